@@ -0,0 +1,476 @@
+# -*- coding: utf-8 -*-
+
+"""
+Бенчмарки Наряд-Заказа (работают без дисплея).
+
+    python bench.py                                  # 1k и 10k компаний, результат в bench_results/
+    python bench.py --companies 1000 100000 --plates-per-company 10
+    python bench.py --only load_companies filter_companies
+    python bench.py --compare bench_results/old.json bench_results/new.json
+
+Синтетические companies.xlsx / price.xlsx / consumables.xlsx генерируются в --data-dir
+(по умолчанию bench_data/) и переиспользуются между запусками с теми же параметрами.
+Результаты сохраняются в JSON, чтобы сравнивать версии между собой.
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from openpyxl import Workbook, load_workbook
+
+import main
+
+BENCH_DIR = Path(__file__).parent
+RESULTS_DIR = BENCH_DIR / "bench_results"
+DEFAULT_DATA_DIR = BENCH_DIR / "bench_data"
+
+# Буквы, допустимые в российских госномерах
+PLATE_LETTERS = "АВЕКМНОРСТУХ"
+NAME_PARTS_1 = ["Транс", "Авто", "Логист", "Грузо", "Строй", "Агро", "Спец", "Мега", "Урал", "Сиб", "Волга", "Нефте"]
+NAME_PARTS_2 = ["логистика", "сервис", "трейд", "техника", "групп", "перевозки", "маш", "ресурс", "комплект", "снаб"]
+FORMS = ["ООО", "АО", "ИП", "ООО ТК", "ПАО"]
+CAR_MODELS = ["", "", "SCANIA S440 ", "Volvo FH ", "КАМАЗ 5490 ", "MAN TGX ", "Genesis GV80 "]
+
+
+# === Генерация синтетических данных ===
+def _random_car_plate(rnd: random.Random) -> str:
+    l = PLATE_LETTERS
+    return f"{rnd.choice(l)}{rnd.randint(1, 999):03d}{rnd.choice(l)}{rnd.choice(l)}{rnd.choice([77, 96, 196, 66, 174, 750])}"
+
+
+def _random_trailer_plate(rnd: random.Random) -> str:
+    l = PLATE_LETTERS
+    return f"Прицеп {rnd.choice(l)}{rnd.choice(l)} {rnd.randint(1, 9999):04d} {rnd.choice([66, 77, 96])}"
+
+
+def _random_company_name(rnd: random.Random, idx: int) -> str:
+    return f"{rnd.choice(NAME_PARTS_1)}{rnd.choice(NAME_PARTS_2)} {idx} {rnd.choice(FORMS)}"
+
+
+def generate_companies_xlsx(path: Path, n_companies: int, plates_per_company: float, seed: int = 1) -> Path:
+    """Файл компаний в формате data/companies.xlsx: Компания / ИНН / Номера / Оплата.
+
+    Общее число номеров ≈ n_companies * plates_per_company, распределение неравномерное:
+    немного крупных парков и много компаний с 1–3 машинами. Около 20% номеров — прицепы.
+    """
+    rnd = random.Random(seed)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append([main.COL_NAME, main.COL_INN, main.COL_PLATES, main.COL_PAY])
+    total_plates = int(n_companies * plates_per_company)
+    # веса по Парето, чтобы крупные парки встречались реже
+    weights = [rnd.paretovariate(1.3) for _ in range(n_companies)]
+    scale = total_plates / sum(weights) if weights else 0
+    for i in range(n_companies):
+        n = max(0, int(round(weights[i] * scale)))
+        plates = []
+        for _ in range(n):
+            plate = _random_trailer_plate(rnd) if rnd.random() < 0.2 else _random_car_plate(rnd)
+            plates.append(rnd.choice(CAR_MODELS) + plate)
+        pay = "да" if rnd.random() < 0.9 else "нет"
+        inn = str(rnd.randint(10**9, 10**10 - 1))
+        ws.append([_random_company_name(rnd, i), inn, ", ".join(plates), pay])
+    wb.save(path)
+    return path
+
+
+def generate_price_xlsx(path: Path, extra_services: int = 100, seed: int = 2) -> Path:
+    """Прайс в формате data/price.xlsx: две строки шапки, далее «услуга | цены грузовых ... | цены легковых ...»."""
+    rnd = random.Random(seed)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    width = 18
+    header1 = [None] * width
+    header1[1] = "Грузовой"
+    header1[9] = "Легковой"
+    ws.append(header1)
+    ws.append(["Тип колёс"] + [f"R{12 + i}" for i in range(width - 1)])
+    names = [main.SERVICE_PRICE_NAME.get(s, s) for s in main.SERVICES]
+    names += [f"Доп. услуга {i}" for i in range(extra_services)]
+    for name in names:
+        row = [name]
+        for _ in range(width - 1):
+            if name in ("Снятие, установка наружное/внутреннее", "Вентиль легковой (хром/черный)"):
+                row.append(f"{rnd.randint(50, 400)}/ {rnd.randint(50, 400)}")
+            else:
+                row.append(rnd.randint(20, 2000))
+        ws.append(row)
+    wb.save(path)
+    return path
+
+
+def generate_consumables_xlsx(path: Path, names_per_kind: int = 40, n_categories: int = 3, seed: int = 3) -> Path:
+    """Расходники в формате data/consumables.xlsx: пары колонок «холодная/горячая» на каждую категорию."""
+    rnd = random.Random(seed)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    cats = [f"Категория {i + 1}" for i in range(n_categories)]
+    header1 = [None, None]
+    header2 = ["Вид", "Наименование"]
+    for c in cats:
+        header1 += [c, None]
+        header2 += ["холодная", "горячая"]
+    ws.append(header1)
+    ws.append(header2)
+    for kind in sorted(set(main.CONSUMABLE_SERVICE_MAP.values())):
+        for i in range(names_per_kind):
+            row = [kind, f"{kind} {i}"]
+            for _ in cats:
+                row += [rnd.randint(100, 5000), rnd.choice([None, rnd.randint(100, 5000)])]
+            ws.append(row)
+    wb.save(path)
+    return path
+
+
+def ensure_dataset(data_dir: Path, n_companies: int, plates_per_company: float) -> dict:
+    """Сгенерировать (или переиспользовать) набор файлов для заданного размера."""
+    tag = f"c{n_companies}_p{plates_per_company:g}"
+    files = {
+        "companies": data_dir / f"companies_{tag}.xlsx",
+        "price": data_dir / "price.xlsx",
+        "consumables": data_dir / "consumables.xlsx",
+    }
+    if not files["companies"].exists():
+        t0 = time.perf_counter()
+        generate_companies_xlsx(files["companies"], n_companies, plates_per_company)
+        print(f"  сгенерирован {files['companies'].name} за {time.perf_counter() - t0:.1f} c")
+    if not files["price"].exists():
+        generate_price_xlsx(files["price"])
+    if not files["consumables"].exists():
+        generate_consumables_xlsx(files["consumables"])
+    return files
+
+
+def sample_order(n_services: int = 20) -> dict:
+    services = {}
+    for i, name in enumerate(main.SERVICES[:n_services]):
+        qty = 1 + i % 4
+        price = 100 + 10 * i
+        services[name] = {"qty": qty, "price": price, "cost": qty * price}
+    return {
+        "customer_display": "Транслогистика 1 ООО",
+        "plate": "А123ВС77",
+        "trailer": "Прицеп ЕА 1626 66",
+        "driver_name": "Иванов Иван Иванович",
+        "defect": "Разрыв по боковине",
+        "issued_to": "Петров",
+        "mechanic": "Сидоров",
+        "vehicle_type": "Грузовой",
+        "services": services,
+    }
+
+
+# === Замеры ===
+def measure(fn, repeat: int = 5, number: int = 1, warmup: int = 1) -> dict:
+    """Вызвать fn() repeat×number раз и вернуть статистику времени одного вызова в секундах."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - t0) / number)
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "max": max(samples),
+        "repeat": repeat,
+        "number": number,
+    }
+
+
+class _Patched:
+    """Временно подменить атрибуты модуля main (пути к данным, конвертеры PDF)."""
+
+    def __init__(self, **attrs):
+        self.attrs = attrs
+        self.saved = {}
+
+    def __enter__(self):
+        for k, v in self.attrs.items():
+            self.saved[k] = getattr(main, k)
+            setattr(main, k, v)
+        return self
+
+    def __exit__(self, *exc):
+        for k, v in self.saved.items():
+            setattr(main, k, v)
+
+
+def _stub_libreoffice(xlsx_path: Path, pdf_path: Path) -> bool:
+    # заглушка конвертера: замеряем только наш путь экспорта, без soffice
+    pdf_path.write_bytes(b"%PDF-1.4\n%stub\n")
+    return True
+
+
+def bench_companies(files: dict, label: str, results: dict, only: set, repeat: int):
+    with _Patched(COMPANIES_XLSX=files["companies"]):
+        if _wanted("load_companies", only):
+            results[f"load_companies[{label}]"] = measure(main.load_companies, repeat=max(1, repeat // 2), warmup=0)
+        companies, visible, _ = main.load_companies()
+    n_plates = sum(len(m.plates) for m in companies.values())
+    print(f"  {label}: компаний {len(companies)}, номеров {n_plates}")
+    if _wanted("plate_index", only):
+        results[f"plate_index_build[{label}]"] = measure(lambda: main.PlateIndex.build(companies), repeat=max(1, repeat // 2), warmup=0)
+    if not _wanted("filter_companies", only) or not visible:
+        return
+    plate_index = main.PlateIndex.build(companies)
+    if _wanted("search_index", only):
+        results[f"search_index_build[{label}]"] = measure(lambda: main.CompanySearchIndex(visible, plate_index), repeat=max(1, repeat // 2), warmup=0)
+    search_index = main.CompanySearchIndex(visible, plate_index)
+    with _Patched(COMPANIES=companies, ALL_COMPANY_NAMES=visible, PLATE_INDEX=plate_index, SEARCH_INDEX=search_index):
+        sample = visible[len(visible) // 2]
+        some_plate = next((m.plates[0] for m in companies.values() if m.plates), "А123")
+        # полный номер в «неудобном» написании: латиница, нижний регистр, пробелы
+        full, _ = main.canonical_plate(some_plate)
+        messy = " ".join(full.translate(str.maketrans("АВЕКМНОРСТУХ", "abekmhopctyx")))
+        queries = {
+            "empty": "",
+            "prefix": sample[:4],
+            "name": sample,
+            "plate": some_plate[-6:],
+            "plate_exact": messy,
+            "typo": "транслогистк",
+            "typo2": "логстика сервс",
+            "miss": "несуществующая компания",
+        }
+        for qname, q in queries.items():
+            results[f"filter_companies[{label},{qname}]"] = measure(lambda q=q: main.filter_companies(q), repeat=repeat)
+
+
+def bench_tables(files: dict, results: dict, only: set, repeat: int):
+    with _Patched(PRICE_XLSX=files["price"], CONSUMABLES_XLSX=files["consumables"]):
+        if _wanted("load_price_table", only):
+            results["load_price_table"] = measure(main.load_price_table, repeat=repeat)
+        if _wanted("load_consumables_table", only):
+            results["load_consumables_table"] = measure(main.load_consumables_table, repeat=repeat)
+
+
+def bench_orders(results: dict, only: set, repeat: int):
+    data = sample_order()
+    if _wanted("make_total_text", only):
+        values = [0, 1, 21, 152, 1999, 34567, 1000001]
+        results["make_total_text"] = measure(lambda: [main.make_total_text(v) for v in values], repeat=repeat, number=20)
+    if _wanted("_write_to_excel", only):
+        wb = load_workbook(main.TEMPLATE_XLSX)
+        ws = wb.active
+        results["_write_to_excel"] = measure(lambda: main._write_to_excel(ws, data), repeat=repeat, number=10)
+    out = Path(tempfile.mkdtemp(prefix="naryad_bench_"))
+    # настоящие счётчик номеров, индекс нарядов и кеш готовых нарядов рабочего места не трогаем
+    real_index = _index_signature()
+    index = main.OrderIndex(out / "orders_index.sqlite")
+    try:
+        with _Patched(OUTPUT_DIR=out, ORDER_NUMBERS=main.OrderNumbers(out / "order_numbers.json"),
+                      ARTIFACTS=main.ArtifactCache(out / "artifacts"), ORDER_INDEX=index):
+            if _wanted("fill_excel_only", only):
+                results["fill_excel_only"] = measure(lambda: main.fill_excel_only(data), repeat=repeat)
+            if _wanted("fill_excel_and_export_pdf", only):
+                with _Patched(export_pdf_via_excel=lambda *a, **k: False, export_pdf_via_libreoffice=_stub_libreoffice):
+                    results["fill_excel_and_export_pdf[stub]"] = measure(lambda: main.fill_excel_and_export_pdf(data), repeat=repeat)
+            if _wanted("reprint", only):
+                with _Patched(export_pdf_via_excel=lambda *a, **k: False, export_pdf_via_libreoffice=_stub_libreoffice):
+                    order = dict(data)
+                    main.fill_excel_and_export_pdf(order)
+                results["reprint[cache_hit]"] = measure(lambda: main.find_reprint(order), repeat=repeat, number=20)
+            if _wanted("export_orders", only):
+                orders = out / "export"
+                orders.mkdir()
+                with _Patched(OUTPUT_DIR=orders):
+                    for i in range(40):
+                        xlsx = main.fill_excel_only(dict(data))
+                        if i % 2:
+                            xlsx.with_suffix(".json").unlink()  # половина — как наряды старых версий, только xlsx
+                target = out / "export.csv"
+                results["export_orders[40]"] = measure(lambda: main.export_orders(target, folder=orders), repeat=repeat)
+    finally:
+        index.close()
+        shutil.rmtree(out, ignore_errors=True)
+    if _index_signature() != real_index:
+        raise AssertionError(f"прогон изменил настоящий индекс нарядов {main.ORDER_INDEX_FILE}")
+
+
+def _index_signature() -> tuple:
+    path = main.ORDER_INDEX_FILE
+    return tuple(main._file_signature(p) for p in (path, path.with_name(path.name + "-wal")))
+
+
+def bench_order_search(results: dict, only: set, repeat: int, n_orders: int = 50000):
+    """Поиск по индексу нарядов: n_orders синтетических нарядов за несколько лет."""
+    if not _wanted("order_search", only):
+        return
+    rnd = random.Random(47)
+    defects = ["Разрыв по боковине", "Порез боковины", "Прокол", "Грыжа", "Износ протектора", "Замена вентиля"]
+    tmp = Path(tempfile.mkdtemp(prefix="naryad_index_"))
+    index = main.OrderIndex(tmp / "orders.sqlite")
+    try:
+        t0 = time.perf_counter()
+        with index.lock:
+            db = index._conn()
+            with db:
+                for i in range(n_orders):
+                    order = sample_order(rnd.randint(1, 6))
+                    day = datetime.date(2022, 1, 1) + datetime.timedelta(days=i * 1500 // n_orders)
+                    order.update(created=day.isoformat(), number=f"{day.year}-{i:06d}",
+                                 customer_display=f"Компания {rnd.randrange(2000)} ООО",
+                                 plate=f"А{rnd.randrange(1000):03d}ВС{rnd.randrange(10, 200)}",
+                                 defect=rnd.choice(defects), driver_name=f"Водитель {rnd.randrange(5000)}")
+                    index._put(db, f"наряд_{i}.xlsx", 0.0, order)
+        print(f"индекс нарядов: {n_orders} за {time.perf_counter() - t0:.1f} с")
+        queries = {
+            "customer": ("компания 123", None, None),
+            "plate": ("a123", None, None),
+            "defect_month": ("боков", "2023-03", "2023-03-99"),
+            "latest": ("", None, None),
+        }
+        for case, (text, lo, hi) in queries.items():
+            results[f"order_search[{case}]"] = measure(lambda: index.search(text, lo, hi), repeat=repeat, number=20)
+        results["order_repeat[last_for_plate]"] = measure(lambda: index.last_for_plate("a 123 bc 77"), repeat=repeat, number=100)
+    finally:
+        index.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _allocate_numbers(args) -> list[int]:
+    path, series, count = args
+    numbers = main.OrderNumbers(Path(path))
+    return [numbers.allocate(series) for _ in range(count)]
+
+
+def bench_order_numbers(results: dict, only: set, processes: int = 8, per_process: int = 250):
+    """Пропускная способность нумерации: processes процессов одновременно берут номера из одного файла.
+
+    Что номера выходят без повторов и пропусков, проверяет tests/test_order_numbers.py.
+    """
+    if not _wanted("order_numbers", only):
+        return
+    tmp = Path(tempfile.mkdtemp(prefix="naryad_numbers_"))
+    try:
+        path = tmp / "order_numbers.json"
+        t0 = time.perf_counter()
+        with multiprocessing.Pool(processes) as pool:
+            chunks = pool.map(_allocate_numbers, [(str(path), "2026", per_process)] * processes)
+        elapsed = time.perf_counter() - t0
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    total = sum(len(chunk) for chunk in chunks)
+    per_call = elapsed / total
+    results["order_numbers"] = {
+        "min": per_call, "median": per_call, "mean": per_call, "max": per_call,
+        "repeat": 1, "number": total, "processes": processes, "per_second": total / elapsed,
+    }
+    print(f"нумерация: {total} номеров в {processes} процессах за {elapsed:.2f} с ({total / elapsed:.0f}/с)")
+
+
+def _wanted(name: str, only: set) -> bool:
+    return not only or name in only
+
+
+def _git_revision() -> str:
+    try:
+        res = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True)
+        return res.stdout.strip()
+    except Exception:
+        return ""
+
+
+def run(args) -> dict:
+    data_dir = Path(args.data_dir)
+    only = set(args.only or [])
+    results = {}
+    shared = None
+    for n in args.companies:
+        files = ensure_dataset(data_dir, n, args.plates_per_company)
+        shared = files
+        bench_companies(files, f"{n}", results, only, args.repeat)
+    if shared is None:
+        shared = ensure_dataset(data_dir, 0, 0)
+    bench_tables(shared, results, only, args.repeat)
+    bench_orders(results, only, args.repeat)
+    bench_order_numbers(results, only)
+    bench_order_search(results, only, args.repeat)
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "revision": _git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "companies": args.companies,
+            "plates_per_company": args.plates_per_company,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+
+# === Сравнение двух прогонов ===
+def compare(old_path: Path, new_path: Path, threshold: float) -> int:
+    old = json.loads(Path(old_path).read_text(encoding="utf-8"))["results"]
+    new = json.loads(Path(new_path).read_text(encoding="utf-8"))["results"]
+    regressions = 0
+    width = max((len(k) for k in new), default=10)
+    print(f"{'случай':<{width}}  {'было, мс':>10}  {'стало, мс':>10}  {'×':>6}")
+    for key in sorted(set(old) | set(new)):
+        if key not in old or key not in new:
+            side = "только в новом" if key in new else "только в старом"
+            print(f"{key:<{width}}  {side}")
+            continue
+        a = old[key]["median"] * 1000
+        b = new[key]["median"] * 1000
+        ratio = b / a if a else float("inf")
+        mark = ""
+        if ratio > 1 + threshold:
+            mark = "  РЕГРЕССИЯ"
+            regressions += 1
+        print(f"{key:<{width}}  {a:>10.3f}  {b:>10.3f}  {ratio:>6.2f}{mark}")
+    return 1 if regressions else 0
+
+
+def print_results(report: dict):
+    res = report["results"]
+    width = max((len(k) for k in res), default=10)
+    for key, st in res.items():
+        print(f"{key:<{width}}  median {st['median'] * 1000:10.3f} мс   min {st['min'] * 1000:10.3f} мс")
+
+
+def main_cli(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Бенчмарки Наряд-Заказа")
+    ap.add_argument("--companies", type=int, nargs="+", default=[1000, 10000], help="размеры справочника компаний")
+    ap.add_argument("--plates-per-company", type=float, default=10, help="среднее число номеров на компанию")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--only", nargs="*", help="запустить только указанные случаи")
+    ap.add_argument("--data-dir", default=str(DEFAULT_DATA_DIR))
+    ap.add_argument("--out", help="куда сохранить JSON (по умолчанию bench_results/bench_<время>.json)")
+    ap.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="сравнить два JSON с результатами")
+    ap.add_argument("--threshold", type=float, default=0.15, help="допустимое замедление при сравнении (0.15 = 15%%)")
+    args = ap.parse_args(argv)
+
+    if args.compare:
+        return compare(Path(args.compare[0]), Path(args.compare[1]), args.threshold)
+
+    report = run(args)
+    print_results(report)
+    out = Path(args.out) if args.out else RESULTS_DIR / f"bench_{datetime.datetime.now():%Y%m%d_%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Результаты: {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -10,15 +10,39 @@
 - Компании в списках идут в том же порядке, что и в файле; новые добавляются В КОНЕЦ.
 """
 
+import time
+_PROCESS_T0 = time.perf_counter()  # отсчёт для замера «время до первой отрисовки окна»
+
 import os
+import sys
+import re
+import io
+import csv
+import json
+import shutil
+import hashlib
+import array
+import bisect
 import datetime
+import functools
+import threading
+import queue
+import select
+import sqlite3
 import subprocess
+import collections
+import contextlib
+import concurrent.futures
+import logging
+import logging.handlers
 from pathlib import Path
 import tkinter as tk
-from tkinter import BOTH, LEFT, RIGHT, Y, X, NW, DISABLED, NORMAL, messagebox, simpledialog
+from tkinter import BOTH, LEFT, RIGHT, Y, X, NW, DISABLED, NORMAL, messagebox, simpledialog, filedialog
 from tkinter import ttk
 
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell.cell import MergedCell
+from openpyxl.utils.cell import column_index_from_string, coordinate_to_tuple, get_column_letter
 from num2words import num2words
 import pandas as pd
 import ttkbootstrap as tb
@@ -35,6 +59,9 @@ PRICE_XLSX = DATA_DIR / "price.xlsx"
 CONSUMABLES_XLSX = DATA_DIR / "consumables.xlsx"
 
 
+# Данные конкретного рабочего места (метрики, черновики и т.п.) — не в общей папке data
+LOCAL_DIR = Path(os.environ.get("NARYAD_LOCAL_DIR") or Path(os.environ.get("LOCALAPPDATA") or Path.home() / ".local" / "share") / "naryad")
+
 OUTPUT_DIR.mkdir(exist_ok=True, parents=True)
 TEMPLATES_DIR.mkdir(exist_ok=True, parents=True)
 DATA_DIR.mkdir(exist_ok=True, parents=True)
@@ -43,6 +70,144 @@ DATA_DIR.mkdir(exist_ok=True, parents=True)
 if not COMPANIES_XLSX.exists():
     pd.DataFrame(columns=["Компания", "ИНН", "Номера", "Оплата"]).to_excel(COMPANIES_XLSX, index=False)
 
+# === Метрики (замеры горячих путей) ===
+# Включаются переменной окружения NARYAD_METRICS=1 или галочкой во вкладке «Диагностика».
+# В выключенном состоянии span() возвращает общий пустой контекст, а timed() — одну проверку флага.
+METRICS_FILE = LOCAL_DIR / "metrics" / "metrics.jsonl"
+METRICS_MAX_BYTES = 1_000_000
+METRICS_BACKUPS = 3
+
+
+def _percentile(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("metrics", "name", "t0")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.t0)
+        return False
+
+
+class Metrics:
+    def __init__(self, path: Path, enabled: bool = False, keep: int = 2000):
+        self.path = path
+        self.enabled = enabled
+        self.recent = collections.deque(maxlen=keep)  # (время, имя замера, секунды)
+        self.cache_stats = collections.defaultdict(lambda: [0, 0])  # имя кэша -> [попадания, промахи]
+        self._lock = threading.Lock()
+        self._logger = None
+
+    def span(self, name: str):
+        return _Span(self, name) if self.enabled else _NULL_SPAN
+
+    def timed(self, name: str):
+        def deco(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                t0 = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - t0)
+            return wrapper
+        return deco
+
+    def cache(self, name: str, hit: bool):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.cache_stats[name][0 if hit else 1] += 1
+
+    def record(self, name: str, seconds: float):
+        ts = time.time()
+        with self._lock:
+            self.recent.append((ts, name, seconds))
+        try:
+            self._file_logger().info(json.dumps({"ts": round(ts, 3), "span": name, "ms": round(seconds * 1000, 3)}, ensure_ascii=False))
+        except Exception:
+            pass  # метрики не должны ломать работу
+
+    def _file_logger(self):
+        if self._logger is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            logger = logging.getLogger("naryad.metrics")
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            handler = logging.handlers.RotatingFileHandler(self.path, maxBytes=METRICS_MAX_BYTES, backupCount=METRICS_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            self._logger = logger
+        return self._logger
+
+    def summary(self) -> dict[str, dict]:
+        """Сводка по последним замерам: имя -> {count, p50, p95, last} (в миллисекундах)."""
+        with self._lock:
+            items = list(self.recent)
+        return summarize_spans((name, sec) for _, name, sec in items)
+
+    def cache_summary(self) -> dict[str, tuple[int, int, float]]:
+        with self._lock:
+            stats = {k: tuple(v) for k, v in self.cache_stats.items()}
+        return {k: (h, m, (h / (h + m) if h + m else 0.0)) for k, (h, m) in stats.items()}
+
+
+def summarize_spans(spans) -> dict[str, dict]:
+    by_name = collections.defaultdict(list)
+    for name, sec in spans:
+        by_name[name].append(sec * 1000)
+    res = {}
+    for name, values in by_name.items():
+        last = values[-1]
+        values.sort()
+        res[name] = {"count": len(values), "p50": _percentile(values, 50), "p95": _percentile(values, 95), "last": last}
+    return res
+
+
+def summarize_metrics_file(path: Path = METRICS_FILE) -> dict[str, dict]:
+    """Сводка p50/p95 по файлу метрик вместе с его ротированными копиями."""
+    files = [Path(f"{path}.{i}") for i in range(METRICS_BACKUPS, 0, -1)] + [path]
+    spans = []
+    for f in files:
+        if not f.exists():
+            continue
+        with open(f, encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    rec = json.loads(line)
+                    spans.append((rec["span"], rec["ms"] / 1000))
+                except Exception:
+                    continue
+    return summarize_spans(spans)
+
+
+METRICS = Metrics(METRICS_FILE, enabled=os.environ.get("NARYAD_METRICS", "").strip().lower() in ("1", "да", "yes", "true"))
+
 # === Ячейки шаблона ===
 CELL_CUSTOMER = "I5"
 CELL_PLATE = "G6"
@@ -52,6 +217,7 @@ CELL_DEFECT_LINE1 = "Y8"
 CELL_DEFECT_LINE2 = "A9"
 CELL_ISSUED_TO = "N10"
 CELL_DATE = "CG4"
+CELL_ORDER_NUMBER = "Z3"  # поле справа от «НАРЯД-ЗАКАЗ №» (объединённая Z3:AO4)
 # Итоговые суммы и подписи
 CELL_TOTAL_NUM = "BR47"
 CELL_TOTAL_TEXT = "A49"
@@ -126,39 +292,135 @@ COL_NAME = "Компания"
 COL_INN = "ИНН"
 COL_PLATES = "Номера"
 COL_PAY = "Оплата"
+COL_ID = "ID"  # постоянный номер компании — на него ссылается лист «Номера»
+COMPANY_COLUMNS = [COL_NAME, COL_INN, COL_PLATES, COL_PAY, COL_ID]
+COMPANIES_SHEET = "Компании"  # первый лист — его читают и старые версии программы
+PLATES_SHEET = "Номера"       # по строке на номер: ID компании, номер, тип, дата добавления
+PLATE_SHEET_COLUMNS = ["ID компании", "Номер", "Тип", "Добавлен"]
+PLATE_KIND_TITLES = {"car": "машина", "trailer": "прицеп"}
 
-def _normalize_company_df(df: pd.DataFrame) -> pd.DataFrame:
+COMPANY_HEADER_SCAN_ROWS = 10  # строка заголовка ищется среди первых строк листа (над ней бывает пусто)
+
+
+def _company_column(header) -> str | None:
+    """Стандартное имя столбца (COL_*) по заголовку из файла; None — столбец не наш."""
     # Поддержка разных заголовков (включая варианты вроде "Оплата (да/нет)")
-    mapping = {}
-    for col in df.columns:
-        v = str(col).strip().lower()
-        if v in ("компания", "название", "организация", "контрагент", "company", "name"):
-            mapping[col] = COL_NAME
-        elif v in ("инн", "inn"):
-            mapping[col] = COL_INN
-        elif v in ("номера", "госномер", "госномера", "машины", "авто", "plates", "cars"):
-            mapping[col] = COL_PLATES
-        elif ("оплат" in v) or v in ("оплата", "опл", "pay", "payment"):
-            mapping[col] = COL_PAY
+    v = str(header).strip().lower()
+    if v in ("компания", "название", "организация", "контрагент", "контрагенты", "company", "name"):
+        return COL_NAME
+    if v in ("инн", "inn"):
+        return COL_INN
+    if v in ("номера", "госномер", "госномера", "машины", "авто", "plates", "cars") or v.startswith("гос. номер"):
+        return COL_PLATES
+    if ("оплат" in v) or v in ("оплата", "опл", "pay", "payment"):
+        return COL_PAY
+    if v in ("id", "код"):
+        return COL_ID
+    return None
+
+def _normalize_company_df(df: pd.DataFrame) -> pd.DataFrame:
+    mapping = {col: std for col in df.columns if (std := _company_column(col))}
     df2 = df.rename(columns=mapping).copy()
-    for c in (COL_NAME, COL_INN, COL_PLATES, COL_PAY):
+    for c in COMPANY_COLUMNS:
         if c not in df2.columns:
             df2[c] = ""
-    df2 = df2[[COL_NAME, COL_INN, COL_PLATES, COL_PAY]]
-    for c in (COL_NAME, COL_INN, COL_PLATES, COL_PAY):
+    df2 = df2[COMPANY_COLUMNS]
+    for c in COMPANY_COLUMNS:
         df2[c] = df2[c].astype(str).fillna("").str.strip()
+    _assign_company_ids(df2)
     return df2
 
-def read_companies_df() -> pd.DataFrame:
+def _assign_company_ids(df: pd.DataFrame):
+    """Проставить недостающие и повторные ID (новые строки, файл старого формата, строки, скопированные в Excel)."""
+    ids = pd.to_numeric(df[COL_ID], errors="coerce")
+    missing = ids.isna() | ids.duplicated()
+    if missing.any():
+        start = int(ids[~missing].max()) + 1 if (~missing).any() else 1
+        ids[missing] = list(range(start, start + int(missing.sum())))
+    df[COL_ID] = ids.astype(int).astype(str)
+
+def _cell_text(value) -> str:
+    """Значение ячейки как текст — так же, как его давал read_excel(dtype=str): 6658476128, а не 6658476128.0."""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+def _read_company_sheet(rows) -> pd.DataFrame:
+    """Лист компаний из потока строк openpyxl (values_only): заголовок ищется, пустые строки пропускаются."""
+    positions = {}
+    for _, row in zip(range(COMPANY_HEADER_SCAN_ROWS), rows):
+        for i, header in enumerate(row):
+            std = _company_column(header) if header is not None else None
+            if std and std not in positions:
+                positions[std] = i
+        if COL_NAME in positions:
+            break
+        positions = {}
+    cols = {c: [] for c in COMPANY_COLUMNS}
+    if positions:
+        for row in rows:
+            values = [_cell_text(row[i]) if i < len(row) else "" for i in positions.values()]
+            if any(values):
+                for c, v in zip(positions, values):
+                    cols[c].append(v)
+                for c in COMPANY_COLUMNS:
+                    if c not in positions:
+                        cols[c].append("")
+    df = pd.DataFrame(cols, columns=COMPANY_COLUMNS)
+    _assign_company_ids(df)
+    return df
+
+def _read_companies_xlsx(with_plates: bool) -> tuple[pd.DataFrame, "PlateTable"]:
+    # Потоковое чтение openpyxl (read_only): ячейки не держатся в памяти всем листом,
+    # и нет промежуточного DataFrame на каждый лист.
     try:
-        df = pd.read_excel(COMPANIES_XLSX, dtype=str)
+        wb = load_workbook(COMPANIES_XLSX, read_only=True, data_only=True)
     except Exception:
-        df = pd.DataFrame(columns=[COL_NAME, COL_INN, COL_PLATES, COL_PAY])
-    return _normalize_company_df(df)
+        return pd.DataFrame(columns=COMPANY_COLUMNS), PlateTable()
+    try:
+        df = _read_company_sheet(wb.worksheets[0].iter_rows(values_only=True))
+        plates = PlateTable()
+        if with_plates and PLATES_SHEET in wb.sheetnames:
+            plates = PlateTable.from_rows(wb[PLATES_SHEET].iter_rows(values_only=True))
+    finally:
+        wb.close()
+    return df, plates
+
+def read_companies_df() -> pd.DataFrame:
+    return _read_companies_xlsx(with_plates=False)[0]
+
+def read_companies_book() -> tuple[pd.DataFrame, "PlateTable"]:
+    """Лист компаний и лист «Номера» (в файлах старого формата его нет — тогда таблица пустая)."""
+    return _read_companies_xlsx(with_plates=True)
 
 def write_companies_df(df: pd.DataFrame):
-    # Сохраняем как есть, без сортировки — чтобы новые компании были в конце
-    df.to_excel(COMPANIES_XLSX, index=False)
+    """Сохранить справочник: лист компаний как есть и лист «Номера», собранный по ячейкам.
+
+    Новым строкам df проставляются ID (прямо в df); таблица номеров в памяти (PLATES) заменяется записанной.
+    """
+    global PLATES
+    # Сохраняем как есть, без сортировки — чтобы новые компании были в конце.
+    _assign_company_ids(df)
+    plates = reconcile_plates(df[COL_ID], df[COL_PLATES], PLATES)
+    # Пишем во временный файл и подменяем целиком: оборванная запись не портит справочник.
+    # write_only: строки уходят в файл по мере добавления, без объекта на каждую ячейку.
+    tmp = COMPANIES_XLSX.with_name(f".{COMPANIES_XLSX.stem}.tmp.xlsx")
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(COMPANIES_SHEET)
+    ws.append([str(c) for c in df.columns])
+    # ID — числом: такие ячейки и Excel, и чтение разбирают быстрее строковых
+    for row in zip(*(list(map(int, df[c])) if c == COL_ID else df[c].tolist() for c in df.columns)):
+        ws.append(row)
+    ws = wb.create_sheet(PLATES_SHEET)
+    ws.append(PLATE_SHEET_COLUMNS)
+    for row in plates.rows():
+        ws.append(row)
+    wb.save(tmp)
+    os.replace(tmp, COMPANIES_XLSX)
+    _note_own_write(COMPANIES_XLSX)  # свою запись наблюдатель за папкой не перечитывает
+    PLATES = plates
 
 def parse_plates(cell_value: str) -> list[str]:
     return [p.strip() for p in str(cell_value).split(",") if p.strip()]
@@ -166,148 +428,999 @@ def parse_plates(cell_value: str) -> list[str]:
 def join_plates(plates: list[str]) -> str:
     return ", ".join(sorted(set([p.strip() for p in plates if p.strip()])))
 
-def load_companies() -> tuple[dict, list[str]]:
-    df = read_companies_df()
+
+PlateRecord = collections.namedtuple("PlateRecord", "company_id plate kind added")
+PLATE_KINDS = ("car", "trailer")  # код типа в PlateTable — индекс в этом кортеже
+PAY_YES = ("да", "yes", "true", "1")
+
+
+def _plate_record_key(rec) -> tuple[int, str]:
+    return rec[0], rec[1]
+
+
+def plate_kind(plate: str) -> str:
+    return "trailer" if is_trailer_plate(plate) else "car"
+
+
+class Company:
+    """Запись справочника. Номера — один кортеж: сначала машины, потом прицепы; cars/trailers — срезы."""
+
+    __slots__ = ("id", "name", "inn", "pay", "plates", "n_cars")
+
+    def __init__(self, id: int, name: str, inn: str = "", pay: str = "", plates: tuple = (), n_cars: int | None = None):
+        self.id = id
+        self.name = name
+        self.inn = inn
+        self.pay = pay
+        self.plates = tuple(plates)
+        self.n_cars = len(self.plates) if n_cars is None else n_cars
+
+    @property
+    def cars(self) -> tuple:
+        return self.plates[:self.n_cars]
+
+    @property
+    def trailers(self) -> tuple:
+        return self.plates[self.n_cars:]
+
+    @property
+    def visible(self) -> bool:
+        return self.pay in PAY_YES
+
+    def __repr__(self) -> str:
+        return f"Company({self.id}, {self.name!r}, inn={self.inn!r}, pay={self.pay!r}, plates={self.plates!r})"
+
+
+class PlateTable:
+    """Все номера справочника, отсортированные по (ID компании, номер), — четыре столбца вместо объекта на номер.
+
+    Номера одной компании лежат подряд, поэтому диапазон компании, вставка и удаление номера
+    находятся бинарным поиском, а ячейка «Номера» собирается без пересортировки.
+    Строки номеров и дат интернированы: карточка компании ссылается на те же объекты.
+    """
+
+    def __init__(self, records=()):
+        unique = {}
+        for rec in records:
+            unique.setdefault(_plate_record_key(rec), rec)
+        self._set_rows(sorted((cid, plate, PLATE_KINDS.index(kind), added) for cid, plate, kind, added in unique.values()))
+
+    def _set_rows(self, rows):
+        """rows — отсортированные кортежи (ID, номер, код типа, дата) без повторов."""
+        self._cid = array.array("q", [r[0] for r in rows])
+        self._plate = [sys.intern(r[1]) for r in rows]
+        self._kind = bytearray(r[2] for r in rows)
+        self._added = [sys.intern(r[3]) for r in rows]
+
+    @classmethod
+    def _from_rows(cls, rows) -> "PlateTable":
+        table = cls.__new__(cls)
+        # Лист, записанный программой, уже отсортирован и без повторов — тогда без словаря и сортировки.
+        if any((a[0], a[1]) >= (b[0], b[1]) for a, b in zip(rows, rows[1:])):
+            rows = sorted(dict(((r[0], r[1]), r) for r in reversed(rows)).values())  # повтор — остаётся первая запись
+        table._set_rows(rows)
+        return table
+
+    def __len__(self) -> int:
+        return len(self._plate)
+
+    def _record(self, i: int) -> PlateRecord:
+        return PlateRecord(self._cid[i], self._plate[i], PLATE_KINDS[self._kind[i]], self._added[i])
+
+    @property
+    def records(self) -> list[PlateRecord]:
+        return [self._record(i) for i in range(len(self))]
+
+    def _range(self, company_id: int) -> tuple[int, int]:
+        return bisect.bisect_left(self._cid, company_id), bisect.bisect_right(self._cid, company_id)
+
+    def _find(self, company_id: int, plate: str) -> tuple[int, bool]:
+        lo, hi = self._range(company_id)
+        i = bisect.bisect_left(self._plate, plate, lo, hi)
+        return i, i < hi and self._plate[i] == plate
+
+    def spans(self) -> dict[int, tuple[int, int]]:
+        """ID компании -> диапазон её номеров, за один проход."""
+        out, cids, lo = {}, self._cid, 0
+        while lo < len(cids):
+            hi = bisect.bisect_right(cids, cids[lo], lo)
+            out[cids[lo]] = (lo, hi)
+            lo = hi
+        return out
+
+    def company_plates(self, lo: int, hi: int) -> tuple[tuple, int]:
+        """Номера диапазона в порядке Company.plates (машины, потом прицепы) и число машин."""
+        plates, kinds = self._plate[lo:hi], self._kind[lo:hi]
+        if 1 not in kinds:
+            return tuple(plates), len(plates)
+        cars = [p for p, k in zip(plates, kinds) if not k]
+        return tuple(cars) + tuple(p for p, k in zip(plates, kinds) if k), len(cars)
+
+    def for_company(self, company_id: int) -> list[PlateRecord]:
+        lo, hi = self._range(company_id)
+        return [self._record(i) for i in range(lo, hi)]
+
+    def cell(self, company_id: int) -> str:
+        lo, hi = self._range(company_id)
+        return ", ".join(self._plate[lo:hi])
+
+    def add(self, company_id: int, plate: str, kind: str | None = None, added: str | None = None) -> bool:
+        plate = plate.strip()
+        i, found = self._find(company_id, plate)
+        if not plate or found:
+            return False
+        self._cid.insert(i, company_id)
+        self._plate.insert(i, sys.intern(plate))
+        self._kind.insert(i, PLATE_KINDS.index(kind or plate_kind(plate)))
+        self._added.insert(i, sys.intern(added or datetime.date.today().isoformat()))
+        return True
+
+    def remove(self, company_id: int, plate: str) -> bool:
+        i, found = self._find(company_id, plate)
+        if found:
+            for col in (self._cid, self._plate, self._kind, self._added):
+                del col[i]
+        return found
+
+    @classmethod
+    def from_rows(cls, rows) -> "PlateTable":
+        """Таблица из строк листа «Номера» (первая — заголовок), как их отдаёт iter_rows(values_only=True)."""
+        rows = iter(rows)
+        header = [_cell_text(v) for v in next(rows, ())]
+        pos = [header.index(c) if c in header else None for c in PLATE_SHEET_COLUMNS]
+        out = []
+        for row in rows:
+            cid, plate, kind, added = (_cell_text(row[i]) if i is not None and i < len(row) else "" for i in pos)
+            try:
+                cid = int(float(cid))
+            except ValueError:
+                continue
+            if plate:
+                out.append((cid, plate, 1 if kind.lower() == "прицеп" else 0, added))
+        return cls._from_rows(out)
+
+    def rows(self):
+        """Строки листа «Номера» без заголовка."""
+        titles = [PLATE_KIND_TITLES[k] for k in PLATE_KINDS]
+        return zip(self._cid, self._plate, (titles[k] for k in self._kind), self._added)
+
+
+def reconcile_plates(ids, cells, known: PlateTable) -> PlateTable:
+    """Таблица номеров по ячейкам «Номера»: состав берётся из ячейки (её могли поправить в Excel),
+    тип и дата добавления — из known для номеров, которые там уже были."""
+    today = datetime.date.today().isoformat()
+    had = dict(zip(zip(known._cid, known._plate), range(len(known))))
+    rows = []
+    for cid, cell in zip(ids, cells):
+        cid = int(cid)
+        for plate in parse_plates(cell):
+            i = had.get((cid, plate))
+            if i is None:
+                rows.append((cid, plate, 1 if is_trailer_plate(plate) else 0, today))
+            else:
+                rows.append((cid, plate, known._kind[i], known._added[i]))
+    return PlateTable._from_rows(rows)
+
+
+def company_from_row(row, plates: PlateTable | None = None) -> tuple[str, Company]:
+    """Строка таблицы компаний -> (название, запись справочника); номера — из таблицы номеров."""
+    table = PLATES if plates is None else plates
+    cid = int(row[COL_ID])
+    company_plates, n_cars = table.company_plates(*table._range(cid))
+    return row[COL_NAME], Company(cid, row[COL_NAME], row[COL_INN], sys.intern(str(row[COL_PAY]).strip().lower()),
+                                  company_plates, n_cars)
+
+@METRICS.timed("load.companies")
+def load_companies() -> tuple[dict, list[str], PlateTable]:
+    df, sheet = read_companies_book()
+    plates = reconcile_plates(df[COL_ID], df[COL_PLATES], sheet)
+    spans = plates.spans()
+    pays = [sys.intern(p) for p in df[COL_PAY].str.strip().str.lower()]
     companies = {}
     visible_names = []
-    for _, row in df.iterrows():  # сохраняем порядок строк
-        name = row[COL_NAME]
-        inn = row[COL_INN]
-        plates_all = parse_plates(row[COL_PLATES])
-        cars = [p for p in plates_all if not p.lower().startswith("прицеп")]
-        trailers = [p for p in plates_all if p.lower().startswith("прицеп")]
-        pay = str(row[COL_PAY]).strip().lower()
+    # Столбцами, а не iterrows: на 100 тыс. строк Series на строку — основная часть времени загрузки.
+    for name, inn, cid, pay in zip(df[COL_NAME].tolist(), df[COL_INN].tolist(), df[COL_ID].tolist(), pays):  # сохраняем порядок строк
         if name:
-            companies[name] = {
-                "inn": inn,
-                "plates": plates_all,
-                "cars": cars,
-                "trailers": trailers,
-                "pay": pay,
-            }
-            if pay in ("да","yes","true","1"):
+            cid = int(cid)
+            company_plates, n_cars = plates.company_plates(*spans.get(cid, (0, 0)))
+            companies[name] = Company(cid, name, inn, pay, company_plates, n_cars)
+            if pay in PAY_YES:
                 visible_names.append(name)
-    return companies, visible_names
+    return companies, visible_names, plates
+
+# === Нормализация госномеров ===
+# Латинские буквы, которые на номерах выглядят как кириллические
+_PLATE_HOMOGLYPHS = str.maketrans("ABEKMHOPCTYX", "АВЕКМНОРСТУХ")
+_PLATE_LETTERS = "АВЕКМНОРСТУХ"
+_PLATE_TO_LATIN = str.maketrans(_PLATE_LETTERS, "ABEKMHOPCTYX")
+_RE_PLATE_JUNK = re.compile(r"[^0-9A-ZА-ЯЁ]+")
+_RE_PLATE_CAR = re.compile(rf"[{_PLATE_LETTERS}]\d{{3}}[{_PLATE_LETTERS}]{{2}}(\d{{2,3}})")
+_RE_PLATE_TRAILER = re.compile(rf"[{_PLATE_LETTERS}]{{2}}\d{{4}}(\d{{2,3}})")
+_RE_PLATE_COUNTRY = re.compile(r"(?:RUS|РУС)$")
+
+PlateRef = collections.namedtuple("PlateRef", "company role plate")  # role: "car" | "trailer"
+
+
+def _plate_compact(text: str) -> str:
+    """Верхний регистр, латиница → кириллица, без пробелов, дефисов и прочих разделителей."""
+    return _RE_PLATE_JUNK.sub("", str(text).upper()).translate(_PLATE_HOMOGLYPHS)
+
+
+def is_trailer_plate(text: str) -> bool:
+    return str(text).strip().lower().startswith("прицеп")
+
+
+def canonical_plate(text: str) -> tuple[str, str]:
+    """Канонический вид номера и он же без кода региона.
+
+    «А123ВС77», «a 123 bc 77», «A123BC 77 RUS» → ("А123ВС77", "А123ВС");
+    «Прицеп ЕА 1626 66» → ("ЕА162666", "ЕА1626"). Если в тексте есть марка машины
+    («SCANIA S440 М332КР196»), берётся последнее совпадение с форматом номера.
+    Номера нестандартного вида возвращаются как есть в компактной форме.
+    """
+    compact = _plate_compact(text)
+    if compact.startswith("ПРИЦЕП"):
+        compact = compact[6:]
+    compact = _RE_PLATE_COUNTRY.sub("", compact)
+    for rx in (_RE_PLATE_CAR, _RE_PLATE_TRAILER):
+        m = rx.fullmatch(compact)  # обычный случай: в ячейке только номер
+        if m is None:
+            for m in rx.finditer(compact):
+                pass
+        if m is not None:
+            return m.group(0), m.group(0)[: m.start(1) - m.start(0)]
+    return compact, compact
+
+
+class PlateIndex:
+    """Хэш-индекс «канонический номер → компания и роль (машина/прицеп)»."""
+
+    def __init__(self):
+        self.exact: dict[str, PlateRef] = {}
+        self.base: dict[str, PlateRef | None] = {}  # номер без региона; None — неоднозначно
+        # компания -> строки для поиска по подстроке: канонические номера и остаток текста
+        # ячейки без самих номеров (марки машин, «прицеп») — без повторов
+        self.canon_blob: dict[str, str] = {}
+        self.extra_blob: dict[str, str] = {}
+
+    @classmethod
+    @METRICS.timed("index.plates")
+    def build(cls, companies: dict) -> "PlateIndex":
+        idx = cls()
+        for name, meta in companies.items():
+            idx.add_company(name, meta.plates)
+        return idx
+
+    def add_company(self, company: str, plates: list[str]):
+        self.canon_blob[company] = self.extra_blob[company] = ""
+        self.add_plates(company, plates)
+
+    def add_plates(self, company: str, plates: list[str]):
+        """Дописать номера компании; уже проиндексированные номера повторно не разбираются."""
+        canon_all = [self.canon_blob[company]] if self.canon_blob.get(company) else []
+        extra = set(self.extra_blob.get(company, "").split())
+        for plate in plates:
+            full, base = canonical_plate(plate)
+            if not full:
+                continue
+            canon_all.append(full)
+            for word in plate.lower().split():
+                if _plate_compact(word) not in full:
+                    extra.add(word)
+            ref = PlateRef(company, "trailer" if is_trailer_plate(plate) else "car", plate)
+            self.exact.setdefault(full, ref)
+            if base != full:
+                prev = self.base.get(base, ref)
+                self.base[base] = ref if prev is not None and prev.company == company else None
+        self.canon_blob[company] = "\n".join(canon_all)
+        self.extra_blob[company] = " ".join(sorted(extra))
+
+    def remove_company(self, company: str):
+        self.extra_blob.pop(company, None)
+        for full in self.canon_blob.pop(company, "").split("\n"):
+            if not full:
+                continue
+            if getattr(self.exact.get(full), "company", None) == company:
+                del self.exact[full]
+            base = canonical_plate(full)[1]
+            # неоднозначный (None) номер без региона так и оставляем: кто ещё им владеет, здесь не видно,
+            # а None лишь отправляет запрос в обычный поиск
+            if getattr(self.base.get(base), "company", None) == company:
+                del self.base[base]
+
+    def lookup(self, text: str) -> PlateRef | None:
+        """Найти владельца по полному номеру (в любом написании). None — если номер не найден."""
+        full, base = canonical_plate(text)
+        if len(full) < 6:
+            return None
+        ref = self.exact.get(full)
+        if ref is None and full == base:
+            ref = self.base.get(base)
+        return ref
+
+
+# === Поиск компаний ===
+_RE_NAME_JUNK = re.compile(r"[^0-9a-zа-я]+")
+FUZZY_MIN_LEN = 4  # короче — только точные совпадения подстроки
+
+
+def normalize_company_name(name: str) -> str:
+    """Нижний регистр, ё → е, кавычки и знаки препинания → пробел."""
+    return _RE_NAME_JUNK.sub(" ", str(name).lower().replace("ё", "е")).strip()
+
+
+def _fuzzy_budget(word: str) -> int:
+    # сколько опечаток допускаем в слове запроса
+    n = len(word)
+    return 0 if n < FUZZY_MIN_LEN else (1 if n <= 7 else 2)
+
+
+class CompanySearchIndex:
+    """Индекс для поиска компаний: префикс > подстрока (в названии или номерах) > нечёткое совпадение.
+
+    Названия и номера склеены в две большие строки, поэтому проверка подстроки — это несколько
+    вызовов str.find вместо цикла по всем компаниям. Для опечаток слова названий разложены в
+    префиксное дерево, по которому идёт ограниченный поиск расстояния Левенштейна: «Транслогистк»
+    находит «Транслогистика» (запрос в пределах k правок от префикса слова).
+    """
+
+    _END = ""  # ключ узла дерева, под которым лежит само слово
+
+    def __init__(self, names: list[str], plates: PlateIndex):
+        self.names = list(names)
+        self._pos = {n: i for i, n in enumerate(self.names)}
+        self._dead: set[int] = set()  # позиции удалённых записей (см. remove)
+        # место в порядке файла — им разрешаются равные ярусы; у убранных записей остаётся до перестройки
+        self._rank = [float(i) for i in range(len(self.names))]
+        self._rank_of = dict(zip(self.names, self._rank))
+        norm = [normalize_company_name(n) for n in self.names]
+        self._names_text, self._names_starts = self._concat(norm, "\x1f")
+        # номера — в латинице и байтах: так строка однобайтовая и str.find по ней вдвое быстрее
+        self._canon_text, self._canon_starts = self._concat([self._canon_bytes(plates, n) for n in self.names], b"\x1f")
+        self._extra_text, self._extra_starts = self._concat([plates.extra_blob.get(n, "") for n in self.names], "\x1f")
+        self._token_names: dict[str, list[int]] = collections.defaultdict(list)
+        self._trie: dict = {}
+        for i, n in enumerate(norm):
+            self._add_tokens(i, n)
+
+    @staticmethod
+    def _canon_bytes(plates: PlateIndex, name: str) -> bytes:
+        return plates.canon_blob.get(name, "").translate(_PLATE_TO_LATIN).encode("utf-8")
+
+    def _add_tokens(self, i: int, norm_name: str):
+        for tok in set(norm_name.split()):
+            if len(tok) >= 3 and not tok.isdigit():
+                if tok not in self._token_names:
+                    node = self._trie
+                    for ch in tok:
+                        node = node.setdefault(ch, {})
+                    node[self._END] = tok
+                self._token_names[tok].append(i)
+
+    @staticmethod
+    def _concat(parts: list, sep) -> tuple:
+        starts = []
+        pos = 0
+        for p in parts:
+            starts.append(pos)
+            pos += len(p) + 1
+        return sep.join(parts), starts
+
+    @staticmethod
+    def _append(text, starts: list[int], part, sep):
+        starts.append(len(text) + 1 if starts else 0)
+        return text + sep + part if len(starts) > 1 else part
+
+    def _rank_in(self, name: str, order: list[str] | None) -> float:
+        """Место для компании, которой ещё не было в индексе: между соседями по order."""
+        end = self._rank[-1] + 1 if self._rank else 0.0
+        if not order:
+            return end
+        nxt = None
+        for k in range(len(order) - 1, -1, -1):  # новые компании — в конце order, поэтому идём с конца
+            if order[k] == name:
+                break
+            nxt = self._rank_of.get(order[k], nxt)
+        else:
+            return end
+        prev = next((self._rank_of[n] for n in map(order.__getitem__, range(k - 1, -1, -1)) if n in self._rank_of), None)
+        if nxt is None:
+            return end if prev is None else max(prev + 1, end)
+        return nxt - 1 if prev is None else (prev + nxt) / 2
+
+    def add(self, name: str, plates: PlateIndex, order: list[str] | None = None):
+        """Дописать компанию в индекс без перестройки остальных записей.
+
+        При равных ярусах search ставит её на место из order (ALL_COMPANY_NAMES — порядок файла);
+        компания, которая уже была в индексе, своё место сохраняет.
+        """
+        self.remove(name)
+        rank = self._rank_of.get(name)
+        if rank is None:
+            rank = self._rank_of[name] = self._rank_in(name, order)
+        i = len(self.names)
+        self.names.append(name)
+        self._pos[name] = i
+        self._rank.append(rank)
+        norm = normalize_company_name(name)
+        self._names_text = self._append(self._names_text, self._names_starts, norm, "\x1f")
+        self._canon_text = self._append(self._canon_text, self._canon_starts, self._canon_bytes(plates, name), b"\x1f")
+        self._extra_text = self._append(self._extra_text, self._extra_starts, plates.extra_blob.get(name, ""), "\x1f")
+        self._add_tokens(i, norm)
+
+    def remove(self, name: str):
+        # запись остаётся в строках и дереве, но search её пропускает
+        i = self._pos.pop(name, None)
+        if i is not None:
+            self._dead.add(i)
+
+    @property
+    def garbage(self) -> int:
+        return len(self._dead)
+
+    @staticmethod
+    def _find_all(text: str, starts: list[int], q: str, prefix: set | None = None) -> set[int]:
+        """Номера записей, содержащих q; в prefix — те, что с q начинаются."""
+        found = set()
+        i = text.find(q)
+        while i >= 0:
+            k = bisect.bisect_right(starts, i) - 1
+            found.add(k)
+            if prefix is not None and i == starts[k]:
+                prefix.add(k)
+            nxt = starts[k + 1] if k + 1 < len(starts) else len(text)
+            i = text.find(q, nxt)
+        return found
+
+    def _fuzzy_word(self, word: str, k: int) -> dict[str, int]:
+        """Слова индекса, префикс которых отличается от word не более чем на k правок."""
+        out: dict[str, int] = {}
+        first = list(range(len(word) + 1))
+        inf = k + 1
+        stack = [(ch, child, first, inf) for ch, child in self._trie.items() if ch != self._END]
+        while stack:
+            ch, node, prev, best = stack.pop()
+            row = [prev[0] + 1]
+            for c in range(1, len(word) + 1):
+                row.append(min(row[c - 1] + 1, prev[c] + 1, prev[c - 1] + (word[c - 1] != ch)))
+            best = min(best, row[-1])  # лучшее расстояние запроса до префиксов на этом пути
+            low = min(row)
+            if best <= k and low >= best:
+                # глубже расстояние уже не уменьшится — всё поддерево подходит с этим best
+                self._collect(node, best, out)
+                continue
+            if low <= k:
+                if best <= k and self._END in node:
+                    out[node[self._END]] = min(best, out.get(node[self._END], inf))
+                stack.extend((ch2, child, row, best) for ch2, child in node.items() if ch2 != self._END)
+        return out
+
+    def _collect(self, node: dict, dist: int, out: dict[str, int]):
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            for ch, child in n.items():
+                if ch == self._END:
+                    if out.get(child, dist + 1) > dist:
+                        out[child] = dist
+                else:
+                    stack.append(child)
+
+    def search(self, query: str) -> list[tuple[int, int, int]]:
+        """Список (ярус, расстояние, позиция в индексе) для подходящих компаний — в порядке выдачи.
+
+        Ярус 0 — название начинается с запроса, 1 — подстрока названия или номера, 2 — нечёткое;
+        внутри яруса и расстояния — порядок файла.
+        """
+        q = normalize_company_name(query)
+        if not q:
+            return []
+        prefix: set[int] = set()
+        substr = self._find_all(self._names_text, self._names_starts, q, prefix)
+        raw = str(query).strip().lower()
+        substr |= self._find_all(self._extra_text, self._extra_starts, raw)
+        frag = _plate_compact(raw)
+        if len(frag) >= 2 and any(ch.isdigit() for ch in frag):
+            # похоже на кусок номера — ищем среди канонических номеров
+            substr |= self._find_all(self._canon_text, self._canon_starts, frag.translate(_PLATE_TO_LATIN).encode("utf-8"))
+        hits = {i: (0 if i in prefix else 1, 0) for i in substr}
+
+        words = q.split()
+        if any(_fuzzy_budget(w) for w in words):
+            fuzzy: dict[int, int] | None = None
+            for w in words:
+                k = _fuzzy_budget(w)
+                if k:
+                    cand: dict[int, int] = {}
+                    for tok, d in self._fuzzy_word(w, k).items():
+                        for i in self._token_names[tok]:
+                            if cand.get(i, d + 1) > d:
+                                cand[i] = d
+                else:
+                    cand = {i: 0 for i in self._find_all(self._names_text, self._names_starts, w)}
+                fuzzy = cand if fuzzy is None else {i: fuzzy[i] + d for i, d in cand.items() if i in fuzzy}
+                if not fuzzy:
+                    break
+            for i, d in (fuzzy or {}).items():
+                if i not in hits:
+                    hits[i] = (2, d)
+        rank = self._rank
+        ranked = sorted((tier, d, rank[i], i) for i, (tier, d) in hits.items() if i not in self._dead)
+        return [(tier, d, i) for tier, d, _, i in ranked]
 
-COMPANIES, ALL_COMPANY_NAMES = load_companies()
+
+def _visible(meta: Company | None) -> bool:
+    return meta is not None and meta.visible
+
+
+# Справочники при импорте не читаются: их грузит TableLoader в фоне, пока окно уже на экране
+# (или load_all_tables() — синхронно, для консольных команд).
+COMPANIES: dict = {}
+ALL_COMPANY_NAMES: list[str] = []
+PLATES = PlateTable()  # лист «Номера»: записи с типом и датой добавления
+PLATE_INDEX = PlateIndex()
+SEARCH_INDEX = CompanySearchIndex([], PLATE_INDEX)
+
+def _load_companies_bundle():
+    companies, visible, table = load_companies()
+    plates = PlateIndex.build(companies)
+    return companies, visible, plates, CompanySearchIndex(visible, plates), table
+
+def _set_companies(bundle):
+    global COMPANIES, ALL_COMPANY_NAMES, PLATE_INDEX, SEARCH_INDEX, PLATES
+    COMPANIES, ALL_COMPANY_NAMES, PLATE_INDEX, SEARCH_INDEX, PLATES = bundle
 
 def reload_companies_globals():
-    global COMPANIES, ALL_COMPANY_NAMES
-    COMPANIES, ALL_COMPANY_NAMES = load_companies()
+    bundle = _load_companies_bundle()
+    events = company_events(COMPANIES, bundle[0])
+    _set_companies(bundle)
+    emit_company_events(events)
+
+
+# === События справочника компаний ===
+# Виджеты подписываются на изменения и правят только затронутые компании,
+# вместо полной перезаливки списков после каждой правки.
+COMPANY_LISTENERS: list = []  # callback(events), events — список (вид, компания); вызываются в потоке Tk
+SEARCH_INDEX_MAX_GARBAGE = 500  # столько удалённых записей поиск терпит до перестройки индекса
+
+
+def subscribe_companies(callback):
+    """Подписаться на события справочника; возвращает функцию отписки."""
+    COMPANY_LISTENERS.append(callback)
+    return lambda: callback in COMPANY_LISTENERS and COMPANY_LISTENERS.remove(callback)
+
+
+def emit_company_events(events: list[tuple[str, str]]):
+    if events:
+        for callback in list(COMPANY_LISTENERS):
+            callback(events)
+
+
+def company_events(old: dict, new: dict) -> list[tuple[str, str]]:
+    """События между двумя состояниями справочника: added, removed, plates, pay, inn."""
+    events = [("removed", n) for n in old if n not in new]
+    for name, meta in new.items():
+        prev = old.get(name)
+        if prev is None:
+            events.append(("added", name))
+        elif prev is not meta:
+            for kind, key in (("plates", "plates"), ("pay", "pay"), ("inn", "inn")):
+                if getattr(prev, key) != getattr(meta, key):
+                    events.append((kind, name))
+    return events
+
+
+def set_company(name: str, meta: Company | None):
+    """Поменять одну компанию в памяти (meta=None — удалить) без перечитывания файла и разослать события."""
+    set_companies({name: meta})
+
+
+def set_companies(changes: dict[str, dict | None]):
+    """То же для пачки компаний: индексы правятся по месту, события уходят одним списком.
+
+    Записи COMPANIES меняются всегда — ID или разбивка на машины/прицепы событий не дают,
+    но в памяти должны быть свежими; индексы трогаются только там, где это нужно.
+    """
+    global ALL_COMPANY_NAMES, SEARCH_INDEX
+    old = {n: COMPANIES[n] for n in changes if n in COMPANIES}
+    events = company_events(old, {n: m for n, m in changes.items() if m is not None})
+    visibility_changed = False
+    to_search = []
+    for name, meta in changes.items():
+        prev = old.get(name)
+        was_visible = prev is not None and _visible(prev)
+        now_visible = meta is not None and _visible(meta)
+        visibility_changed |= was_visible != now_visible
+        reindex = prev is None or meta is None or prev.plates != meta.plates
+        if meta is None:
+            COMPANIES.pop(name, None)
+        else:
+            COMPANIES[name] = meta  # новая компания встаёт в конец — как и строка в файле
+        if reindex and prev is not None and meta is not None and set(prev.plates) <= set(meta.plates):
+            # номера только добавились — индексируем лишь новые
+            had = set(prev.plates)
+            PLATE_INDEX.add_plates(name, [p for p in meta.plates if p not in had])
+        elif reindex:
+            PLATE_INDEX.remove_company(name)
+            if meta is not None:
+                PLATE_INDEX.add_company(name, meta.plates)
+        if was_visible and (reindex or not now_visible):
+            SEARCH_INDEX.remove(name)
+        if now_visible and (reindex or not was_visible):
+            to_search.append(name)
+    if visibility_changed:
+        ALL_COMPANY_NAMES = [n for n, m in COMPANIES.items() if _visible(m)]
+    if SEARCH_INDEX.garbage + len(to_search) > SEARCH_INDEX_MAX_GARBAGE:
+        SEARCH_INDEX = CompanySearchIndex(ALL_COMPANY_NAMES, PLATE_INDEX)
+    else:
+        for name in to_search:
+            SEARCH_INDEX.add(name, PLATE_INDEX, ALL_COMPANY_NAMES)
+    emit_company_events(events)
+
+
+def _company_row(df: pd.DataFrame, name: str):
+    mask = df[COL_NAME].str.lower() == name.lower()
+    return mask if mask.any() else None
+
+
+def add_company_plates(name: str, plates: list[str]) -> bool:
+    """Дописать номера компании в companies.xlsx; False — компании в файле нет.
+
+    Ячейка собирается из ячейки файла (её могли поправить в Excel), PLATES и COMPANIES
+    меняются только после удачной записи.
+    """
+    df = read_companies_df()
+    mask = _company_row(df, name)
+    if mask is None:
+        return False
+    df.loc[mask, COL_PLATES] = _append_plates(df.loc[mask, COL_PLATES].iloc[0], plates)
+    write_companies_df(df)
+    set_company(*company_from_row(df.loc[mask].iloc[0]))
+    return True
 
 
-def filter_companies(query: str) -> list[str]:
-    q = str(query).strip().lower()
-    if not q:
-        return list(ALL_COMPANY_NAMES)
-    result = []
-    for name in ALL_COMPANY_NAMES:
-        meta = COMPANIES.get(name, {})
-        plates = meta.get("plates", [])
-        if q in name.lower() or any(q in p.lower() for p in plates):
-            result.append(name)
-    return result
+def remove_company_plates(name: str, plates: list[str]) -> bool:
+    """Убрать номера компании из companies.xlsx; False — компании в файле нет."""
+    df = read_companies_df()
+    mask = _company_row(df, name)
+    if mask is None:
+        return False
+    drop = {p.strip() for p in plates}
+    df.loc[mask, COL_PLATES] = ", ".join(p for p in parse_plates(df.loc[mask, COL_PLATES].iloc[0]) if p not in drop)
+    write_companies_df(df)
+    set_company(*company_from_row(df.loc[mask].iloc[0]))
+    return True
 
-# === Цены услуг и расходников ===
-def _parse_price_value(v):
-    if isinstance(v, str) and "/" in v:
-        parts = [p.strip() for p in v.split("/") if p.strip()]
-        if len(parts) == 2:
-            try:
-                return int(parts[0]), int(parts[1])
-            except Exception:
-                return 0
-    try:
-        return int(v)
-    except Exception:
-        return 0
 
-def load_price_table():
-    price = {"Легковой": {}, "Грузовой": {}}
-    if not PRICE_XLSX.exists():
-        return price
-    wb = load_workbook(PRICE_XLSX, data_only=True)
-    ws = wb.active
-    rows = list(ws.iter_rows(values_only=True))
-    if len(rows) < 3:
-        return price
-    # Определим столбцы цен для грузовых и легковых
-    header = rows[0]
-    truck_col = header.index("Грузовой") if "Грузовой" in header else 1
-    car_col = header.index("Легковой") if "Легковой" in header else 9
-    for r in rows[2:]:
-        name = str(r[0]).strip() if r and r[0] else ""
+# === Массовый импорт компаний и номеров ===
+_RE_IMPORT_PLATES_SEP = re.compile(r"[,;\n]+")
+IMPORT_PREVIEW_ROWS = 500  # сколько строк различий показывать в админке
+
+
+def _inn_key(inn: str) -> str:
+    return re.sub(r"\D", "", str(inn))
+
+
+def _append_plates(cell: str, plates: list[str]) -> str:
+    """Дописать номера в конец ячейки «Номера», пропуская те, что в ней уже есть (в каноническом виде)."""
+    current = parse_plates(cell)
+    seen = {canonical_plate(p)[0] or p.lower() for p in current}
+    for plate in plates:
+        key = canonical_plate(plate)[0] or plate.lower()
+        if key not in seen:
+            seen.add(key)
+            current.append(plate)
+    return ", ".join(current)
+
+
+CSV_SNIFF_TAIL_LINES = 20  # разделитель определяем по концу файла: там таблица, а не шапка выписки
+
+
+def _read_csv_rows(path: Path) -> list[list[str]]:
+    """Строки CSV как есть, дополненные пустыми ячейками до одной ширины.
+
+    Строки шапки (реквизиты выписки, период) короче строк таблицы — pandas на таких файлах падает,
+    поэтому читаем модулем csv, а заголовок ищет вызывающий.
+    """
+    for enc in ("utf-8-sig", "cp1251"):
+        try:
+            text = path.read_text(encoding=enc)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        raise ValueError(f"Не удалось определить кодировку файла {path.name}")
+    tail = [ln for ln in text.splitlines() if ln.strip()][-CSV_SNIFF_TAIL_LINES:]
+    try:
+        delimiter = csv.Sniffer().sniff("\n".join(tail), delimiters=";,\t|").delimiter
+    except csv.Error:
+        delimiter = ";"
+    rows = [r for r in csv.reader(io.StringIO(text), delimiter=delimiter) if any(c.strip() for c in r)]
+    width = max((len(r) for r in rows), default=0)
+    return [[c.strip() for c in r] + [""] * (width - len(r)) for r in rows]
+
+
+def _read_table_file(path, header: int | None = 0) -> pd.DataFrame:
+    """CSV (разделитель и кодировка — как получится из Excel/банка) или xlsx, все ячейки строками.
+
+    header=None — без строки заголовка: колонки 0, 1, 2…
+    """
+    path = Path(path)
+    if path.suffix.lower() in (".csv", ".txt"):
+        rows = _read_csv_rows(path)
+        if header is None:
+            return pd.DataFrame(rows, dtype=str)
+        return pd.DataFrame(rows[header + 1:], columns=rows[header] if rows else [], dtype=str)
+    return pd.read_excel(path, dtype=str, keep_default_na=False, header=header)
+
+
+def read_import_table(path) -> pd.DataFrame:
+    """Таблица импорта с колонками компании/ИНН/номеров (заголовки — как в companies.xlsx)."""
+    return _normalize_company_df(_read_table_file(path))
+
+
+class CompanyImport:
+    """План импорта: что добавится в справочник. Считается за один проход по файлу."""
+
+    def __init__(self):
+        self.new: dict[str, dict] = {}          # новая компания -> {"inn", "plates", "pay"}
+        self.plates: dict[str, list[str]] = {}  # существующая компания -> её новые номера
+        self.inn: dict[str, str] = {}           # существующая компания без ИНН -> ИНН из файла
+        self.conflicts: list[tuple[str, str, str]] = []  # (номер, компания в файле, чей номер сейчас)
+        self.duplicates = 0  # номера, которые уже есть у этой же компании или повторяются в файле
+        self.skipped = 0     # строки без названия компании
+        self.rows = 0
+
+    @property
+    def empty(self) -> bool:
+        return not (self.new or self.plates or self.inn)
+
+    def summary(self) -> str:
+        n_new_plates = sum(len(v["plates"]) for v in self.new.values()) + sum(len(v) for v in self.plates.values())
+        return (f"Строк: {self.rows}. Новых компаний: {len(self.new)}, новых номеров: {n_new_plates}, "
+                f"ИНН дополнено: {len(self.inn)}. Уже есть: {self.duplicates}, "
+                f"номер у другой компании: {len(self.conflicts)}, без названия: {self.skipped}.")
+
+    def diff(self):
+        """Построчно (действие, компания, подробности) — для предпросмотра."""
+        for name, rec in self.new.items():
+            yield "новая компания", name, ", ".join(filter(None, [rec["inn"] and f"ИНН {rec['inn']}", *rec["plates"]]))
+        for name, plates in self.plates.items():
+            yield "+ номера", name, ", ".join(plates)
+        for name, inn in self.inn.items():
+            yield "ИНН", name, inn
+        for plate, name, owner in self.conflicts:
+            yield "пропущен", name, f"{plate} уже у «{owner}»"
+
+
+@METRICS.timed("import.plan")
+def plan_company_import(df: pd.DataFrame) -> CompanyImport:
+    """Сверить таблицу импорта со справочником в памяти: номера — в каноническом виде, за один проход."""
+    plan = CompanyImport()
+    by_name = {normalize_company_name(n): n for n in COMPANIES}
+    by_inn = {}
+    for n, meta in COMPANIES.items():
+        key = _inn_key(meta.inn)
+        if key:
+            by_inn.setdefault(key, n)
+    owner: dict[str, str] = {}  # канонический номер -> компания, уже с учётом строк файла
+    for full, ref in PLATE_INDEX.exact.items():
+        owner[full] = ref.company
+    for name, inn, cell, pay in zip(df[COL_NAME], df[COL_INN], df[COL_PLATES], df[COL_PAY]):
+        plan.rows += 1
+        name, inn = name.strip(), inn.strip()
         if not name:
+            plan.skipped += 1
             continue
-        price["Грузовой"][name] = _parse_price_value(r[truck_col] if truck_col < len(r) else 0)
-        price["Легковой"][name] = _parse_price_value(r[car_col] if car_col < len(r) else 0)
-    return price
+        target = by_inn.get(_inn_key(inn)) if _inn_key(inn) else None
+        target = target or by_name.get(normalize_company_name(name))
+        if target is None:
+            # компания из файла — заводим новую (и следующие её строки попадут сюда же)
+            target = name
+            plan.new[name] = {"inn": inn, "plates": [], "pay": pay.strip().lower() or "да"}
+            by_name[normalize_company_name(name)] = name
+            if _inn_key(inn):
+                by_inn.setdefault(_inn_key(inn), name)
+        elif target in plan.new:
+            plan.new[target]["inn"] = plan.new[target]["inn"] or inn
+        elif inn and not _inn_key(COMPANIES[target].inn) and target not in plan.inn:
+            plan.inn[target] = inn
+        for plate in _RE_IMPORT_PLATES_SEP.split(cell):
+            plate = " ".join(plate.split())
+            if not plate:
+                continue
+            key = canonical_plate(plate)[0] or plate.lower()
+            holder = owner.get(key)
+            if holder is None:
+                owner[key] = target
+                if target in plan.new:
+                    plan.new[target]["plates"].append(plate)
+                else:
+                    plan.plates.setdefault(target, []).append(plate)
+            elif holder == target:
+                plan.duplicates += 1
+            else:
+                plan.conflicts.append((plate, name, holder))
+    return plan
 
-def load_consumables_table():
-    data = {}
-    categories = []
-    if not CONSUMABLES_XLSX.exists():
-        return data, categories
-    wb = load_workbook(CONSUMABLES_XLSX, data_only=True)
-    ws = wb.active
-    rows = list(ws.iter_rows(values_only=True))
-    if len(rows) < 3:
-        return data, categories
-    header1 = rows[0]
-    header2 = rows[1]
-    for i in range(2, len(header1), 2):
-        cat = header1[i]
-        if cat:
-            categories.append(str(cat).strip())
-    for row in rows[2:]:
-        kind = row[0]
-        name = row[1]
-        if not kind or not name:
+
+@METRICS.timed("import.apply")
+def apply_company_import(plan: CompanyImport):
+    """Записать план одним сохранением companies.xlsx и обновить справочник в памяти.
+
+    Правятся только столбцы, прочитанные из файла: PLATES и COMPANIES меняются после удачной записи
+    (write_companies_df и set_companies), так что упавшее сохранение не оставляет справочник в памяти
+    впереди файла.
+    """
+    if plan.empty:
+        return
+    df = read_companies_df()
+    cols = {c: list(df[c]) for c in COMPANY_COLUMNS}
+    row_of = {name: i for i, name in enumerate(cols[COL_NAME])}
+    touched = []
+    for name, plates in plan.plates.items():
+        i = row_of.get(name)
+        if i is not None:
+            cols[COL_PLATES][i] = _append_plates(cols[COL_PLATES][i], plates)
+            touched.append(i)
+    for name, inn in plan.inn.items():
+        i = row_of.get(name)
+        if i is not None:
+            cols[COL_INN][i] = inn
+            touched.append(i)
+    for name, rec in plan.new.items():
+        if name in row_of:  # файл успели поменять с момента проверки — дописываем номера к строке
+            i = row_of[name]
+            cols[COL_PLATES][i] = _append_plates(cols[COL_PLATES][i], rec["plates"])
+        else:
+            i = len(cols[COL_NAME])
+            row_of[name] = i
+            for c, v in ((COL_NAME, name), (COL_INN, rec["inn"]), (COL_PLATES, _append_plates("", rec["plates"])), (COL_PAY, rec["pay"]), (COL_ID, "")):
+                cols[c].append(v)
+        touched.append(i)
+    df = pd.DataFrame(cols)
+    write_companies_df(df)  # проставит ID новым компаниям
+    set_companies(dict(company_from_row(df.iloc[i]) for i in touched))
+
+
+# === Оплаты из банковской выписки ===
+STATEMENT_HEADER_SCAN_ROWS = 30  # в выгрузках банков заголовок таблицы идёт после шапки выписки
+
+
+def _parse_amount(value) -> float:
+    text = str(value).replace("\xa0", "").replace(" ", "").replace(",", ".")
+    try:
+        return float(text)
+    except ValueError:
+        return 0.0
+
+
+def _read_1c_statement(path: Path) -> list[tuple[str, str, float]]:
+    """Формат обмена 1С (1CClientBankExchange): секции «ключ=значение» по документам."""
+    payments = []
+    doc = None
+    for line in path.read_text(encoding="cp1251", errors="replace").splitlines():
+        key, _, value = line.strip().partition("=")
+        if key == "СекцияДокумент":
+            doc = {}
+        elif key == "КонецДокумента" and doc is not None:
+            payments.append((doc.get("ПлательщикИНН", ""), doc.get("Плательщик1") or doc.get("Плательщик", ""),
+                             _parse_amount(doc.get("Сумма", 0))))
+            doc = None
+        elif doc is not None:
+            doc[key] = value.strip()
+    return payments
+
+
+_RE_STATEMENT_VALUE = re.compile(r"\d{5}")
+
+
+def _statement_columns(header: list[str]) -> tuple[int, int | None, int | None] | None:
+    """Номера колонок (ИНН плательщика, плательщик, сумма) в строке заголовка или None."""
+    # «ИНН 7701000000» в шапке выписки — реквизит, а не заголовок колонки
+    cells = ["" if _RE_STATEMENT_VALUE.search(str(c)) else str(c).strip().lower() for c in header]
+    inn = [i for i, c in enumerate(cells) if "инн" in c]
+    if not inn:
+        return None
+    # в выписке обычно есть и ИНН получателя — это мы сами
+    inn_col = next((i for i in inn if "плат" in cells[i] or "контраг" in cells[i]), inn[0])
+    name_col = next((i for i, c in enumerate(cells) if i not in inn and ("плательщ" in c or "контрагент" in c or "наименован" in c)), None)
+    sum_col = next((i for i, c in enumerate(cells) if "кредит" in c or "поступ" in c or "приход" in c), None)
+    if sum_col is None:
+        sum_col = next((i for i, c in enumerate(cells) if "сумм" in c), None)
+    return inn_col, name_col, sum_col
+
+
+def read_bank_statement(path) -> list[tuple[str, str, float]]:
+    """Платежи из выписки: (ИНН плательщика, плательщик, сумма)."""
+    path = Path(path)
+    if path.suffix.lower() == ".txt" and path.read_bytes()[:32].startswith(b"1CClientBankExchange"):
+        return _read_1c_statement(path)
+    df = _read_table_file(path, header=None)
+    rows = df.values.tolist()
+    for h, header in enumerate(rows[:STATEMENT_HEADER_SCAN_ROWS]):
+        cols = _statement_columns(header)
+        if cols is not None:
+            break
+    else:
+        raise ValueError("В выписке не найдена колонка с ИНН плательщика.")
+    inn_col, name_col, sum_col = cols
+    payments = []
+    for row in rows[h + 1:]:
+        inn = _inn_key(row[inn_col])
+        name = str(row[name_col]).strip() if name_col is not None else ""
+        amount = _parse_amount(row[sum_col]) if sum_col is not None else 0.0
+        if inn or name:
+            payments.append((inn, name, amount))
+    return payments
+
+
+class StatementMatch:
+    """Сверка выписки со справочником по ИНН плательщика."""
+
+    def __init__(self):
+        self.enable: dict[str, str] = {}  # компания -> ИНН; оплата будет включена
+        self.already: set[str] = set()    # оплата уже включена
+        self.unmatched: dict[str, list] = {}  # ИНН -> [плательщик, сумма, число платежей]
+        self.payments = 0
+
+    def summary(self) -> str:
+        return (f"Платежей: {self.payments}. Включить оплату: {len(self.enable)}, уже включена: {len(self.already)}, "
+                f"плательщиков без компании в справочнике: {len(self.unmatched)}.")
+
+
+@METRICS.timed("import.bank")
+def match_statement(payments: list[tuple[str, str, float]]) -> StatementMatch:
+    match = StatementMatch()
+    by_inn: dict[str, list[str]] = collections.defaultdict(list)
+    for name, meta in COMPANIES.items():
+        key = _inn_key(meta.inn)
+        if key:
+            by_inn[key].append(name)
+    for inn, payer, amount in payments:
+        match.payments += 1
+        names = by_inn.get(inn) if inn else None
+        if not names:
+            rec = match.unmatched.setdefault(inn, [payer, 0.0, 0])
+            rec[1] += amount
+            rec[2] += 1
             continue
-        kind = str(kind).strip()
-        name = str(name).strip()
-        data.setdefault(kind, {}).setdefault(name, {})
-        for idx, cat in enumerate(categories):
-            base = 2 + idx*2
-            cold = row[base]
-            hot = row[base+1] if base+1 < len(row) else None
-            if cold not in (None, ""):
-                data[kind][name][(cat, "холодная")] = _parse_price_value(cold)
-            if hot not in (None, ""):
-                data[kind][name][(cat, "горячая")] = _parse_price_value(hot)
-    return data, categories
+        for name in names:  # у одного ИНН может быть несколько записей (филиалы)
+            if _visible(COMPANIES[name]):
+                match.already.add(name)
+            else:
+                match.enable[name] = inn
+    return match
 
-PRICE_TABLE = load_price_table()
-CONSUMABLES_TABLE, CONSUMABLE_CATEGORIES = load_consumables_table()
 
-CONSUMABLE_SERVICE_MAP = {
-    "Пластырь №": "Пластырь",
-    "Грибок №": "Грибок",
-    "Удлинитель": "Удлинитель",
-    "Грузики": "Грузики",
-    "Флипер": "Флипер",
-    "Камера": "Камера",
-}
+def apply_statement(match: StatementMatch):
+    """Выставить «Оплата = да» всем найденным компаниям — одной записью файла."""
+    if not match.enable:
+        return
+    df = read_companies_df()
+    mask = df[COL_NAME].isin(match.enable.keys())
+    df.loc[mask, COL_PAY] = "да"
+    write_companies_df(df)
+    set_companies(dict(company_from_row(row) for _, row in df[mask].iterrows()))
 
-SERVICE_PRICE_NAME = {
-    "Снятие/установка": "Снятие, установка наружное/внутреннее",
-    "Вентиль легковой": "Вентиль легковой (хром/черный)",
-    "Пластырь №": "Пластырь",
-    "Грибок №": "Грибок",
-    "Удлинитель": "Удлинитель ",
-}
 
+@METRICS.timed("search")
 def filter_companies(query: str) -> list[str]:
     q = str(query).strip().lower()
     if not q:
         return list(ALL_COMPANY_NAMES)
-    result = []
-    for name in ALL_COMPANY_NAMES:
-        meta = COMPANIES.get(name, {})
-        plates = meta.get("plates", [])
-        if q in name.lower() or any(q in p.lower() for p in plates):
-            result.append(name)
-    return result
+    # полный номер в любом написании — сразу компания-владелец, без перебора
+    ref = PLATE_INDEX.lookup(q)
+    if ref is not None and _visible(COMPANIES.get(ref.company)):
+        return [ref.company]
+    names = SEARCH_INDEX.names
+    hits = SEARCH_INDEX.search(q)
+    if USAGE.companies:
+        # внутри яруса (префикс/подстрока/опечатка) выше те, с кем работаем чаще
+        now = time.time()
+        score = USAGE.company_score
+        hits.sort(key=lambda h: (h[0], h[1], -score(names[h[2]], now)))  # сортировка устойчивая: дальше — порядок файла
+    return [names[i] for _, _, i in hits]
 
 # === Цены услуг и расходников ===
 def _parse_price_value(v):
@@ -323,6 +1436,7 @@ def _parse_price_value(v):
     except Exception:
         return 0
 
+@METRICS.timed("load.price")
 def load_price_table():
     price = {"Легковой": {}, "Грузовой": {}}
     if not PRICE_XLSX.exists():
@@ -344,6 +1458,7 @@ def load_price_table():
         price["Легковой"][name] = _parse_price_value(r[car_col] if car_col < len(r) else 0)
     return price
 
+@METRICS.timed("load.consumables")
 def load_consumables_table():
     data = {}
     categories = []
@@ -378,8 +1493,17 @@ def load_consumables_table():
                 data[kind][name][(cat, "горячая")] = _parse_price_value(hot)
     return data, categories
 
-PRICE_TABLE = load_price_table()
-CONSUMABLES_TABLE, CONSUMABLE_CATEGORIES = load_consumables_table()
+PRICE_TABLE: dict = {"Легковой": {}, "Грузовой": {}}
+CONSUMABLES_TABLE: dict = {}
+CONSUMABLE_CATEGORIES: list = []
+
+def _set_price(table):
+    global PRICE_TABLE
+    PRICE_TABLE = table
+
+def _set_consumables(result):
+    global CONSUMABLES_TABLE, CONSUMABLE_CATEGORIES
+    CONSUMABLES_TABLE, CONSUMABLE_CATEGORIES = result
 
 CONSUMABLE_SERVICE_MAP = {
     "Пластырь №": "Пластырь",
@@ -390,6 +1514,12 @@ CONSUMABLE_SERVICE_MAP = {
     "Камера": "Камера",
 }
 
+CONSUMABLE_TEMPS = ["холодная", "горячая"]
+
+
+def consumable_price(kind: str, name: str, category: str, temp: str, table: dict | None = None) -> int:
+    return (CONSUMABLES_TABLE if table is None else table).get(kind, {}).get(name, {}).get((category, temp), 0)
+
 SERVICE_PRICE_NAME = {
     "Снятие/установка": "Снятие, установка наружное/внутреннее",
     "Вентиль легковой": "Вентиль легковой (хром/черный)",
@@ -399,256 +1529,1809 @@ SERVICE_PRICE_NAME = {
 }
 
 
+# === История цен ===
+# Прайс и расходники версионируются: при каждой загрузке файла изменившиеся позиции дописываются
+# ревизией с датой вступления в силу. Старый наряд можно перепроверить или пересчитать по ценам своего дня.
+PRICE_HISTORY_FILE = DATA_DIR / "price_history.json"  # рядом со справочниками: история общая для всех рабочих мест
+_PRICE_KEY_SEP = "\t"
 
-def filter_companies(query: str) -> list[str]:
-    q = str(query).strip().lower()
-    if not q:
-        return list(ALL_COMPANY_NAMES)
-    result = []
-    for name in ALL_COMPANY_NAMES:
-        meta = COMPANIES.get(name, {})
-        plates = meta.get("plates", [])
-        if q in name.lower() or any(q in p.lower() for p in plates):
-            result.append(name)
+
+def flatten_price(table: dict) -> dict[tuple, object]:
+    return {(vt, name): v for vt, rows in table.items() for name, v in rows.items()}
+
+def unflatten_price(flat: dict) -> dict:
+    table = {"Легковой": {}, "Грузовой": {}}
+    for (vt, name), v in flat.items():
+        table.setdefault(vt, {})[name] = v
+    return table
+
+def flatten_consumables(result) -> dict[tuple, object]:
+    data, _ = result
+    return {(kind, name, cat, temp): v
+            for kind, rows in data.items() for name, prices in rows.items() for (cat, temp), v in prices.items()}
+
+def unflatten_consumables(flat: dict):
+    data, categories = {}, []
+    for (kind, name, cat, temp), v in flat.items():
+        data.setdefault(kind, {}).setdefault(name, {})[(cat, temp)] = v
+        if cat not in categories:
+            categories.append(cat)
+    return data, categories
+
+
+class PriceHistory:
+    """Ревизии прайса («price») и расходников («consumables»): дата вступления в силу и только изменения.
+
+    as_of(вид, дата) отдаёт таблицу того же вида, что PRICE_TABLE / результат load_consumables_table:
+    ревизия ищется бинарным поиском по датам, собранные таблицы кэшируются — запросы к ним идут
+    с обычной скоростью, и массовый пересчёт нарядов собирает каждую ревизию один раз.
+    """
+
+    KINDS = {"price": (flatten_price, unflatten_price), "consumables": (flatten_consumables, unflatten_consumables)}
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._revs = {kind: [] for kind in self.KINDS}   # вид -> [(дата ISO, {ключ: цена или None — позиция убрана})]
+        self._dates = {kind: [] for kind in self.KINDS}
+        self._flat = {}    # (вид, номер ревизии) -> все позиции на эту ревизию
+        self._tables = {}  # (вид, номер ревизии) -> собранная таблица
+        self._sig = None
+
+    def _load(self):
+        """Перечитать файл, если его поменяли (в том числе с другого рабочего места)."""
+        sig = _file_signature(self.path)
+        if sig == self._sig:
+            return
+        try:
+            raw = json.loads(self.path.read_text(encoding="utf-8"))
+        except Exception:
+            raw = {}
+        for kind in self.KINDS:
+            revs = []
+            for rev in raw.get(kind, []):
+                changes = {tuple(k.split(_PRICE_KEY_SEP)): (tuple(v) if isinstance(v, list) else v)
+                           for k, v in rev.get("changes", {}).items()}
+                revs.append((rev["effective"], changes))
+            revs.sort(key=lambda r: r[0])
+            self._revs[kind] = revs
+            self._dates[kind] = [d for d, _ in revs]
+        self._flat.clear()
+        self._tables.clear()
+        self._sig = sig
+
+    def _save(self):
+        raw = {kind: [{"effective": d, "changes": {_PRICE_KEY_SEP.join(k): v for k, v in changes.items()}}
+                      for d, changes in revs] for kind, revs in self._revs.items()}
+        tmp = self.path.with_name(f".{self.path.stem}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(raw, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp, self.path)
+        self._sig = _file_signature(self.path)
+
+    def _flat_at(self, kind: str, i: int) -> dict:
+        if (kind, i) not in self._flat:
+            start = i
+            while start >= 0 and (kind, start) not in self._flat:
+                start -= 1
+            flat = dict(self._flat[(kind, start)]) if start >= 0 else {}
+            for j in range(start + 1, i + 1):
+                for key, v in self._revs[kind][j][1].items():
+                    if v is None:
+                        flat.pop(key, None)
+                    else:
+                        flat[key] = v
+                self._flat[(kind, j)] = dict(flat) if j < i else flat
+        return self._flat[(kind, i)]
+
+    def revisions(self, kind: str) -> list[str]:
+        with self._lock:
+            self._load()
+            return list(self._dates[kind])
+
+    def as_of(self, kind: str, day: str):
+        """Таблица на дату day (ISO). Раньше первой ревизии — первая; истории нет — None."""
+        with self._lock:
+            self._load()
+            if not self._revs[kind]:
+                return None
+            i = max(0, bisect.bisect_right(self._dates[kind], day) - 1)
+            if (kind, i) not in self._tables:
+                self._tables[(kind, i)] = self.KINDS[kind][1](self._flat_at(kind, i))
+            return self._tables[(kind, i)]
+
+    def record(self, kind: str, table, effective: str) -> bool:
+        """Записать таблицу ревизией с датой effective; True — если на эту дату что-то поменялось.
+
+        Файл прайса старше последней ревизии получает свою дату и встаёт в историю по порядку;
+        правка в день существующей ревизии уточняет её. Файл истории общий для рабочих мест,
+        поэтому чтение, слияние и запись идут под блокировкой файла.
+        """
+        flat = self.KINDS[kind][0](table)
+        with self._lock, _file_lock(self.path.with_name(self.path.name + ".lock")):
+            self._sig = None  # ревизию могли дописать с другого рабочего места — читаем заново под блокировкой
+            self._load()
+            dates = list(self._dates[kind])
+            i = bisect.bisect_right(dates, effective) - 1  # ревизия, действующая на effective
+            if (self._flat_at(kind, i) if i >= 0 else {}) == flat:
+                return False
+            snapshots = [self._flat_at(kind, j) for j in range(len(dates))]
+            if i >= 0 and dates[i] == effective:
+                snapshots[i] = flat
+            else:
+                snapshots.insert(i + 1, flat)
+                dates.insert(i + 1, effective)
+            # ревизии хранят изменения относительно предыдущей — после вставки пересчитываем их по полным таблицам
+            revs, prev = [], {}
+            for day, snap in zip(dates, snapshots):
+                changes = {k: v for k, v in snap.items() if prev.get(k) != v}
+                changes.update({k: None for k in prev if k not in snap})
+                revs.append((day, changes))
+                prev = snap
+            self._revs[kind] = revs
+            self._dates[kind] = dates
+            for key in [k for k in self._flat if k[0] == kind]:
+                del self._flat[key]
+                self._tables.pop(key, None)
+            self._save()
+            return True
+
+
+PRICE_HISTORY = PriceHistory(PRICE_HISTORY_FILE)
+
+
+def _file_day(path: Path) -> str:
+    try:
+        return datetime.date.fromtimestamp(path.stat().st_mtime).isoformat()
+    except OSError:
+        return datetime.date.today().isoformat()
+
+def _record_history(kind: str, table, path: Path):
+    try:
+        PRICE_HISTORY.record(kind, table, _file_day(path))
+    except Exception:
+        pass  # история — вспомогательный файл: папка только для чтения не мешает работе
+
+def load_price_versioned():
+    table = load_price_table()
+    _record_history("price", table, PRICE_XLSX)
+    return table
+
+def load_consumables_versioned():
+    result = load_consumables_table()
+    _record_history("consumables", result, CONSUMABLES_XLSX)
     return result
 
-# === Цены услуг и расходников ===
-def _parse_price_value(v):
-    if isinstance(v, str) and "/" in v:
-        parts = [p.strip() for p in v.split("/") if p.strip()]
-        if len(parts) == 2:
+
+SPLIT_SERVICES = {  # услуга -> варианты с разной ценой (в прайсе — пара цен)
+    "Снятие/установка": ["наружное", "внутреннее"],
+    "Вентиль легковой": ["хром", "черный"],
+}
+
+def _price_pair(price) -> tuple:
+    return (price, price) if isinstance(price, int) else tuple(price)
+
+def price_services(vt: str, lines: dict[str, dict], price_table: dict | None = None,
+                   consumables: dict | None = None) -> dict[str, dict]:
+    """Цены выбранных услуг по прайсу (по умолчанию — текущему).
+
+    lines: {услуга: {"qty": n} | {"parts": [n1, n2]} | {"items": [[вариант, категория, тип, кол-во], ...]}};
+    в результат попадают услуги с ненулевым количеством: {"qty", "price", "cost"} и исходные данные строки.
+    """
+    price_table = PRICE_TABLE if price_table is None else price_table
+    consumables = CONSUMABLES_TABLE if consumables is None else consumables
+    prices = price_table.get(vt, {})
+    selected = {}
+    for name, line in lines.items():
+        base_name = SERVICE_PRICE_NAME.get(name, name)
+        if "parts" in line:  # «Снятие/установка» (наружное/внутреннее), «Вентиль легковой» (хром/черный)
+            pair = _price_pair(prices.get(base_name, (0, 0)))
+            qty = sum(line["parts"])
+            cost = sum(n * p for n, p in zip(line["parts"], pair))
+        elif "items" in line:
+            kind = CONSUMABLE_SERVICE_MAP[name]
+            qty = sum(count for *_, count in line["items"])
+            cost = sum(consumable_price(kind, n, c, t, consumables) * count for n, c, t, count in line["items"])
+        else:
+            qty = line["qty"]
+            price = prices.get(base_name, 0)
+            selected[name] = {"qty": qty, "price": price, "cost": price * qty}
+            continue
+        if qty > 0:
+            selected[name] = {"qty": qty, "price": cost // qty, "cost": cost, **line}
+    return selected
+
+
+# Рядом с каждым нарядом — JSON с исходными данными: по нему наряд пересчитывается по ценам любой даты.
+def write_order_record(xlsx_out: Path, data: dict) -> dict:
+    record = {"created": datetime.datetime.now().isoformat(timespec="seconds"), **data}
+    try:
+        xlsx_out.with_suffix(".json").write_text(json.dumps(record, ensure_ascii=False, indent=1), encoding="utf-8")
+    except OSError:
+        pass  # наряд уже сохранён; без JSON его просто нельзя будет пересчитать
+    return record
+
+def reprice_order(order: dict, day: str | None = None, history: PriceHistory | None = None) -> dict[str, dict]:
+    """Услуги наряда по ценам на day (по умолчанию — на дату самого наряда).
+
+    Строки без исходных данных (наряды старых версий с разбивкой или расходниками) остаются как были.
+    """
+    history = PRICE_HISTORY if history is None else history
+    day = day or order.get("created", "")[:10] or datetime.date.today().isoformat()
+    price_table = history.as_of("price", day)
+    consumables = history.as_of("consumables", day)
+    lines, kept = {}, {}
+    for name, s in order.get("services", {}).items():
+        if "parts" in s:
+            lines[name] = {"parts": s["parts"]}
+        elif "items" in s:
+            lines[name] = {"items": s["items"]}
+        elif name in SPLIT_SERVICES or name in CONSUMABLE_SERVICE_MAP:
+            kept[name] = s
+        else:
+            lines[name] = {"qty": s.get("qty", 0)}
+    repriced = price_services(order.get("vehicle_type", ""), lines, price_table,
+                              consumables[0] if consumables is not None else None)
+    return {**kept, **repriced}
+
+@METRICS.timed("reprice.orders")
+def reprice_orders(paths, day: str | None = None, history: PriceHistory | None = None):
+    """(путь, сумма в наряде, сумма по ценам дня) для каждого JSON наряда; нечитаемые файлы пропускаются."""
+    out = []
+    for path in paths:
+        try:
+            order = json.loads(Path(path).read_text(encoding="utf-8"))
+        except Exception:
+            continue
+        old = sum(s.get("cost", 0) for s in order.get("services", {}).values())
+        new = sum(s["cost"] for s in reprice_order(order, day, history).values())
+        out.append((Path(path), old, new))
+    return out
+
+
+# === Чек и текст суммы ===
+def ruble_suffix(n: int) -> str:
+    n_abs = abs(n) % 100
+    n1 = n_abs % 10
+    if 11 <= n_abs <= 19:
+        return "рублей"
+    if n1 == 1:
+        return "рубль"
+    if 2 <= n1 <= 4:
+        return "рубля"
+    return "рублей"
+
+def make_total_text(total: int) -> str:
+    words = num2words(total, lang='ru').capitalize()
+    return f"{words} {ruble_suffix(total)}"
+
+# === Экспорт PDF ===
+PDF_CONVERT_TIMEOUT_SEC = 300
+# свой профиль LibreOffice: создаётся один раз при прогреве и не конфликтует с открытым у оператора LibreOffice
+SOFFICE_PROFILE_DIR = LOCAL_DIR / "soffice-profile"
+_SOFFICE_LOCK = threading.Lock()  # один профиль — один запущенный soffice за раз
+
+
+def _excel_export(excel, xlsx_path: Path, pdf_path: Path, a5: bool, landscape: bool):
+    from win32com.client import constants
+    wb = excel.Workbooks.Open(str(xlsx_path.resolve()))
+    try:
+        ws = wb.Worksheets(1)
+        if a5:
+            ws.PageSetup.PaperSize = constants.xlPaperA5
+        ws.PageSetup.Orientation = constants.xlLandscape if landscape else constants.xlPortrait
+        xlTypePDF = 0
+        wb.ExportAsFixedFormat(xlTypePDF, str(pdf_path.resolve()))
+    finally:
+        wb.Close(SaveChanges=False)
+
+def export_pdf_via_excel(xlsx_path: Path, pdf_path: Path, a5: bool = True, landscape: bool = False) -> bool:
+    """Холодный запуск: свой экземпляр Excel на одну конвертацию."""
+    try:
+        import win32com.client as win32
+        excel = win32.DispatchEx("Excel.Application")
+        excel.Visible = False
+        try:
+            _excel_export(excel, xlsx_path, pdf_path, a5, landscape)
+        finally:
+            excel.Quit()
+        return True
+    except Exception:
+        return False
+
+def soffice_command(outdir: Path, files) -> list[str]:
+    return ["soffice", f"-env:UserInstallation={SOFFICE_PROFILE_DIR.resolve().as_uri()}", "--headless", "--norestore",
+            "--convert-to", "pdf", "--outdir", str(outdir), *(str(Path(f).resolve()) for f in files)]
+
+def export_pdf_via_libreoffice(xlsx_path: Path, pdf_path: Path) -> bool:
+    try:
+        outdir = pdf_path.parent
+        with _SOFFICE_LOCK:
+            subprocess.run(soffice_command(outdir, [xlsx_path]), check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                           timeout=PDF_CONVERT_TIMEOUT_SEC)
+        produced = outdir / (xlsx_path.stem + ".pdf")
+        if produced.exists():
+            if produced != pdf_path:
+                produced.replace(pdf_path)
+            return True
+        return False
+    except Exception:
+        return False
+
+
+CONVERTER_HEALTH_SEC = 60              # как часто проверять, что прогретый Excel жив
+CONVERTER_REWARM_IDLE_SEC = 30 * 60    # без Excel: после такого простоя прогреваем заново
+
+
+class PdfConverter:
+    """Прогретый конвертер PDF, чтобы первый наряд дня печатался так же быстро, как сотый.
+
+    Свой поток держит запущенный Excel (COM-объект живёт в создавшем его потоке): раз в CONVERTER_HEALTH_SEC
+    проверяет, что он отвечает, и поднимает заново, если процесс закрыли или он упал.
+    Без Excel — LibreOffice: при старте делается пробная конвертация (создаётся профиль, программа
+    попадает в кеш ОС) и повторяется после долгого простоя. Пока start() не вызван, всё работает холодным запуском.
+    """
+
+    def __init__(self, workdir: Path):
+        self.workdir = workdir
+        self.state = "cold"  # cold | warming | excel | libreoffice | none
+        self._jobs: queue.Queue = queue.Queue()
+        self._thread = None
+        self._excel = None
+        self._last_used = time.monotonic()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="naryad-pdf", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._jobs.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def excel(self, xlsx_path: Path, pdf_path: Path, a5: bool = True, landscape: bool = False) -> bool:
+        """Конвертация в прогретом Excel (или холодным запуском, если поток не запущен)."""
+        if self._thread is None:
+            return export_pdf_via_excel(xlsx_path, pdf_path, a5=a5, landscape=landscape)
+        if self.state in ("libreoffice", "none"):
+            return False  # Excel при прогреве не нашёлся
+        fut = concurrent.futures.Future()
+        self._jobs.put((fut, (xlsx_path, pdf_path, a5, landscape)))
+        try:
+            return fut.result(timeout=PDF_CONVERT_TIMEOUT_SEC)
+        except concurrent.futures.TimeoutError:
+            return False
+
+    def convert(self, xlsx_path: Path, pdf_path: Path, a5: bool = True, landscape: bool = False) -> bool:
+        if self.excel(xlsx_path, pdf_path, a5, landscape):
+            return True
+        ok = export_pdf_via_libreoffice(xlsx_path, pdf_path)
+        self._last_used = time.monotonic()
+        return ok
+
+    def _run(self):
+        try:
+            import pythoncom
+            pythoncom.CoInitialize()
+        except ImportError:
+            pass
+        self._warm()
+        while True:
             try:
-                return int(parts[0]), int(parts[1])
+                job = self._jobs.get(timeout=CONVERTER_HEALTH_SEC)
+            except queue.Empty:
+                self._check()
+                continue
+            if job is None:
+                break
+            fut, args = job
+            if fut.set_running_or_notify_cancel():
+                fut.set_result(self._excel_convert(*args))
+        self._excel_quit()
+
+    def _warm(self):
+        self.state = "warming"
+        with METRICS.span("pdf.warm"):
+            if self._excel_start():
+                self.state = "excel"
+            else:
+                self.state = "libreoffice" if self._soffice_warm() else "none"
+        self._last_used = time.monotonic()
+
+    def _check(self):
+        if self.state == "excel":
+            try:
+                self._excel.Workbooks.Count  # отвечает ли процесс
             except Exception:
-                return 0
+                self._excel_quit()
+                self._warm()
+        elif time.monotonic() - self._last_used > CONVERTER_REWARM_IDLE_SEC:
+            self._warm()  # LibreOffice остыл, или за это время появился Excel
+
+    def _excel_start(self) -> bool:
+        try:
+            import win32com.client as win32
+            excel = win32.DispatchEx("Excel.Application")
+            excel.Visible = False
+            excel.DisplayAlerts = False
+        except Exception:
+            return False
+        self._excel = excel
+        return True
+
+    def _excel_quit(self):
+        if self._excel is not None:
+            try:
+                self._excel.Quit()
+            except Exception:
+                pass
+            self._excel = None
+
+    def _excel_convert(self, xlsx_path: Path, pdf_path: Path, a5: bool, landscape: bool) -> bool:
+        for _ in range(2):  # Excel могли закрыть с момента проверки — поднимаем и пробуем ещё раз
+            if self._excel is None and not self._excel_start():
+                return False
+            try:
+                _excel_export(self._excel, xlsx_path, pdf_path, a5, landscape)
+                self._last_used = time.monotonic()
+                return True
+            except Exception:
+                self._excel_quit()
+        return False
+
+    def _soffice_warm(self) -> bool:
+        src, out = self.workdir / "warmup.xlsx", self.workdir / "warmup.pdf"
+        try:
+            self.workdir.mkdir(parents=True, exist_ok=True)
+            if not src.exists():
+                wb = Workbook()
+                wb.active["A1"] = "Наряд-Заказ"
+                wb.save(src)
+            ok = export_pdf_via_libreoffice(src, out)
+            out.unlink(missing_ok=True)
+            return ok
+        except Exception:
+            return False
+
+
+PDF_CONVERTER = PdfConverter(LOCAL_DIR / "converter")
+
+# === Номера нарядов ===
+# Сквозная нумерация по сериям: год («2026-000123») или филиал и год («Б1-2026-000123»).
+# Счётчики — в папке data, общей для рабочих мест; выделение номера идёт под блокировкой файла,
+# поэтому номера не повторяются ни между процессами, ни между компьютерами.
+ORDER_NUMBERS_FILE = DATA_DIR / "order_numbers.json"
+ORDER_BRANCH = os.environ.get("NARYAD_BRANCH", "").strip()  # серия филиала; пусто — только год
+ORDER_NUMBER_WIDTH = 6
+
+
+@contextlib.contextmanager
+def _file_lock(path: Path):
+    """Эксклюзивная блокировка файла path между процессами на время блока (ждёт, пока не освободится)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK сдаётся через ~10 с — ждём дальше
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class OrderNumbers:
+    """Счётчики серий в JSON-файле.
+
+    Каждое выделение — под блокировкой <файл>.lock: прочитать, увеличить, записать во временный файл,
+    fsync и os.replace. После сбоя в любой момент в файле остаётся либо старое, либо новое значение.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock_path = path.with_name(path.name + ".lock")
+
+    def _read(self) -> dict[str, int]:
+        try:
+            raw = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return {}
+        # испорченный файл не обнуляем молча — это дало бы повторные номера
+        return {series: int(n) for series, n in raw.items()}
+
+    def _write(self, counters: dict[str, int]):
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(counters, f, ensure_ascii=False, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def allocate(self, series: str, count: int = 1) -> int:
+        """Выделить count номеров подряд; возвращает первый."""
+        with _file_lock(self.lock_path):
+            counters = self._read()
+            first = counters.get(series, 0) + 1
+            counters[series] = first + count - 1
+            self._write(counters)
+        return first
+
+    def release(self, series: str, number: int, count: int = 1) -> bool:
+        """Вернуть номера несохранённого наряда, если после них ничего не выделено, — чтобы не было пропуска."""
+        with _file_lock(self.lock_path):
+            counters = self._read()
+            if counters.get(series) != number + count - 1:
+                return False
+            counters[series] = number - 1
+            self._write(counters)
+        return True
+
+    def last(self, series: str) -> int:
+        with _file_lock(self.lock_path):
+            return self._read().get(series, 0)
+
+
+ORDER_NUMBERS = OrderNumbers(ORDER_NUMBERS_FILE)
+
+
+def order_series(day: datetime.date | None = None, branch: str | None = None) -> str:
+    year = (day or datetime.date.today()).year
+    branch = ORDER_BRANCH if branch is None else branch
+    return f"{branch}-{year}" if branch else str(year)
+
+def format_order_number(series: str, number: int) -> str:
+    return f"{series}-{number:0{ORDER_NUMBER_WIDTH}d}"
+
+# === Заполнение шаблона ===
+# Шаблоны — templates/<имя>.xlsx, ячейки описаны рядом в <имя>.layout.json (без описания — DEFAULT_LAYOUT).
+# Описание компилируется один раз в номера строк и столбцов, разобранная книга держится в памяти:
+# наряд пишется прямо в неё, книга сохраняется, и затронутые ячейки возвращаются к исходным значениям.
+DEFAULT_TEMPLATE = TEMPLATE_XLSX.stem
+TEMPLATE_LAYOUT_SUFFIX = ".layout.json"
+DEFAULT_LAYOUT = {
+    "title": "Наряд-заказ (A5)",
+    "pdf": {"a5": True, "landscape": False},
+    "cells": {
+        "customer": CELL_CUSTOMER, "plate": CELL_PLATE, "driver": CELL_DRIVER,
+        "defect_line1": CELL_DEFECT_LINE1, "defect_line2": CELL_DEFECT_LINE2, "issued_to": CELL_ISSUED_TO,
+        "date": CELL_DATE, "total_num": CELL_TOTAL_NUM, "total_text": CELL_TOTAL_TEXT, "mechanic": CELL_MECHANIC,
+        "number": CELL_ORDER_NUMBER,
+    },
+    # строка услуги — start_row + её номер в SERVICES; "rows": {услуга: строка} — для шаблонов с другим порядком
+    "services": {"start_row": SERVICES_START_ROW, "qty": COL_QTY, "price": COL_PRICE, "cost": COL_COST},
+}
+
+
+class TemplateLayout:
+    """Описание шаблона в координатах: поле -> (строка, столбец), услуга -> ячейки кол-ва, цены и суммы."""
+
+    __slots__ = ("title", "sheet", "a5", "landscape", "cells", "services")
+
+    def __init__(self, raw: dict):
+        unknown = set(raw.get("cells", {})) - set(DEFAULT_LAYOUT["cells"])
+        if unknown:
+            raise ValueError(f"неизвестные поля: {', '.join(sorted(unknown))}")
+        self.title = raw.get("title", "")
+        self.sheet = raw.get("sheet")  # по умолчанию — активный лист
+        pdf = raw.get("pdf", {})
+        self.a5 = bool(pdf.get("a5", True))
+        self.landscape = bool(pdf.get("landscape", False))
+        self.cells = {field: coordinate_to_tuple(ref) for field, ref in raw.get("cells", {}).items()}
+        svc = raw.get("services", {})
+        cols = [column_index_from_string(svc[k]) for k in ("qty", "price", "cost")] if svc else []
+        rows = svc.get("rows") or ({name: svc["start_row"] + i for i, name in enumerate(SERVICES)} if "start_row" in svc else {})
+        self.services = [(name, tuple((rows[name], c) for c in cols)) for name in SERVICES if name in rows]
+
+    @property
+    def touched(self) -> list[tuple[int, int]]:
+        return [*self.cells.values(), *(rc for _, cells in self.services for rc in cells)]
+
+
+def read_template_layout(path: Path) -> dict:
+    """Описание шаблона из <имя>.layout.json; нет файла — DEFAULT_LAYOUT."""
+    layout_path = path.with_name(path.stem + TEMPLATE_LAYOUT_SUFFIX)
+    if not layout_path.exists():
+        return DEFAULT_LAYOUT
     try:
-        return int(v)
+        return json.loads(layout_path.read_text(encoding="utf-8"))
+    except ValueError as e:
+        raise ValueError(f"Ошибка в описании шаблона {layout_path.name}: {e}") from e
+
+
+DEFAULT_TEMPLATE_LAYOUT = TemplateLayout(DEFAULT_LAYOUT)
+
+
+class CachedTemplate:
+    """Разобранная книга шаблона, её описание и исходные значения ячеек, которые пишет наряд."""
+
+    def __init__(self, path: Path, sig):
+        self.sig = sig
+        try:
+            self.layout = TemplateLayout(read_template_layout(path))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Ошибка в описании шаблона {path.stem}: {e}") from e
+        self.workbook = load_workbook(path)
+        # версия по содержимому книги и описания — ключ кеша готовых нарядов не зависит от дат файлов
+        digest = hashlib.sha256(path.read_bytes())
+        layout_path = path.with_name(path.stem + TEMPLATE_LAYOUT_SUFFIX)
+        if layout_path.exists():
+            digest.update(layout_path.read_bytes())
+        self.version = digest.hexdigest()[:16]
+        # openpyxl читает картинку (логотип) из ref при сохранении и закрывает его — держим байты
+        # и перед каждым сохранением даём свежий буфер, иначе книгу можно сохранить только один раз
+        self._images = [(img, img._data()) for ws in self.workbook.worksheets for img in getattr(ws, "_images", [])]
+        self.sheet = self.workbook[self.layout.sheet] if self.layout.sheet else self.workbook.active
+        merged = [f"{get_column_letter(c)}{r}" for r, c in self.layout.touched if isinstance(self.sheet.cell(r, c), MergedCell)]
+        if merged:
+            raise ValueError(f"Ошибка в описании шаблона {path.stem}: ячейки {', '.join(merged)} внутри объединённых "
+                             f"— укажите левую верхнюю ячейку области")
+        self._originals = [(rc, self.sheet.cell(*rc).value) for rc in self.layout.touched]
+        self.lock = threading.Lock()  # книга одна на все наряды этого шаблона
+        self.restore()
+
+    def restore(self):
+        """Вернуть книгу к виду шаблона после сохранения наряда."""
+        for (row, col), value in self._originals:
+            self.sheet.cell(row, col).value = value
+        for img, data in self._images:
+            img.ref = io.BytesIO(data)
+
+
+class TemplateRegistry:
+    """Шаблоны из папки templates; книга перечитывается, только если поменялся xlsx или его описание."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self._cache: dict[str, CachedTemplate] = {}
+        self._lock = threading.Lock()
+
+    def names(self) -> list[str]:
+        return sorted(p.stem for p in self.directory.glob("*.xlsx") if not p.name.startswith(("~$", ".")))
+
+    def title(self, name: str) -> str:
+        try:
+            return read_template_layout(self.directory / f"{name}.xlsx").get("title") or name
+        except ValueError:
+            return name
+
+    def get(self, name: str) -> CachedTemplate:
+        path = self.directory / f"{name}.xlsx"
+        sig = (_file_signature(path), _file_signature(path.with_name(name + TEMPLATE_LAYOUT_SUFFIX)))
+        if sig[0] is None:
+            raise FileNotFoundError(f"Не найден шаблон: {path}")
+        with self._lock:
+            tpl = self._cache.get(name)
+            hit = tpl is not None and tpl.sig == sig
+            METRICS.cache("template", hit)
+            if not hit:
+                with METRICS.span("template.load"):
+                    tpl = self._cache[name] = CachedTemplate(path, sig)
+        return tpl
+
+
+TEMPLATES = TemplateRegistry(TEMPLATES_DIR)
+
+
+@METRICS.timed("template.fill")
+def _write_to_excel(ws, data: dict, layout: TemplateLayout | None = None) -> int:
+    layout = layout or DEFAULT_TEMPLATE_LAYOUT
+    plate_text = data.get("plate", "")
+    trailer = data.get("trailer", "")
+    if trailer and trailer != "Без прицепа":
+        plate_text = f"{plate_text}, {trailer}" if plate_text else trailer
+    defect_value = data["defect"]
+    services = data["services"]
+    total = 0
+    for service_name in SERVICES:
+        detail = services.get(service_name, {})
+        total += detail.get("cost", detail.get("qty", 0) * detail.get("price", 0))
+    values = {
+        "customer": data["customer_display"],
+        "plate": plate_text,
+        "driver": data["driver_name"],
+        "defect_line1": "" if defect_value == "Пропустить" else defect_value,
+        "defect_line2": "",
+        "issued_to": data["issued_to"],
+        "date": datetime.datetime.now().strftime("%d.%m.%Y"),
+        "mechanic": data["mechanic"],
+        "number": data.get("number", ""),
+        "total_num": total,
+        "total_text": make_total_text(total),
+    }
+    cell = ws.cell
+    for field, (row, col) in layout.cells.items():
+        cell(row, col).value = values[field]
+    for service_name, cells in layout.services:
+        detail = services.get(service_name, {})
+        qty = detail.get("qty", 0)
+        price = detail.get("price", 0)
+        cost = detail.get("cost", qty * price)
+        for (row, col), value in zip(cells, (qty, price, cost)):
+            cell(row, col).value = value if qty else ""
+    return total
+
+def _fill_template(data: dict) -> tuple[Path, TemplateLayout]:
+    tpl = TEMPLATES.get(data.get("template") or DEFAULT_TEMPLATE)
+    series = order_series()
+    n = ORDER_NUMBERS.allocate(series)
+    data["number"] = format_order_number(series, n)
+    xlsx_out = OUTPUT_DIR / f"наряд_{data['number']}.xlsx"
+    try:
+        with tpl.lock:
+            try:
+                _write_to_excel(tpl.sheet, data, tpl.layout)
+                with METRICS.span("save"):
+                    tpl.workbook.save(xlsx_out)
+            finally:
+                tpl.restore()
+    except BaseException:
+        ORDER_NUMBERS.release(series, n)
+        raise
+    record = write_order_record(xlsx_out, data)
+    try:
+        ORDER_INDEX.add(xlsx_out, record)
     except Exception:
-        return 0
+        pass  # индекс поиска досинхронизируется при следующем открытии окна поиска
+    return xlsx_out, tpl.layout
 
-def load_price_table():
-    price = {"Легковой": {}, "Грузовой": {}}
-    if not PRICE_XLSX.exists():
-        return price
-    wb = load_workbook(PRICE_XLSX, data_only=True)
-    ws = wb.active
-    rows = list(ws.iter_rows(values_only=True))
-    if len(rows) < 3:
-        return price
-    # Определим столбцы цен для грузовых и легковых
-    header = rows[0]
-    truck_col = header.index("Грузовой") + 1 if "Грузовой" in header else 1
-    car_col = header.index("Легковой") + 1 if "Легковой" in header else 9
-    for r in rows[2:]:
-        name = str(r[0]).strip() if r and r[0] else ""
-        if not name:
-            continue
-        price["Грузовой"][name] = _parse_price_value(r[truck_col] if truck_col < len(r) else 0)
-        price["Легковой"][name] = _parse_price_value(r[car_col] if car_col < len(r) else 0)
-    return price
+def fill_excel_only(data: dict) -> Path:
+    return _fill_template(data)[0]
 
-def load_consumables_table():
-    data = {}
-    categories = []
-    if not CONSUMABLES_XLSX.exists():
-        return data, categories
-    wb = load_workbook(CONSUMABLES_XLSX, data_only=True)
-    ws = wb.active
-    rows = list(ws.iter_rows(values_only=True))
-    if len(rows) < 3:
-        return data, categories
-    header1 = rows[0]
-    header2 = rows[1]
-    for i in range(2, len(header1), 2):
-        cat = header1[i]
-        if cat:
-            categories.append(str(cat).strip())
-    for row in rows[2:]:
-        kind = row[0]
-        name = row[1]
-        if not kind or not name:
+def fill_excel_and_export_pdf(data: dict) -> tuple[Path, Path]:
+    key = order_fingerprint(data, TEMPLATES.get(data.get("template") or DEFAULT_TEMPLATE).version)  # до выдачи номера
+    xlsx_out, layout = _fill_template(data)
+    pdf_out = xlsx_out.with_suffix(".pdf")
+    with METRICS.span("pdf.export"):
+        ok = PDF_CONVERTER.convert(xlsx_out, pdf_out, a5=layout.a5, landscape=layout.landscape)
+    if not ok:
+        raise PdfQueuedError(xlsx_out, pdf_out, PDF_OUTBOX.enqueue(xlsx_out, pdf_out, layout.a5, layout.landscape))
+    try:
+        ARTIFACTS.put(key, {"order.xlsx": xlsx_out, "order.pdf": pdf_out},
+                      {"number": data.get("number", ""), "xlsx": str(xlsx_out), "pdf": str(pdf_out)})
+    except OSError:
+        pass  # без кеша повторная печать просто соберёт наряд заново
+    return xlsx_out, pdf_out
+
+# === Очередь PDF ===
+# Если ни Excel, ни LibreOffice не сделали PDF, xlsx уже сохранён: задание ложится файлом в LOCAL_DIR/outbox
+# и переживает перезапуск программы. Фоновый поток повторяет его с нарастающей паузой; как только конвертер
+# снова заработал, остальные задания разбираются пачками (LibreOffice конвертирует пачку одним запуском).
+OUTBOX_DIR = LOCAL_DIR / "outbox"
+OUTBOX_RETRY_MIN_SEC = 30        # первая пауза; дальше удваивается
+OUTBOX_RETRY_MAX_SEC = 15 * 60
+OUTBOX_BATCH = 20
+OUTBOX_CONVERT_TIMEOUT_SEC = 300
+
+
+class PdfQueuedError(RuntimeError):
+    """PDF сразу не создан: xlsx сохранён, конвертация стоит в очереди."""
+
+    def __init__(self, xlsx_path: Path, pdf_path: Path, pending: int):
+        super().__init__(f"PDF не создан, задание в очереди (всего в очереди: {pending})")
+        self.xlsx_path = xlsx_path
+        self.pdf_path = pdf_path
+        self.pending = pending
+
+
+def export_pdf_batch(jobs: list[dict]) -> list[bool]:
+    """Пачка заданий очереди: Excel — по файлу, а если он не справился — LibreOffice, один запуск на папку."""
+    done = [False] * len(jobs)
+    for i, job in enumerate(jobs):
+        done[i] = PDF_CONVERTER.excel(Path(job["xlsx"]), Path(job["pdf"]), a5=job["a5"], landscape=job["landscape"])
+        if not done[i]:
+            break  # Excel недоступен — остальное отдаём LibreOffice
+    by_dir = collections.defaultdict(list)
+    for i, job in enumerate(jobs):
+        if not done[i]:
+            by_dir[Path(job["pdf"]).parent].append(i)
+    for outdir, idx in by_dir.items():
+        cmd = soffice_command(outdir, [jobs[i]["xlsx"] for i in idx])
+        try:
+            with _SOFFICE_LOCK:
+                subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=OUTBOX_CONVERT_TIMEOUT_SEC)
+        except Exception:
+            pass  # часть файлов могла сконвертироваться — смотрим по результату
+        for i in idx:
+            produced = outdir / (Path(jobs[i]["xlsx"]).stem + ".pdf")
+            if produced.exists():
+                pdf = Path(jobs[i]["pdf"])
+                if produced != pdf:
+                    produced.replace(pdf)
+                done[i] = True
+    return done
+
+
+class PdfOutbox:
+    """Задания на PDF — по JSON-файлу на задание — и поток, который их повторяет."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self._cond = threading.Condition()
+        self._jobs: dict[str, dict] = {}
+        self._failing = True  # пока конвертер не отработал, пробуем по одному заданию, а не пачкой
+        self._stop = False
+        self._thread = None
+        self.done: queue.Queue = queue.Queue()  # пути готовых PDF — для уведомления в окне
+
+    def _path(self, job: dict) -> Path:
+        return self.directory / f"{job['id']}.json"
+
+    def _save(self, job: dict):
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp = self._path(job).with_suffix(".tmp")
+            tmp.write_text(json.dumps(job, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, self._path(job))
+        except OSError:
+            pass  # задание остаётся в памяти до конца работы программы
+
+    def _drop(self, job: dict):
+        self._jobs.pop(job["id"], None)
+        self._path(job).unlink(missing_ok=True)
+
+    def start(self):
+        with self._cond:
+            for path in self.directory.glob("*.json"):
+                try:
+                    job = json.loads(path.read_text(encoding="utf-8"))
+                    self._jobs[job["id"]] = job
+                except (OSError, ValueError, KeyError):
+                    continue
+            for job in list(self._jobs.values()):
+                if Path(job["pdf"]).exists() or not Path(job["xlsx"]).exists():
+                    self._drop(job)
+        self._thread = threading.Thread(target=self._run, name="pdf-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+
+    def enqueue(self, xlsx_path: Path, pdf_path: Path, a5: bool = True, landscape: bool = False) -> int:
+        """Поставить конвертацию в очередь (первая попытка уже была); возвращает размер очереди."""
+        now = time.time()
+        job = {"id": xlsx_path.stem, "xlsx": str(xlsx_path), "pdf": str(pdf_path), "a5": a5, "landscape": landscape,
+               "created": now, "attempts": 1, "next_try": now + OUTBOX_RETRY_MIN_SEC}
+        with self._cond:
+            self._jobs[job["id"]] = job
+            self._save(job)
+            self._cond.notify_all()
+            return len(self._jobs)
+
+    def kick(self):
+        """Повторить все задания сейчас, не дожидаясь паузы."""
+        with self._cond:
+            for job in self._jobs.values():
+                job["next_try"] = 0
+            self._cond.notify_all()
+
+    def status(self) -> tuple[int, float]:
+        """(заданий в очереди, секунд до следующей попытки)."""
+        with self._cond:
+            if not self._jobs:
+                return 0, 0.0
+            return len(self._jobs), max(0.0, min(j["next_try"] for j in self._jobs.values()) - time.time())
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stop:
+                    now = time.time()
+                    due = sorted((j for j in self._jobs.values() if j["next_try"] <= now), key=lambda j: j["created"])
+                    if due:
+                        break
+                    wake = min((j["next_try"] for j in self._jobs.values()), default=now + 3600)
+                    self._cond.wait(max(0.05, wake - now))
+                if self._stop:
+                    return
+                batch = [dict(j) for j in due[:1 if self._failing else OUTBOX_BATCH]]
+            self._attempt(batch)
+
+    def _attempt(self, batch: list[dict]):
+        live = [j for j in batch if Path(j["xlsx"]).exists()]
+        try:
+            ok = export_pdf_batch(live) if live else []
+        except Exception:
+            ok = [False] * len(live)
+        with self._cond:
+            now = time.time()
+            results = dict(zip((j["id"] for j in live), ok))
+            for job in batch:
+                current = self._jobs.get(job["id"])
+                if current is None:
+                    continue
+                if job["id"] not in results:  # xlsx удалили — конвертировать нечего
+                    self._drop(current)
+                elif results[job["id"]]:
+                    self._drop(current)
+                    self.done.put(current["pdf"])
+                else:
+                    current["attempts"] += 1
+                    current["next_try"] = now + min(OUTBOX_RETRY_MAX_SEC, OUTBOX_RETRY_MIN_SEC * 2 ** (current["attempts"] - 2))
+                    self._save(current)
+            if live:
+                self._failing = not any(ok)
+            others = [job for job in self._jobs.values() if job["id"] not in results]
+            if any(ok):  # конвертер снова работает — остальное разбираем сразу, пачками
+                for job in others:
+                    job["next_try"] = min(job["next_try"], now)
+            elif live:  # не работает — остальные ждут ту же паузу, что и пробное задание
+                resume = max(self._jobs[j["id"]]["next_try"] for j in live if j["id"] in self._jobs)
+                for job in others:
+                    job["next_try"] = max(job["next_try"], resume)
+
+
+PDF_OUTBOX = PdfOutbox(OUTBOX_DIR)
+
+# === Кеш готовых нарядов (повторная печать) ===
+# Готовые xlsx и PDF лежат в LOCAL_DIR/artifacts под ключом — sha256 от нормализованных данных наряда,
+# даты бланка и версии шаблона. Тот же наряд в тот же день печатается повторно из кеша, без нового номера,
+# записи xlsx и конвертации. Кеш ограничен по размеру: при переполнении удаляются давно не открывавшиеся записи.
+ARTIFACT_DIR = LOCAL_DIR / "artifacts"
+ARTIFACT_MAX_BYTES = 512 * 1024 * 1024
+_ORDER_KEY_SKIP = ("number", "created")  # выдаются заново при каждом создании наряда
+
+
+def order_fingerprint(data: dict, template_version: str) -> str:
+    norm = {k: v.strip() if isinstance(v, str) else v for k, v in data.items() if k not in _ORDER_KEY_SKIP}
+    norm["day"] = (data.get("created") or datetime.date.today().isoformat())[:10]  # дата печатается на бланке
+    norm["template_version"] = template_version
+    blob = json.dumps(norm, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ArtifactCache:
+    """Записи <ключ[:2]>/<ключ>/: копии файлов и meta.json. Время обращения — mtime meta.json (для LRU)."""
+
+    def __init__(self, directory: Path, max_bytes: int = ARTIFACT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = None  # каталог записи -> [время обращения, размер]; читается с диска при первой записи
+
+    def _entry(self, key: str) -> Path:
+        return self.directory / key[:2] / key
+
+    def get(self, key: str) -> dict | None:
+        """meta записи с полем "paths" {имя: путь в кеше} или None; попадание продлевает жизнь записи."""
+        entry = self._entry(key)
+        try:
+            meta = json.loads((entry / "meta.json").read_text(encoding="utf-8"))
+            paths = {name: entry / name for name in meta["files"]}
+            if not all(p.exists() for p in paths.values()):
+                raise FileNotFoundError(entry)
+            os.utime(entry / "meta.json")
+        except (OSError, ValueError, KeyError):
+            METRICS.cache("artifact", False)
+            return None
+        METRICS.cache("artifact", True)
+        with self._lock:
+            if self._entries is not None and entry in self._entries:
+                self._entries[entry][0] = time.time()
+        return {**meta, "paths": paths}
+
+    def put(self, key: str, files: dict[str, Path], meta: dict):
+        """Положить копии files ({имя в записи: исходный файл}) и meta; запись заменяется целиком."""
+        entry = self._entry(key)
+        tmp = entry.with_name(f".{key}.{os.getpid()}.tmp")
+        with self._lock:
+            self._load_entries()
+            shutil.rmtree(tmp, ignore_errors=True)
+            tmp.mkdir(parents=True)
+            try:
+                for name, src in files.items():
+                    shutil.copyfile(src, tmp / name)
+                (tmp / "meta.json").write_text(json.dumps({**meta, "files": list(files)}, ensure_ascii=False), encoding="utf-8")
+                shutil.rmtree(entry, ignore_errors=True)
+                os.replace(tmp, entry)
+            except BaseException:
+                shutil.rmtree(tmp, ignore_errors=True)
+                raise
+            self._entries[entry] = [time.time(), self._size(entry)]
+            self._evict()
+
+    @staticmethod
+    def _size(entry: Path) -> int:
+        return sum(f.stat().st_size for f in entry.iterdir())
+
+    def _load_entries(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        for meta in self.directory.glob("*/*/meta.json"):
+            try:
+                self._entries[meta.parent] = [meta.stat().st_mtime, self._size(meta.parent)]
+            except OSError:
+                pass
+
+    def _evict(self):
+        total = sum(size for _, size in self._entries.values())
+        for entry, (_, size) in sorted(self._entries.items(), key=lambda item: item[1][0]):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            del self._entries[entry]
+            total -= size
+
+    @staticmethod
+    def restore(cached: dict) -> tuple[Path, Path]:
+        """(xlsx, pdf) наряда из кеша: исходные файлы в output, а если их удалили — возвращаются копии оттуда."""
+        out = []
+        for name, key in (("order.xlsx", "xlsx"), ("order.pdf", "pdf")):
+            original, copy = Path(cached[key]), cached["paths"][name]
+            try:
+                if not original.exists():
+                    shutil.copyfile(copy, original)
+                out.append(original)
+            except OSError:
+                out.append(copy)
+        return out[0], out[1]
+
+
+ARTIFACTS = ArtifactCache(ARTIFACT_DIR)
+
+
+def find_reprint(data: dict) -> tuple[dict, Path, Path] | None:
+    """Уже сформированный наряд с теми же данными, датой и шаблоном: (meta, xlsx, pdf) или None."""
+    try:
+        version = TEMPLATES.get(data.get("template") or DEFAULT_TEMPLATE).version
+    except (OSError, ValueError):
+        return None
+    cached = ARTIFACTS.get(order_fingerprint(data, version))
+    if cached is None:
+        return None
+    return (cached, *ARTIFACTS.restore(cached))
+
+
+# === Выгрузка для бухгалтерии ===
+# Наряды за период -> CSV / JSONL (можно .gz) или parquet: одна строка на услугу.
+# Всё идёт генераторами: в памяти одновременно держится не больше EXPORT_BATCH строк и окно разбираемых xlsx.
+EXPORT_COLUMNS = ("number", "date", "customer", "inn", "plate", "trailer", "vehicle_type",
+                  "service", "qty", "price", "cost", "order_total", "file")
+EXPORT_FORMATS = ("csv", "jsonl", "parquet")
+EXPORT_BATCH = 5000
+EXPORT_XLSX_WINDOW = 4  # сколько xlsx в работе на один процесс
+# Первые столько xlsx без JSON разбираются в своём процессе: запуск пула (на Windows — с повторным
+# импортом main.py, pandas и Tk) дороже разбора нескольких файлов. Пул поднимается на следующем.
+EXPORT_POOL_MIN_FILES = 20
+
+
+def read_order_xlsx(path: Path) -> dict | None:
+    """Наряд из готового xlsx (для нарядов без JSON рядом): обратная операция к _write_to_excel."""
+    layout = DEFAULT_TEMPLATE_LAYOUT
+    try:
+        wb = load_workbook(path, read_only=True, data_only=True)
+    except Exception:
+        return None
+    try:
+        ws = wb[layout.sheet] if layout.sheet else wb.active
+        last_row = max(r for r, _ in layout.touched)
+        grid = [row for row in ws.iter_rows(max_row=last_row, values_only=True)]
+    finally:
+        wb.close()
+
+    def value(row, col):
+        line = grid[row - 1] if row <= len(grid) else ()
+        return line[col - 1] if col <= len(line) else None
+
+    cells = {field: value(r, c) for field, (r, c) in layout.cells.items()}
+    try:
+        day = datetime.datetime.strptime(str(cells.get("date") or ""), "%d.%m.%Y").date().isoformat()
+    except ValueError:
+        day = datetime.date.fromtimestamp(path.stat().st_mtime).isoformat()
+    plate, _, trailer = str(cells.get("plate") or "").partition(", ")
+    services = {}
+    for name, triple in layout.services:
+        qty, price, cost = (value(r, c) for r, c in triple)
+        if qty not in (None, "", 0):
+            services[name] = {"qty": qty, "price": price or 0, "cost": cost or 0}
+    text = {field: str(cells.get(field) or "") for field in ("number", "customer", "driver", "defect_line1", "issued_to", "mechanic")}
+    return {
+        "created": day,
+        "number": text["number"],
+        "customer_display": text["customer"],
+        "plate": plate,
+        "trailer": trailer,
+        "driver_name": text["driver"],
+        "defect": text["defect_line1"],
+        "issued_to": text["issued_to"],
+        "mechanic": text["mechanic"],
+        "services": services,
+    }
+
+
+def _order_day(order: dict) -> str:
+    return (order.get("created") or "")[:10]
+
+def load_orders(paths, workers: int | None = None):
+    """(путь xlsx, наряд или None) по порядку paths: JSON рядом с xlsx или, для нарядов старых версий, сам xlsx.
+
+    Первые EXPORT_POOL_MIN_FILES xlsx разбираются на месте; если их больше — остальные параллельно
+    в процессах, и в работе держится не больше workers*EXPORT_XLSX_WINDOW файлов.
+    """
+    workers = workers or os.cpu_count() or 1
+    pool, in_place = None, 0
+    window = collections.deque()
+    try:
+        for xlsx in paths:
+            record = xlsx.with_suffix(".json")
+            if record.exists():
+                try:
+                    order = json.loads(record.read_text(encoding="utf-8"))
+                except Exception:
+                    order = None
+            elif pool is None and (workers == 1 or in_place < EXPORT_POOL_MIN_FILES):
+                in_place += 1
+                order = read_order_xlsx(xlsx)
+            else:
+                if pool is None:
+                    pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+                order = pool.submit(read_order_xlsx, xlsx)
+            window.append((xlsx, order))
+            while window and (len(window) > workers * EXPORT_XLSX_WINDOW or not isinstance(window[0][1], concurrent.futures.Future)):
+                yield _order_result(window.popleft())
+        while window:
+            yield _order_result(window.popleft())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+def _order_result(item):
+    xlsx, order = item
+    return xlsx, order.result() if isinstance(order, concurrent.futures.Future) else order
+
+def iter_orders(date_from: str | None = None, date_to: str | None = None, folder: Path | None = None, workers: int | None = None):
+    """(путь, наряд) за период [date_from, date_to] из папки нарядов, по порядку имён файлов."""
+    folder = folder or OUTPUT_DIR
+    lo, hi = date_from or "", date_to or "9999-12-31"
+
+    def candidates():
+        for xlsx in sorted(folder.glob("наряд_*.xlsx")):
+            # файл не может быть изменён раньше, чем создан наряд: старые xlsx без JSON не открываем
+            if xlsx.with_suffix(".json").exists() or datetime.date.fromtimestamp(xlsx.stat().st_mtime).isoformat() >= lo:
+                yield xlsx
+
+    for xlsx, order in load_orders(candidates(), workers):
+        if order is not None and lo <= _order_day(order) <= hi:
+            yield xlsx, order
+
+
+def export_rows(orders):
+    """Строки выгрузки (по EXPORT_COLUMNS) из потока (путь, наряд); ИНН — из справочника COMPANIES."""
+    for xlsx, order in orders:
+        customer = order.get("customer_display", "")
+        meta = COMPANIES.get(customer)
+        services = order.get("services", {})
+        head = (order.get("number", ""), _order_day(order), customer, meta.inn if meta is not None else "",
+                order.get("plate", ""), order.get("trailer", ""), order.get("vehicle_type", ""))
+        total = sum(s.get("cost", 0) for s in services.values())
+        for name, s in services.items():
+            line = (name, s.get("qty", 0), s.get("price", 0), s.get("cost", 0), total, xlsx.name)
+            yield dict(zip(EXPORT_COLUMNS, head + line))
+
+
+def _export_format(path: Path, fmt: str | None) -> tuple[str, bool]:
+    suffixes = [s.lower() for s in path.suffixes]
+    gz = bool(suffixes) and suffixes[-1] == ".gz"
+    fmt = fmt or (suffixes[-2 if gz else -1].lstrip(".") if len(suffixes) > gz else "csv")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt} (есть: {', '.join(EXPORT_FORMATS)})")
+    return fmt, gz
+
+def _open_export(path: Path, fmt: str, gz: bool):
+    encoding = "utf-8-sig" if fmt == "csv" else "utf-8"  # BOM — чтобы Excel открыл CSV в UTF-8
+    if gz:
+        import gzip
+        return gzip.open(path, "wt", encoding=encoding, newline="")
+    return open(path, "w", encoding=encoding, newline="")
+
+def _write_parquet(rows, path: Path) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Для выгрузки в parquet нужен пакет pyarrow (pip install pyarrow)") from None
+    text, number = pa.string(), pa.float64()
+    schema = pa.schema([(c, number if c in ("qty", "price", "cost", "order_total") else text) for c in EXPORT_COLUMNS])
+    n = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= EXPORT_BATCH:
+                writer.write_table(pa.Table.from_pylist(batch, schema))
+                n += len(batch)
+                batch = []
+        if batch or not n:
+            writer.write_table(pa.Table.from_pylist(batch, schema))
+            n += len(batch)
+    return n
+
+@METRICS.timed("export.orders")
+def export_orders(path: Path, date_from: str | None = None, date_to: str | None = None, fmt: str | None = None,
+                  folder: Path | None = None) -> int:
+    """Выгрузить наряды за период в path (формат — по расширению или fmt); возвращает число строк."""
+    path = Path(path)
+    fmt, gz = _export_format(path, fmt)
+    rows = export_rows(iter_orders(date_from, date_to, folder))
+    tmp = path.with_name(f".{path.name}.tmp")
+    try:
+        if fmt == "parquet":
+            n = _write_parquet(rows, tmp)
+        else:
+            n = 0
+            with _open_export(tmp, fmt, gz) as f:
+                if fmt == "csv":
+                    writer = csv.DictWriter(f, EXPORT_COLUMNS, delimiter=";")  # «;» — как ждёт Excel с русской локалью
+                    writer.writeheader()
+                    for row in rows:
+                        writer.writerow(row)
+                        n += 1
+                else:
+                    for row in rows:
+                        f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                        n += 1
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return n
+
+
+# === Поиск по нарядам ===
+# Полнотекстовый индекс SQLite FTS5 по готовым нарядам: заказчик, номера, водитель, неисправность,
+# механик и услуги. Новый наряд попадает в индекс сразу при создании, остальное — досинхронизацией папки.
+ORDER_INDEX_FILE = LOCAL_DIR / "orders_index.sqlite"
+ORDER_INDEX_BATCH = 500  # нарядов на транзакцию при синхронизации
+ORDER_SEARCH_LIMIT = 200
+_RE_SEARCH_TOKEN = re.compile(r"\w+")
+
+
+class OrderIndex:
+    """Индекс нарядов одной папки (ключ — имя xlsx). Потокобезопасен: запросы идут под общей блокировкой.
+
+    Кроме полнотекстового поиска хранит сам наряд (record) с ключом по каноническому номеру машины —
+    для «повторить последний наряд» без чтения папки.
+    """
+
+    VERSION = 2  # индекс — производные данные: при смене схемы он пересоздаётся и заполняется sync()
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS orders(
+            id INTEGER PRIMARY KEY, file TEXT UNIQUE NOT NULL, mtime REAL,
+            created TEXT, number TEXT, customer TEXT, plate TEXT, total INTEGER,
+            plate_key TEXT, record TEXT);
+        CREATE INDEX IF NOT EXISTS orders_created ON orders(created);
+        CREATE INDEX IF NOT EXISTS orders_plate ON orders(plate_key, created);
+        CREATE VIRTUAL TABLE IF NOT EXISTS orders_fts USING fts5(
+            customer, plate, driver, defect, mechanic, services, tokenize="unicode61 remove_diacritics 2");
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._db = None
+
+    def _conn(self):
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            if db.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+                db.executescript(f"DROP TABLE IF EXISTS orders; DROP TABLE IF EXISTS orders_fts; PRAGMA user_version = {self.VERSION};")
+            db.executescript(self.SCHEMA)
+            self._db = db
+        return self._db
+
+    def close(self):
+        with self.lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    @staticmethod
+    def _document(order: dict) -> tuple:
+        plate, trailer = order.get("plate", ""), order.get("trailer", "")
+        # кроме номера как есть — канонический вид и без региона: находится и «a123bc», и «А123ВС77»
+        plates = [p for p in (plate, trailer) if p]
+        plates = list(dict.fromkeys(plates + [form for p in plates for form in canonical_plate(p)]))
+        services = []
+        for name, s in order.get("services", {}).items():
+            services.append(name)
+            services.extend(str(item[0]) for item in s.get("items", []))
+        return (order.get("customer_display", ""), " ".join(plates), order.get("driver_name", ""),
+                order.get("defect", ""), order.get("mechanic", ""), " ".join(services))
+
+    def _put(self, db, name: str, mtime: float, order: dict):
+        row = db.execute("SELECT id FROM orders WHERE file = ?", (name,)).fetchone()
+        if row:
+            db.execute("DELETE FROM orders_fts WHERE rowid = ?", row)
+            db.execute("DELETE FROM orders WHERE id = ?", row)
+        plate = ", ".join(p for p in (order.get("plate", ""), order.get("trailer", "")) if p)
+        total = sum(s.get("cost", 0) for s in order.get("services", {}).values())
+        cur = db.execute("INSERT INTO orders(file, mtime, created, number, customer, plate, total, plate_key, record)"
+                         " VALUES (?,?,?,?,?,?,?,?,?)",
+                         (name, mtime, _order_day(order), order.get("number", ""), order.get("customer_display", ""), plate, total,
+                          self.plate_key(order.get("plate") or order.get("trailer", "")), json.dumps(order, ensure_ascii=False)))
+        db.execute("INSERT INTO orders_fts(rowid, customer, plate, driver, defect, mechanic, services) VALUES (?,?,?,?,?,?,?)",
+                   (cur.lastrowid, *self._document(order)))
+
+    def add(self, xlsx: Path, order: dict):
+        """Добавить (или обновить) один наряд — вызывается сразу после его создания."""
+        mtime = xlsx.stat().st_mtime
+        with self.lock:
+            db = self._conn()
+            with db:
+                self._put(db, xlsx.name, mtime, order)
+
+    @METRICS.timed("orders.index_sync")
+    def sync(self, folder: Path | None = None, workers: int | None = None) -> tuple[int, int]:
+        """Привести индекс к содержимому папки: новые и изменённые наряды добавить, удалённые убрать.
+
+        Возвращает (добавлено, удалено). Повторный вызов без изменений в папке только сверяет даты файлов.
+        """
+        folder = folder or OUTPUT_DIR
+        with self.lock:
+            known = dict(self._conn().execute("SELECT file, mtime FROM orders"))
+        changed, mtimes = [], {}
+        for xlsx in sorted(folder.glob("наряд_*.xlsx")):
+            mtimes[xlsx.name] = mtime = xlsx.stat().st_mtime
+            if known.get(xlsx.name) != mtime:
+                changed.append(xlsx)
+        removed = [name for name in known if name not in mtimes]
+        added = 0
+        pending = []
+
+        def flush():
+            with self.lock:
+                db = self._conn()
+                with db:
+                    for xlsx, order in pending:
+                        self._put(db, xlsx.name, mtimes[xlsx.name], order)
+            pending.clear()
+
+        for xlsx, order in load_orders(changed, workers):
+            if order is not None:
+                pending.append((xlsx, order))
+                added += 1
+            if len(pending) >= ORDER_INDEX_BATCH:
+                flush()
+        flush()
+        if removed:
+            with self.lock:
+                db = self._conn()
+                with db:
+                    for name in removed:
+                        row = db.execute("SELECT id FROM orders WHERE file = ?", (name,)).fetchone()
+                        if row is None:
+                            continue  # запись уже убрал параллельный sync (другой процесс с той же базой)
+                        db.execute("DELETE FROM orders_fts WHERE rowid = ?", row)
+                        db.execute("DELETE FROM orders WHERE id = ?", row)
+        return added, len(removed)
+
+    @staticmethod
+    def plate_key(plate: str) -> str:
+        return canonical_plate(plate)[0] if plate and plate.strip() else ""
+
+    def record(self, file: str) -> dict | None:
+        with self.lock:
+            row = self._conn().execute("SELECT record FROM orders WHERE file = ?", (file,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def last_for_plate(self, plate: str) -> dict | None:
+        """Самый свежий наряд на машину с этим номером (в любом написании) или None."""
+        key = self.plate_key(plate)
+        if not key:
+            return None
+        with self.lock:
+            row = self._conn().execute("SELECT record FROM orders WHERE plate_key = ? ORDER BY created DESC, id DESC LIMIT 1",
+                                       (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    @staticmethod
+    def match_expression(text: str) -> str:
+        """Запрос FTS5 из того, что ввёл оператор: все слова обязательны, каждое — как начало слова."""
+        terms = []
+        for token in _RE_SEARCH_TOKEN.findall(text):
+            if any(ch.isdigit() for ch in token) and not token.isdigit():
+                token = _plate_compact(token)  # похоже на номер: латиница → кириллица, как в индексе
+            terms.append('"' + token.replace('"', '""') + '"*')
+        return " AND ".join(terms)
+
+    @METRICS.timed("orders.search")
+    def search(self, text: str, date_from: str | None = None, date_to: str | None = None,
+               limit: int = ORDER_SEARCH_LIMIT) -> list[dict]:
+        """Наряды по запросу (пустой запрос — последние), новые сверху."""
+        where, params = ["o.created BETWEEN ? AND ?"], [date_from or "", date_to or "9999-12-31"]
+        expr = self.match_expression(text)
+        if expr:
+            sql = ("SELECT o.file, o.created, o.number, o.customer, o.plate, o.total,"
+                   " snippet(orders_fts, -1, '«', '»', '…', 8)"
+                   " FROM orders_fts JOIN orders o ON o.id = orders_fts.rowid WHERE orders_fts MATCH ? AND ")
+            params.insert(0, expr)
+        else:
+            sql = "SELECT o.file, o.created, o.number, o.customer, o.plate, o.total, '' FROM orders o WHERE "
+        sql += " AND ".join(where) + " ORDER BY o.created DESC, o.id DESC LIMIT ?"
+        params.append(limit)
+        with self.lock:
+            rows = self._conn().execute(sql, params).fetchall()
+        keys = ("file", "created", "number", "customer", "plate", "total", "snippet")
+        return [dict(zip(keys, row)) for row in rows]
+
+
+ORDER_INDEX = OrderIndex(ORDER_INDEX_FILE)
+
+
+def parse_search_day(text: str, end: bool = False) -> str | None:
+    """Граница периода поиска: «05.03.2025», «2025-03-05», месяц «03.2025» / «2025-03» или год «2025»."""
+    text = text.strip()
+    if not text:
+        return None
+    for fmt in ("%d.%m.%Y", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            pass
+    for fmt in ("%m.%Y", "%Y-%m", "%Y"):
+        try:
+            day = datetime.datetime.strptime(text, fmt).date()
+        except ValueError:
             continue
-        kind = str(kind).strip()
-        name = str(name).strip()
-        data.setdefault(kind, {}).setdefault(name, {})
-        for idx, cat in enumerate(categories):
-            base = 2 + idx*2
-            cold = row[base]
-            hot = row[base+1] if base+1 < len(row) else None
-            if cold not in (None, ""):
-                data[kind][name][(cat, "холодная")] = _parse_price_value(cold)
-            if hot not in (None, ""):
-                data[kind][name][(cat, "горячая")] = _parse_price_value(hot)
-    return data, categories
+        prefix = day.strftime("%Y") if fmt == "%Y" else day.strftime("%Y-%m")
+        # даты сравниваются как строки: «-99» — после любого дня периода
+        return prefix + ("-99" if end else "")
+    raise ValueError(f"Непонятная дата: {text}")
+
+
+# === Черновик наряда (автосохранение) ===
+DRAFT_FILE = LOCAL_DIR / "drafts" / "draft.json"
+DRAFT_DELAY_MS = 1000  # пауза после последнего изменения перед записью снимка
+
+
+class BackgroundJsonWriter:
+    """Пишет JSON-снимки (черновик, статистика выбора) в фоне. Tk-поток только отдаёт снимок
+    и сразу возвращается; если запись не успевает, промежуточные снимки схлопываются."""
+
+    _CLEAR = object()
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._cond = threading.Condition()
+        self._pending = None
+        self._busy = False
+        self._thread = threading.Thread(target=self._run, name=f"writer-{path.stem}", daemon=True)
+        self._thread.start()
+
+    def submit(self, snapshot: dict):
+        with self._cond:
+            self._pending = snapshot
+            self._cond.notify()
+
+    def clear(self):
+        self.submit(self._CLEAR)
+
+    def flush(self, timeout: float = 2.0):
+        """Дождаться записи последнего снимка (при закрытии приложения)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (self._pending is not None or self._busy) and time.monotonic() < deadline:
+                self._cond.wait(0.05)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                item, self._pending = self._pending, None
+                self._busy = True
+            try:
+                if item is self._CLEAR:
+                    self.path.unlink(missing_ok=True)
+                else:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    tmp = self.path.with_suffix(".tmp")
+                    tmp.write_text(json.dumps(item, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+                    os.replace(tmp, self.path)
+            except Exception:
+                pass  # вспомогательные файлы: ошибки записи не показываем
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+
+def load_draft(path: Path = DRAFT_FILE) -> dict | None:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+# === Статистика выбора компаний и номеров (для ранжирования и быстрого выбора) ===
+USAGE_FILE = LOCAL_DIR / "usage.json"
+USAGE_HALF_LIFE_DAYS = 30  # через месяц вес выбора уменьшается вдвое
+USAGE_MAX_ENTRIES = 1000
+QUICK_PICK_COUNT = 8
+
+
+class UsageStats:
+    """Счётчики выбора с экспоненциальным затуханием, свои для каждого рабочего места.
+
+    Хранится пара (вес, время последнего обновления); текущий вес = вес * 2^(-прошло/полураспад),
+    так что пересчитывать все записи при каждом заказе не нужно.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.companies: dict[str, list] = {}  # компания -> [вес, время]
+        self.plates: dict[str, list] = {}  # канонический номер -> [вес, время, компания, номер как в справочнике]
+        try:
+            raw = json.loads(path.read_text(encoding="utf-8"))
+            self.companies = {k: list(v) for k, v in raw.get("companies", {}).items()}
+            self.plates = {k: list(v) for k, v in raw.get("plates", {}).items()}
+        except Exception:
+            pass
+        self._writer = None
+
+    @staticmethod
+    def _decayed(entry, now: float) -> float:
+        return entry[0] * 0.5 ** ((now - entry[1]) / (USAGE_HALF_LIFE_DAYS * 86400))
+
+    def company_score(self, name: str, now: float | None = None) -> float:
+        entry = self.companies.get(name)
+        return self._decayed(entry, now or time.time()) if entry else 0.0
+
+    def record(self, company: str, plate: str = "", now: float | None = None):
+        now = now or time.time()
+        entry = self.companies.get(company)
+        self.companies[company] = [(self._decayed(entry, now) if entry else 0.0) + 1.0, now]
+        if plate:
+            key = canonical_plate(plate)[0]
+            entry = self.plates.get(key)
+            self.plates[key] = [(self._decayed(entry, now) if entry else 0.0) + 1.0, now, company, plate]
+        self._save(now)
+
+    def top_plates(self, n: int = QUICK_PICK_COUNT, visible=None) -> list[tuple[str, str]]:
+        """Самые частые (компания, номер) с учётом затухания."""
+        now = time.time()
+        ranked = sorted(self.plates.values(), key=lambda e: -self._decayed(e, now))
+        res = []
+        for e in ranked:
+            if visible is None or e[2] in visible:
+                res.append((e[2], e[3]))
+                if len(res) >= n:
+                    break
+        return res
 
-PRICE_TABLE = load_price_table()
-CONSUMABLES_TABLE, CONSUMABLE_CATEGORIES = load_consumables_table()
+    def _save(self, now: float):
+        for table in (self.companies, self.plates):
+            if len(table) > USAGE_MAX_ENTRIES:
+                keep = sorted(table, key=lambda k: -self._decayed(table[k], now))[:USAGE_MAX_ENTRIES]
+                for k in set(table) - set(keep):
+                    del table[k]
+        if self._writer is None:
+            self._writer = BackgroundJsonWriter(self.path)
+        self._writer.submit({"companies": dict(self.companies), "plates": dict(self.plates)})
 
-CONSUMABLE_SERVICE_MAP = {
-    "Пластырь №": "Пластырь",
-    "Грибок №": "Грибок",
-    "Удлинитель": "Удлинитель",
-    "Грузики": "Грузики",
-    "Флипер": "Флипер",
-    "Камера": "Камера",
-}
+    def flush(self):
+        if self._writer is not None:
+            self._writer.flush()
 
-SERVICE_PRICE_NAME = {
-    "Снятие/установка": "Снятие, установка наружное/внутреннее",
-    "Вентиль легковой": "Вентиль легковой (хром/черный)",
-    "Пластырь №": "Пластырь",
-    "Грибок №": "Грибок",
-    "Удлинитель": "Удлинитель ",
+
+USAGE = UsageStats(USAGE_FILE)
+
+
+# === Фоновая загрузка справочников ===
+# имя -> (загрузка, применение к глобальным переменным); загрузки друг от друга не зависят
+TABLE_LOADERS = {
+    "companies": (_load_companies_bundle, _set_companies),
+    "price": (load_price_versioned, _set_price),
+    "consumables": (load_consumables_versioned, _set_consumables),
 }
+TABLE_TITLES = {"companies": "компании", "price": "прайс", "consumables": "расходники"}
 
+STARTUP_TIMINGS: dict[str, float] = {}  # этап -> мс от старта процесса
 
-def filter_companies(query: str) -> list[str]:
-    q = str(query).strip().lower()
-    if not q:
-        return list(ALL_COMPANY_NAMES)
-    result = []
-    for name in ALL_COMPANY_NAMES:
-        meta = COMPANIES.get(name, {})
-        plates = meta.get("plates", [])
-        if q in name.lower() or any(q in p.lower() for p in plates):
-            result.append(name)
-    return result
 
+def _mark_startup(stage: str):
+    ms = (time.perf_counter() - _PROCESS_T0) * 1000
+    STARTUP_TIMINGS[stage] = ms
+    if METRICS.enabled:
+        METRICS.record(f"startup.{stage}", ms / 1000)
 
 
-def filter_companies(query: str) -> list[str]:
-    q = str(query).strip().lower()
-    if not q:
-        return list(ALL_COMPANY_NAMES)
-    result = []
-    for name in ALL_COMPANY_NAMES:
-        meta = COMPANIES.get(name, {})
-        plates = meta.get("plates", [])
-        if q in name.lower() or any(q in p.lower() for p in plates):
-            result.append(name)
-    return result
+def load_all_tables():
+    """Синхронно загрузить все справочники (для консольных команд и скриптов)."""
+    for load, apply in TABLE_LOADERS.values():
+        apply(load())
 
 
-def filter_companies(query: str) -> list[str]:
-    q = str(query).strip().lower()
-    if not q:
-        return list(ALL_COMPANY_NAMES)
-    result = []
-    for name in ALL_COMPANY_NAMES:
-        meta = COMPANIES.get(name, {})
-        plates = meta.get("plates", [])
-        if q in name.lower() or any(q in p.lower() for p in plates):
-            result.append(name)
-    return result
+class TableLoader:
+    """Читает справочники параллельно в фоновых потоках.
 
-# === Чек и текст суммы ===
-def ruble_suffix(n: int) -> str:
-    n_abs = abs(n) % 100
-    n1 = n_abs % 10
-    if 11 <= n_abs <= 19:
-        return "рублей"
-    if n1 == 1:
-        return "рубль"
-    if 2 <= n1 <= 4:
-        return "рубля"
-    return "рублей"
+    Результат применяется к глобальным переменным только в потоке Tk (опрос через after),
+    после чего вызывается on_loaded(name, error) — виджеты дозаполняются по мере готовности.
+    """
 
-def make_total_text(total: int) -> str:
-    words = num2words(total, lang='ru').capitalize()
-    return f"{words} {ruble_suffix(total)}"
+    POLL_MS = 50
 
-# === Экспорт PDF ===
-def export_pdf_via_excel(xlsx_path: Path, pdf_path: Path, a5: bool = True, landscape: bool = False) -> bool:
-    try:
-        import win32com.client as win32
-        from win32com.client import constants
-        excel = win32.DispatchEx("Excel.Application")
-        excel.Visible = False
-        wb = excel.Workbooks.Open(str(xlsx_path.resolve()))
-        ws = wb.Worksheets(1)
-        if a5:
-            ws.PageSetup.PaperSize = constants.xlPaperA5
-        ws.PageSetup.Orientation = constants.xlLandscape if landscape else constants.xlPortrait
-        xlTypePDF = 0
-        wb.ExportAsFixedFormat(xlTypePDF, str(pdf_path.resolve()))
-        wb.Close(SaveChanges=False)
-        excel.Quit()
-        return True
-    except Exception:
-        return False
+    def __init__(self, root, on_loaded):
+        self._root = root
+        self._on_loaded = on_loaded
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=len(TABLE_LOADERS), thread_name_prefix="naryad-load")
+        self._futures = {name: pool.submit(load) for name, (load, _) in TABLE_LOADERS.items()}
+        pool.shutdown(wait=False)
+        self.pending = set(self._futures)
+        self._root.after(self.POLL_MS, self._poll)
 
-def export_pdf_via_libreoffice(xlsx_path: Path, pdf_path: Path) -> bool:
+    def ready(self, name: str) -> bool:
+        return name not in self.pending
+
+    def wait(self, name: str):
+        """Дождаться справочника прямо сейчас (например, наряд сохраняют раньше, чем догрузился прайс)."""
+        if name in self.pending:
+            concurrent.futures.wait([self._futures[name]])
+            self._apply(name)
+
+    def _poll(self):
+        for name in [n for n in self.pending if self._futures[n].done()]:
+            self._apply(name)
+        if self.pending:
+            self._root.after(self.POLL_MS, self._poll)
+
+    def _apply(self, name: str):
+        self.pending.discard(name)
+        error = self._futures[name].exception()
+        if error is None:
+            TABLE_LOADERS[name][1](self._futures[name].result())
+        _mark_startup(f"loaded.{name}")
+        self._on_loaded(name, error)
+
+
+# === Слежение за папкой data (горячая перезагрузка справочников) ===
+WATCH_POLL_SEC = 1.0    # опрос подписей файлов, если inotify недоступен (Windows, сетевые папки)
+WATCH_IDLE_SEC = 5.0    # с inotify — контрольная проверка на случай пропущенного события
+WATCH_QUIET_SEC = 0.5   # файл перечитываем, только когда он перестал меняться: Excel пишет в несколько приёмов
+_OWN_WRITES: dict[str, tuple] = {}  # путь -> подпись файла сразу после нашей собственной записи
+
+# маски inotify (linux/inotify.h)
+_IN_CLOSE_WRITE, _IN_MOVED_FROM, _IN_MOVED_TO, _IN_CREATE, _IN_DELETE = 0x8, 0x40, 0x80, 0x100, 0x200
+
+
+def _file_signature(path) -> tuple | None:
     try:
-        outdir = pdf_path.parent
-        cmd = ["soffice", "--headless", "--convert-to", "pdf", "--outdir", str(outdir), str(xlsx_path.resolve())]
-        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        produced = outdir / (xlsx_path.stem + ".pdf")
-        if produced.exists():
-            if produced != pdf_path:
-                produced.replace(pdf_path)
-            return True
-        return False
-    except Exception:
-        return False
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
 
-# === Заполнение шаблона ===
 
-def _write_to_excel(ws, data: dict) -> int:
-    ws[CELL_CUSTOMER] = data["customer_display"]
-    plate_text = data.get("plate", "")
-    trailer = data.get("trailer", "")
-    if trailer and trailer != "Без прицепа":
-        plate_text = f"{plate_text}, {trailer}" if plate_text else trailer
-    ws[CELL_PLATE] = plate_text
-    ws[CELL_DRIVER] = data["driver_name"]
-    defect_value = data["defect"]
-    ws[CELL_DEFECT_LINE1] = "" if defect_value == "Пропустить" else defect_value
-    ws[CELL_DEFECT_LINE2] = ""
+def _note_own_write(path):
+    _OWN_WRITES[str(path)] = _file_signature(path)
 
-    ws[CELL_ISSUED_TO] = data["issued_to"]
-    ws[CELL_DATE] = datetime.datetime.now().strftime("%d.%m.%Y")
-    ws[CELL_MECHANIC] = data["mechanic"]
-    total = 0
-    for idx, service_name in enumerate(SERVICES):
-        row = SERVICES_START_ROW + idx
-        detail = data["services"].get(service_name, {})
-        qty = detail.get("qty", 0)
-        price = detail.get("price", 0)
-        cost = detail.get("cost", qty * price)
-        ws[f"{COL_QTY}{row}"] = qty if qty else ""
-        ws[f"{COL_PRICE}{row}"] = price if qty else ""
-        ws[f"{COL_COST}{row}"] = cost if qty else ""
-        total += cost
 
-    ws[CELL_TOTAL_NUM] = total
-    ws[CELL_TOTAL_TEXT] = make_total_text(total)
-    return total
+def _inotify_open(directory: Path) -> int | None:
+    """Дескриптор inotify на папку или None (не Linux, нет libc, исчерпан лимит наблюдателей)."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        mask = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+        if libc.inotify_add_watch(fd, os.fsencode(str(directory)), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+def diff_price_tables(old: dict, new: dict) -> set[tuple[str, str]]:
+    """Пары (тип авто, услуга), у которых цена появилась, пропала или изменилась."""
+    out = set()
+    for kind in old.keys() | new.keys():
+        o, n = old.get(kind, {}), new.get(kind, {})
+        out.update((kind, name) for name in o.keys() | n.keys() if o.get(name) != n.get(name))
+    return out
+
+
+class DataDirWatcher:
+    """Следит за справочниками в DATA_DIR и перечитывает только изменившийся файл.
+
+    Изменение определяется по подписи файла (mtime, размер); inotify только будит поток сразу,
+    без него подписи опрашиваются раз в WATCH_POLL_SEC. Прочитанные таблицы кладутся
+    в очередь changes как (имя справочника, результат загрузки) — применяет их поток Tk.
+    """
+
+    def __init__(self, files: dict[Path, str]):
+        self.files = files  # путь -> имя справочника из TABLE_LOADERS
+        self.changes = queue.Queue()
+        self._seen = {path: _file_signature(path) for path in files}
+        self._stop = threading.Event()
+        self._fd = None
+        self._thread = None
+
+    @property
+    def backend(self) -> str:
+        return "inotify" if self._fd is not None else "опрос"
+
+    def start(self):
+        self._fd = _inotify_open(DATA_DIR)
+        self._thread = threading.Thread(target=self._run, name="naryad-watch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _wait(self, timeout: float):
+        if self._fd is None:
+            self._stop.wait(timeout)
+            return
+        try:
+            ready, _, _ = select.select([self._fd], [], [], timeout)
+            if ready:
+                while os.read(self._fd, 65536):  # события не разбираем — важны только подписи
+                    pass
+        except BlockingIOError:
+            pass
+        except (OSError, ValueError):
+            os.close(self._fd)
+            self._fd = None  # дальше — опросом
 
-def fill_excel_only(data: dict) -> Path:
-    if not TEMPLATE_XLSX.exists():
-        raise FileNotFoundError(f"Не найден шаблон: {TEMPLATE_XLSX}")
-    dt = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    xlsx_out = OUTPUT_DIR / f"наряд_{dt}.xlsx"
-    wb = load_workbook(TEMPLATE_XLSX)
-    ws = wb.active
-    _write_to_excel(ws, data)
-    wb.save(xlsx_out)
-    return xlsx_out
+    def _run(self):
+        pending = {}  # путь -> (подпись, когда впервые увидели)
+        try:
+            while not self._stop.is_set():
+                if pending:
+                    self._wait(WATCH_QUIET_SEC)
+                else:
+                    self._wait(WATCH_POLL_SEC if self._fd is None else WATCH_IDLE_SEC)
+                now = time.monotonic()
+                for path, name in self.files.items():
+                    sig = _file_signature(path)
+                    if sig is None or sig == self._seen[path]:
+                        pending.pop(path, None)  # файла нет (пересохраняется) или он не менялся
+                        continue
+                    if sig == _OWN_WRITES.get(str(path)):
+                        self._seen[path] = sig
+                        pending.pop(path, None)
+                        continue
+                    if pending.get(path, (None,))[0] != sig:
+                        pending[path] = (sig, now)
+                        continue
+                    if now - pending[path][1] < WATCH_QUIET_SEC:
+                        continue
+                    del pending[path]
+                    self._seen[path] = sig
+                    try:
+                        with METRICS.span(f"reload.{name}"):
+                            result = TABLE_LOADERS[name][0]()
+                    except Exception:
+                        continue  # недописанный или битый файл — ждём следующего сохранения
+                    self.changes.put((name, result))
+        finally:
+            if self._fd is not None:
+                os.close(self._fd)
 
-def fill_excel_and_export_pdf(data: dict) -> tuple[Path, Path]:
-    if not TEMPLATE_XLSX.exists():
-        raise FileNotFoundError(f"Не найден шаблон: {TEMPLATE_XLSX}")
-    dt = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    xlsx_out = OUTPUT_DIR / f"наряд_{dt}.xlsx"
-    pdf_out = OUTPUT_DIR / f"наряд_{dt}.pdf"
-    wb = load_workbook(TEMPLATE_XLSX)
-    ws = wb.active
-    _write_to_excel(ws, data)
-    wb.save(xlsx_out)
-    ok = export_pdf_via_excel(xlsx_out, pdf_out, a5=True, landscape=False)
-    if not ok and not export_pdf_via_libreoffice(xlsx_out, pdf_out):
-        raise RuntimeError("Не удалось экспортировать в PDF. Проверьте наличие Microsoft Excel (или LibreOffice в PATH).")
-    return xlsx_out, pdf_out
 
 # === Скролл-фреймы ===
 class VScrollFrame(ttk.Frame):
@@ -829,105 +3512,116 @@ class HighlightList(tb.Frame):
         self.on_select(name)
 
 class ConsumableDialog(tb.Toplevel):
-    def __init__(self, parent, kind: str, qty: int):
-        super().__init__(parent)
-        self.title(kind)
-        self.result = None
-        self.grab_set()
-        names = sorted(CONSUMABLES_TABLE.get(kind, {}).keys())
-        cats = list(CONSUMABLE_CATEGORIES)
-        temps = ["холодная", "горячая"]
-        self.vars = []
-        if not names or not cats:
-            tb.Label(self, text="Нет данных для расходников").grid(row=0, column=0, padx=10, pady=10)
-            tb.Button(self, text="OK", command=self.destroy).grid(row=1, column=0, pady=6)
-            return
-        for i in range(qty):
-            row = tb.Frame(self, padding=4)
-            row.grid(row=i, column=0, sticky="we")
-            name_var = tk.StringVar(value=names[0])
-            cat_var = tk.StringVar(value=cats[0])
-            temp_var = tk.StringVar(value=temps[0])
-            tb.Combobox(row, values=names, textvariable=name_var, state="readonly", width=20).pack(side=LEFT, padx=4)
-            tb.Combobox(row, values=cats, textvariable=cat_var, state="readonly", width=20).pack(side=LEFT, padx=4)
-            tb.Combobox(row, values=temps, textvariable=temp_var, state="readonly", width=12).pack(side=LEFT, padx=4)
-            self.vars.append((name_var, cat_var, temp_var))
-        btn = tb.Button(self, text="OK", command=self._ok)
-        btn.grid(row=qty, column=0, pady=6)
+    """Расходники всех выбранных услуг в одном окне.
 
-    def _ok(self):
-        res = []
-        for n, c, t in self.vars:
-            res.append((n.get(), c.get(), t.get()))
-        self.result = res
-        self.destroy()
+    Строка — вариант × категория × холодная/горячая → количество, поэтому виджетов столько,
+    сколько строк, а не штук: 40 одинаковых грузиков — одна строка. Цены считаются сразу по CONSUMABLES_TABLE.
+    result — {услуга: [(вариант, категория, тип), ...]}, по элементу на штуку, как раньше.
+    initial — {услуга: [[вариант, категория, тип, штук], ...]} из прошлого наряда: строки берутся из него,
+    если совпадает количество.
+    """
 
-class ConsumableDialog(tb.Toplevel):
-    def __init__(self, parent, kind: str, qty: int):
+    def __init__(self, parent, wanted: dict[str, int], initial: dict[str, list] | None = None):
         super().__init__(parent)
-        self.title(kind)
+        self.title("Расходники")
         self.result = None
         self.grab_set()
-        names = sorted(CONSUMABLES_TABLE.get(kind, {}).keys())
-        cats = list(CONSUMABLE_CATEGORIES)
-        temps = ["холодная", "горячая"]
-        self.vars = []
-        if not names or not cats:
-            tb.Label(self, text="Нет данных для расходников").grid(row=0, column=0, padx=10, pady=10)
-            tb.Button(self, text="OK", command=self.destroy).grid(row=1, column=0, pady=6)
-            return
-        for i in range(qty):
-            row = tb.Frame(self, padding=4)
-            row.grid(row=i, column=0, sticky="we")
-            name_var = tk.StringVar(value=names[0])
-            cat_var = tk.StringVar(value=cats[0])
-            temp_var = tk.StringVar(value=temps[0])
-            tb.Combobox(row, values=names, textvariable=name_var, state="readonly", width=20).pack(side=LEFT, padx=4)
-            tb.Combobox(row, values=cats, textvariable=cat_var, state="readonly", width=20).pack(side=LEFT, padx=4)
-            tb.Combobox(row, values=temps, textvariable=temp_var, state="readonly", width=12).pack(side=LEFT, padx=4)
-            self.vars.append((name_var, cat_var, temp_var))
-        btn = tb.Button(self, text="OK", command=self._ok)
-        btn.grid(row=qty, column=0, pady=6)
-
-    def _ok(self):
-        res = []
-        for n, c, t in self.vars:
-            res.append((n.get(), c.get(), t.get()))
-        self.result = res
-        self.destroy()
+        self.sections = {}
+        for r, (service, qty) in enumerate(wanted.items()):
+            box = tb.Labelframe(self, text=f"{service} — {qty} шт.", padding=6)
+            box.grid(row=r, column=0, sticky="we", padx=6, pady=4)
+            lines = tb.Frame(box)
+            lines.pack(fill=X)
+            footer = tb.Frame(box)
+            footer.pack(fill=X, pady=(4, 0))
+            tb.Button(footer, text="+ строка", bootstyle="secondary-outline",
+                      command=lambda s=service: self._add_line(s)).pack(side=LEFT)
+            total = tk.StringVar()
+            tb.Label(footer, textvariable=total).pack(side=RIGHT)
+            self.sections[service] = {"kind": CONSUMABLE_SERVICE_MAP[service], "qty": qty, "frame": lines,
+                                      "lines": [], "total": total}
+            previous = (initial or {}).get(service) or []
+            if previous and sum(k for *_, k in previous) == qty:
+                for n, c, t, k in previous:
+                    self._add_line(service, k, (n, c, t))
+            else:
+                self._add_line(service, qty)
+        bottom = tb.Frame(self, padding=6)
+        bottom.grid(row=len(wanted), column=0, sticky="we")
+        self.grand = tk.StringVar()
+        tb.Label(bottom, textvariable=self.grand, font=("-weight", "bold")).pack(side=LEFT)
+        tb.Button(bottom, text="OK", command=self._ok).pack(side=RIGHT)
+        self.bind("<Return>", lambda e: self._ok())
+        self._reprice()
+
+    @staticmethod
+    def _count(var) -> int:
+        try:
+            return max(0, int(var.get()))
+        except (tk.TclError, ValueError):
+            return 0
 
-class ConsumableDialog(tb.Toplevel):
-    def __init__(self, parent, kind: str, qty: int):
-        super().__init__(parent)
-        self.title(kind)
-        self.result = None
-        self.grab_set()
-        names = sorted(CONSUMABLES_TABLE.get(kind, {}).keys())
+    def _add_line(self, service: str, count: int | None = None, choice: tuple = ("", "", "")):
+        sec = self.sections[service]
+        names = sorted(CONSUMABLES_TABLE.get(sec["kind"], {}).keys())
         cats = CONSUMABLE_CATEGORIES
-        temps = ["холодная", "горячая"]
-        self.vars = []
-        for i in range(qty):
-            row = tb.Frame(self, padding=4)
-            row.grid(row=i, column=0, sticky="we")
-            name_var = tk.StringVar(value=(names[0] if names else ""))
-            cat_var = tk.StringVar(value=(cats[0] if cats else ""))
-            temp_var = tk.StringVar(value=temps[0])
-            tb.Combobox(row, values=names, textvariable=name_var, state="readonly", width=20).pack(side=LEFT, padx=4)
-            tb.Combobox(row, values=cats, textvariable=cat_var, state="readonly", width=20).pack(side=LEFT, padx=4)
-            tb.Combobox(row, values=temps, textvariable=temp_var, state="readonly", width=12).pack(side=LEFT, padx=4)
-            self.vars.append((name_var, cat_var, temp_var))
-        btn = tb.Button(self, text="OK", command=self._ok)
-        btn.grid(row=qty, column=0, pady=6)
+        if count is None:  # новая строка забирает недостающие до количества в наряде штуки
+            count = max(1, sec["qty"] - sum(self._count(ln["count"]) for ln in sec["lines"]))
+        name, cat, temp = choice  # выбор из прошлого наряда, если он ещё есть в таблице расходников
+        row = tb.Frame(sec["frame"], padding=2)
+        row.pack(fill=X)
+        line = {
+            "name": tk.StringVar(value=(name if name in names else names[0] if names else "")),
+            "cat": tk.StringVar(value=(cat if cat in cats else cats[0] if cats else "")),
+            "temp": tk.StringVar(value=(temp if temp in CONSUMABLE_TEMPS else CONSUMABLE_TEMPS[0])),
+            "count": tk.IntVar(value=count),
+            "sum": tk.StringVar(),
+            "row": row,
+        }
+        tb.Combobox(row, values=names, textvariable=line["name"], state="readonly", width=20).pack(side=LEFT, padx=4)
+        tb.Combobox(row, values=cats, textvariable=line["cat"], state="readonly", width=20).pack(side=LEFT, padx=4)
+        tb.Combobox(row, values=CONSUMABLE_TEMPS, textvariable=line["temp"], state="readonly", width=12).pack(side=LEFT, padx=4)
+        tb.Spinbox(row, from_=0, to=999, textvariable=line["count"], width=6).pack(side=LEFT, padx=4)
+        tb.Label(row, textvariable=line["sum"], width=18).pack(side=LEFT, padx=4)
+        tb.Button(row, text="✕", bootstyle="danger-link", command=lambda: self._remove_line(service, line)).pack(side=LEFT)
+        for key in ("name", "cat", "temp", "count"):
+            line[key].trace_add("write", lambda *_: self._reprice())
+        sec["lines"].append(line)
+        self._reprice()
+
+    def _remove_line(self, service: str, line: dict):
+        self.sections[service]["lines"].remove(line)
+        line["row"].destroy()
+        self._reprice()
+
+    def _reprice(self):
+        grand = 0
+        for sec in self.sections.values():
+            n = cost = 0
+            for ln in sec["lines"]:
+                count = self._count(ln["count"])
+                price = consumable_price(sec["kind"], ln["name"].get(), ln["cat"].get(), ln["temp"].get())
+                ln["sum"].set(f"× {price} = {count * price} ₽")
+                n += count
+                cost += count * price
+            sec["total"].set(f"{n} из {sec['qty']} шт. — {cost} ₽")
+            grand += cost
+        self.grand.set(f"Итого расходники: {grand} ₽")
 
     def _ok(self):
-        res = []
-        for n, c, t in self.vars:
-            res.append((n.get(), c.get(), t.get()))
-        self.result = res
+        self.result = {
+            service: [(ln["name"].get(), ln["cat"].get(), ln["temp"].get())
+                      for ln in sec["lines"] for _ in range(self._count(ln["count"]))]
+            for service, sec in self.sections.items()
+        }
         self.destroy()
 
 # === Приложение ===
 class WorkOrderApp:
+    WATCH_APPLY_MS = 300  # как часто поток Tk забирает перечитанные справочники
+    OUTBOX_POLL_MS = 1000  # обновление строки состояния очереди PDF
+    CONVERTER_WARM_DELAY_MS = 3000
+
     def __init__(self, root: tb.Window):
         self.root = root
         self.root.title("Наряд-Заказ — v2.3")
@@ -938,40 +3632,340 @@ class WorkOrderApp:
         tb.Label(topbar, text="Наряд‑Заказ", font=("-size", 16, "-weight", "bold")).pack(side=LEFT)
         tb.Button(topbar, text="Создать наряд", bootstyle="primary", command=self.open_create_form).pack(side=RIGHT, padx=6)
         tb.Button(topbar, text="Админ‑панель", bootstyle="secondary", command=self.open_admin_panel).pack(side=RIGHT, padx=6)
+        tb.Button(topbar, text="Поиск нарядов", bootstyle="info", command=self.open_order_search).pack(side=RIGHT, padx=6)
         tb.Button(topbar, text="Обновить списки", bootstyle="warning", command=self.refresh_lists).pack(side=RIGHT, padx=6)
+        self.load_status = tk.StringVar(value="Загрузка справочников…")
+        self.template_name = DEFAULT_TEMPLATE  # выбор шаблона живёт, пока открыто приложение
+        tb.Label(topbar, textvariable=self.load_status, bootstyle="secondary").pack(side=LEFT, padx=16)
+        self.outbox_status = tk.StringVar(value="")
+        lbl_outbox = tb.Label(topbar, textvariable=self.outbox_status, bootstyle="warning", cursor="hand2")
+        lbl_outbox.pack(side=LEFT, padx=8)
+        lbl_outbox.bind("<Button-1>", lambda e: PDF_OUTBOX.kick())  # щелчок — повторить сейчас
         topbar.pack(fill=X)
 
         self.root.bind("<Control-n>", lambda e: self.open_create_form())
+        self.root.bind("<Control-F>", lambda e: self.open_order_search())  # Ctrl+Shift+F
 
         # Плейсхолдер
         self.placeholder = tb.Frame(self.root, padding=20)
         tb.Label(self.placeholder, text="Нажмите «Создать наряд» или Ctrl+N", bootstyle="secondary").pack()
         self.placeholder.pack(fill=BOTH, expand=True)
 
+        # правки справочников в Excel подхватываем сами, без «Обновить списки»;
+        # наблюдатель запускаем до фоновой загрузки, чтобы не пропустить сохранение во время неё
+        self._watcher = DataDirWatcher({COMPANIES_XLSX: "companies", PRICE_XLSX: "price", CONSUMABLES_XLSX: "consumables"})
+        self._watcher.start()
+        subscribe_companies(self._on_company_events)
+        self.root.after(self.WATCH_APPLY_MS, self._poll_data_changes)
+        # конвертер PDF прогревается, пока оператор заполняет первый наряд; стартовую загрузку не тормозит
+        self.root.after(self.CONVERTER_WARM_DELAY_MS, PDF_CONVERTER.start)
+        # несделанные PDF (в том числе с прошлого запуска) досоздаются в фоне
+        PDF_OUTBOX.start()
+        self.root.after(self.OUTBOX_POLL_MS, self._poll_outbox)
+
+        # справочники читаются параллельно в фоне — окно показываем сразу
+        self._loader = TableLoader(self.root, self._on_table_loaded)
+        self.root.bind("<Map>", self._on_first_map, add="+")
+
         self._create_form_window = None  # ссылка, чтобы обновлять виджеты после админки
+        self._search_window = None
+        self._repeat_lines = {}  # разбивка и расходники повторяемого наряда — подставляются в окна выбора
+        # индекс нарядов догоняет папку output в фоне (на нём поиск и «повторить последний наряд»)
+        threading.Thread(target=self._sync_order_index, name="naryad-index", daemon=True).start()
+        # форму наряда строим заранее, пока оператор ничего не нажал — первый Ctrl+N тоже мгновенный
+        self.root.after(500, self._prebuild_create_form)
+
+        # автосохранение черновика наряда
+        self._draft_writer = BackgroundJsonWriter(DRAFT_FILE)
+        self._draft_job = None
+        self._draft_suspended = False
+        self._draft_written = False  # писали ли черновик в этой сессии (чужой черновик не затираем)
+        self._form_unsaved = False  # в форме есть правки, которых нет ни в одном сохранённом наряде
+        self.root.after(700, self._offer_draft_restore)
+        self.root.protocol("WM_DELETE_WINDOW", self._on_app_close)
+
+    def _on_app_close(self):
+        if self._draft_job is not None:
+            self._save_draft()
+        self._draft_writer.flush()
+        USAGE.flush()
+        self._watcher.stop()
+        PDF_OUTBOX.stop()
+        PDF_CONVERTER.stop()
+        self.root.destroy()
+
+    def _on_first_map(self, event):
+        if event.widget is self.root and "first_paint" not in STARTUP_TIMINGS:
+            _mark_startup("first_paint")
+
+    def _on_table_loaded(self, name: str, error):
+        if error is not None:
+            messagebox.showerror("Ошибка загрузки", f"Не удалось прочитать справочник «{TABLE_TITLES[name]}»:\n{error}", parent=self.root)
+        if name == "companies":
+            self._apply_companies_to_form(self._create_form_window)
+            if hasattr(self, "quick_picks") and self._widget_exists(self.quick_picks):
+                self._refresh_quick_picks()
+        elif name == "price":
+            self._update_service_prices()
+        if self._loader.pending:
+            left = ", ".join(TABLE_TITLES[n] for n in TABLE_LOADERS if n in self._loader.pending)
+            self.load_status.set(f"Загрузка справочников: {left}…")
+        else:
+            _mark_startup("tables")
+            self.load_status.set("")
+
+    def _poll_data_changes(self):
+        try:
+            while True:
+                self._apply_data_change(*self._watcher.changes.get_nowait())
+        except queue.Empty:
+            pass
+        self.root.after(self.WATCH_APPLY_MS, self._poll_data_changes)
+
+    def _apply_data_change(self, name: str, result):
+        # файл перечитан после сохранения — он должен лечь поверх стартовой загрузки, а не наоборот
+        self._loader.wait(name)
+        if name == "companies":
+            events = company_events(COMPANIES, result[0])
+            _set_companies(result)
+            if not events:
+                return
+            emit_company_events(events)
+            kinds = collections.Counter(kind for kind, _ in events)
+            note = f"+{kinds['added']} −{kinds['removed']} изм. {len(events) - kinds['added'] - kinds['removed']}"
+        elif name == "price":
+            changed = diff_price_tables(PRICE_TABLE, result)
+            _set_price(result)
+            if not changed:
+                return
+            self._update_service_prices(changed)
+            note = f"изм. {len(changed)}"
+        else:
+            if result == (CONSUMABLES_TABLE, CONSUMABLE_CATEGORIES):
+                return
+            _set_consumables(result)
+            note = ""
+        self._flash_status(f"Обновлено из файла: {TABLE_TITLES[name]} {note}".rstrip())
+
+    def _poll_outbox(self, reschedule: bool = True):
+        try:
+            while True:
+                self._flash_status(f"PDF создан: {Path(PDF_OUTBOX.done.get_nowait()).name}")
+        except queue.Empty:
+            pass
+        pending, wait = PDF_OUTBOX.status()
+        if not pending:
+            self.outbox_status.set("Готовлю конвертер PDF…" if PDF_CONVERTER.state == "warming" else "")
+        else:
+            retry = f"повтор через {int(wait)} с" if wait >= 1 else "создаются…"
+            self.outbox_status.set(f"PDF в очереди: {pending} ({retry})")
+        if reschedule:
+            self.root.after(self.OUTBOX_POLL_MS, self._poll_outbox)
+
+    def _flash_status(self, text: str):
+        if self._loader.pending:
+            return  # строка занята ходом стартовой загрузки
+        self.load_status.set(text)
+        self.root.after(5000, lambda: self.load_status.get() == text and self.load_status.set(""))
+
+    # ===== Поиск нарядов =====
+    SEARCH_DEBOUNCE_MS = 150
+
+    def open_order_search(self):
+        if self._widget_exists(self._search_window):
+            self._search_window.deiconify()
+            self._search_window.lift()
+            return
+        win = tb.Toplevel(self.root)
+        self._search_window = win
+        win.title("Поиск нарядов")
+        win.geometry("1200x640")
+
+        bar = tb.Frame(win, padding=8)
+        bar.pack(fill=X)
+        query, day_from, day_to = tk.StringVar(), tk.StringVar(), tk.StringVar()
+        tb.Label(bar, text="Найти:").pack(side=LEFT)
+        entry = tb.Entry(bar, textvariable=query)
+        entry.pack(side=LEFT, fill=X, expand=True, padx=6)
+        tb.Label(bar, text="с").pack(side=LEFT)
+        tb.Entry(bar, textvariable=day_from, width=11).pack(side=LEFT, padx=4)
+        tb.Label(bar, text="по").pack(side=LEFT)
+        tb.Entry(bar, textvariable=day_to, width=11).pack(side=LEFT, padx=4)
+
+        columns = (("created", "Дата", 90), ("number", "№", 110), ("customer", "Заказчик", 220),
+                   ("plate", "Номер", 200), ("total", "Сумма", 80), ("snippet", "Совпадение", 420))
+        tree = ttk.Treeview(win, columns=[c for c, _, _ in columns], show="headings")
+        for col, title, width in columns:
+            tree.heading(col, text=title)
+            tree.column(col, width=width, anchor="e" if col == "total" else "w")
+        tree.pack(fill=BOTH, expand=True, padx=8)
+        status = tk.StringVar(value="Обновляю индекс…")
+        tb.Label(win, textvariable=status, bootstyle="secondary").pack(fill=X, padx=8, pady=4)
+
+        pending = [None]
+
+        def run_search():
+            pending[0] = None
+            try:
+                hits = ORDER_INDEX.search(query.get(), parse_search_day(day_from.get()), parse_search_day(day_to.get(), end=True))
+            except (ValueError, sqlite3.Error) as e:
+                status.set(str(e))
+                return
+            tree.delete(*tree.get_children())
+            for h in hits:
+                tree.insert("", tk.END, iid=h["file"], values=(h["created"], h["number"], h["customer"], h["plate"], h["total"], h["snippet"]))
+            more = " (показаны последние)" if len(hits) == ORDER_SEARCH_LIMIT else ""
+            status.set(f"Найдено: {len(hits)}{more}")
+
+        def schedule(*_):
+            if pending[0] is not None:
+                win.after_cancel(pending[0])
+            pending[0] = win.after(self.SEARCH_DEBOUNCE_MS, run_search)
+
+        for var in (query, day_from, day_to):
+            var.trace_add("write", schedule)
+
+        def open_selected(event=None):
+            for name in tree.selection()[:1]:
+                try:
+                    os.startfile(str((OUTPUT_DIR / name).resolve()))
+                except Exception:
+                    pass
+
+        def reprint_selected(event=None):
+            for name in tree.selection()[:1]:
+                order = ORDER_INDEX.record(name)
+                found = find_reprint(order) if order else None
+                pdf = found[2] if found else (OUTPUT_DIR / name).with_suffix(".pdf")
+                if not pdf.exists():
+                    messagebox.showinfo("Повторная печать", f"PDF для {name} не найден — откройте наряд и напечатайте из Excel.", parent=win)
+                    return
+                try:
+                    os.startfile(str(pdf))
+                except Exception:
+                    pass
+
+        tb.Button(bar, text="PDF для печати (Ctrl+P)", bootstyle="info-outline", command=reprint_selected).pack(side=LEFT, padx=(8, 0))
+        tree.bind("<Double-1>", open_selected)
+        tree.bind("<Return>", open_selected)
+        win.bind("<Control-p>", reprint_selected)
+        win.bind("<Escape>", lambda e: win.destroy())
+
+        # индекс досинхронизируется с папкой в фоне (наряды с других версий, удалённые файлы)
+        done = queue.Queue()
+
+        def sync():
+            try:
+                added, removed = ORDER_INDEX.sync()
+                done.put(f"Индекс обновлён: +{added}, −{removed}" if added or removed else "")
+            except Exception as e:
+                done.put(f"Индекс не обновлён: {e}")
+
+        def poll_sync():
+            if not self._widget_exists(win):
+                return
+            try:
+                note = done.get_nowait()
+            except queue.Empty:
+                win.after(self.SEARCH_DEBOUNCE_MS, poll_sync)
+                return
+            run_search()
+            if note:
+                status.set(f"{status.get()}. {note}")
+
+        threading.Thread(target=sync, name="naryad-index", daemon=True).start()
+        win.after(self.SEARCH_DEBOUNCE_MS, poll_sync)
+        run_search()
+        entry.focus_set()
+
+    def _prebuild_create_form(self):
+        if not self._widget_exists(self._create_form_window):
+            with METRICS.span("form.build"):
+                self._build_create_form().withdraw()
 
     def refresh_lists(self):
-        reload_companies_globals()
-        # если форма открыта — обновим виджеты (с защитой на уничтоженные)
-        self._apply_companies_to_form(self._create_form_window)
+        self._loader.wait("companies")
+        reload_companies_globals()  # открытые формы обновятся по событиям справочника
         messagebox.showinfo("Готово", "Справочник компаний обновлён из файла.", parent=self.root)
 
     # ===== Создание наряда =====
     def open_create_form(self):
+        # Форма строится один раз; при повторном открытии — только сброс полей.
+        # Несохранённый наряд (форма открыта, свёрнута или скрыта по Esc) без подтверждения не очищается
+        win = self._create_form_window
+        if self._widget_exists(win):
+            discard = True
+            if self._form_unsaved and self._draft_snapshot() is not None:
+                win.deiconify()
+                win.lift()
+                discard = messagebox.askyesno("Новый наряд", "В форме несохранённый наряд. Очистить форму и начать новый?",
+                                              default=messagebox.NO, parent=win)
+                if discard:
+                    self._discard_draft()
+            if discard:
+                self.reset_create_form()
+            win.deiconify()
+        else:
+            with METRICS.span("form.build"):
+                win = self._build_create_form()
+        try:
+            win.state('zoomed')
+        except Exception:
+            pass
+        win.lift()
+        win.focus_force()
+
+    def _hide_create_form(self):
+        # окно не уничтожаем — его виджеты переиспользуются для следующего наряда
+        if self._widget_exists(self._create_form_window):
+            self._create_form_window.withdraw()
+
+    @METRICS.timed("form.reset")
+    def reset_create_form(self):
+        """Вернуть открытую ранее форму в чистое состояние нового наряда."""
+        self._draft_suspended = True
+        try:
+            self._reset_form_fields()
+        finally:
+            self._draft_suspended = False
+        self._form_unsaved = False
+
+    def _reset_form_fields(self):
+        self.customer_type.set("Частное лицо")
+        if self.company_query.get():
+            self.company_query.set("")  # apply_filter перестроит список компаний
+        elif ALL_COMPANY_NAMES and self.company_selected.get() != ALL_COMPANY_NAMES[0]:
+            self.cmb_company.set(ALL_COMPANY_NAMES[0])
+        self.plate_var.set("")
+        self.driver_name.set("")
+        self.defect_choice.set(DEFECTS[0])
+        self._on_defect_changed()
+        self.issued_to.set("")
+        self.mechanic.set("")
+        self.vehicle_type.set("Легковой")
+        self._repeat_lines = {}
+        for name in SERVICES:
+            self.services_vars[name].set(0)
+            self.services_qty[name].set(0)
+        for sf in self._form_scrolls:
+            sf.canvas.yview_moveto(0)
+        self._refresh_quick_picks()
+        self._on_customer_type_changed()
+        self._update_company_meta()
+        self._update_service_prices()
+
+    def _build_create_form(self):
         win = tb.Toplevel(self.root)
         self._create_form_window = win
         win.title("Создать наряд")
         win.geometry("1400x860")
         win.resizable(True, True)
-        try:
-            win.state('zoomed')
-        except Exception:
-            pass
 
         # хоткеи формы
         win.bind("<Control-s>", lambda e: self._build_xlsx_only())
         win.bind("<Control-p>", lambda e: self._build_and_save())
-        win.bind("<Escape>", lambda e: win.destroy())
+        win.bind("<Control-r>", lambda e: self._repeat_last_order())
+        win.bind("<Escape>", lambda e: self._hide_create_form())
         self._form_parent = win
 
         # Две панели
@@ -1007,10 +4001,6 @@ class WorkOrderApp:
         tb.Radiobutton(frm_customer, text="Частное лицо", variable=self.customer_type, value="Частное лицо", command=self._on_customer_type_changed).grid(row=0, column=0, sticky=NW, padx=4, pady=4)
         tb.Radiobutton(frm_customer, text="Компания", variable=self.customer_type, value="Компания", command=self._on_customer_type_changed).grid(row=0, column=1, sticky=NW, padx=4, pady=4)
         tb.Label(frm_customer, text="Поиск компании или номера (Ctrl+F):").grid(row=1, column=0, sticky=NW, padx=4, pady=4)
-        tb.Label(frm_customer, text="Поиск компании или номера (Ctrl+F):").grid(row=1, column=0, sticky=NW, padx=4, pady=4)
-
-        tb.Label(frm_customer, text="Поиск компании или номера (Ctrl+F):").grid(row=1, column=0, sticky=NW, padx=4, pady=4)
-        tb.Label(frm_customer, text="Поиск компании или номера (Ctrl+F):").grid(row=1, column=0, sticky=NW, padx=4, pady=4)
 
         self.company_query = tk.StringVar(value="")
         self.entry_company_query = tb.Entry(frm_customer, textvariable=self.company_query)
@@ -1037,6 +4027,14 @@ class WorkOrderApp:
         self.company_inn_var = tk.StringVar(value="")
         tb.Label(frm_customer, textvariable=self.company_inn_var, bootstyle="secondary").grid(row=4, column=1, sticky="w", padx=4, pady=4)
 
+        # Быстрый выбор частых машин (Alt+1…Alt+8)
+        tb.Label(frm_customer, text="Частые:").grid(row=5, column=0, sticky=NW, padx=4, pady=4)
+        self.quick_picks = tb.Frame(frm_customer)
+        self.quick_picks.grid(row=5, column=1, sticky="we", padx=4, pady=4)
+        self._quick_pick_items = []
+        for i in range(1, QUICK_PICK_COUNT + 1):
+            win.bind(f"<Alt-Key-{i}>", lambda e, k=i - 1: self._quick_pick_index(k))
+
 
         def apply_filter(*_):
             q = self.company_query.get()
@@ -1047,6 +4045,11 @@ class WorkOrderApp:
             else:
                 self.cmb_company.set("")
             self.search_results.set_items(values[:50], q.strip().lower())
+            # введён (или отсканирован) полный номер — сразу к компании-владельцу
+            ref = PLATE_INDEX.lookup(q) if q.strip() else None
+            if ref is not None and values and values[0] == ref.company and self.customer_type.get() != "Компания":
+                self.customer_type.set("Компания")
+                self._on_customer_type_changed()
             self._update_company_meta()
 
         self._company_query_trace = self.company_query.trace_add("write", apply_filter)
@@ -1068,6 +4071,8 @@ class WorkOrderApp:
         self.plate_list.grid(row=1, column=1, sticky="we", padx=4, pady=4)
         tb.Label(frm_plate, text="Номер прицепа (опционально):").grid(row=2, column=0, columnspan=2, sticky=NW, padx=4, pady=4)
         self.trailer_list.grid(row=3, column=0, columnspan=2, sticky="we", padx=4, pady=4)
+        tb.Button(frm_plate, text="Повторить последний наряд на машину (Ctrl+R)", bootstyle="info-outline",
+                  command=self._repeat_last_order).grid(row=4, column=0, columnspan=2, sticky="w", padx=4, pady=4)
 
         # Водитель
         frm_driver = tb.Labelframe(left, text="Ф.И.О. водителя", padding=8)
@@ -1099,6 +4104,7 @@ class WorkOrderApp:
                 self.defect_custom.set("")
         cmb_def.bind("<<ComboboxSelected>>", lambda e: on_defect_changed())
         on_defect_changed()
+        self._on_defect_changed = on_defect_changed
 
         # Исполнители
         frm_people = tb.Labelframe(left, text="Исполнители", padding=8)
@@ -1167,25 +4173,225 @@ class WorkOrderApp:
         actions.grid(row=2, column=0, sticky="we", **pad)
         tb.Button(actions, text="Сформировать Excel (Ctrl+S)", bootstyle="success", command=self._build_xlsx_only).pack(side=LEFT, padx=6)
         tb.Button(actions, text="Сформировать PDF (Ctrl+P)", bootstyle="info", command=self._build_and_save).pack(side=LEFT, padx=6)
+        names = TEMPLATES.names()
+        if len(names) > 1:  # выбор шаблона (A5, акт A4, варианты филиалов) — только если их несколько
+            titles = {TEMPLATES.title(n): n for n in names}
+            tb.Label(actions, text="Шаблон:").pack(side=LEFT, padx=(12, 2))
+            cmb_template = tb.Combobox(actions, values=list(titles), state="readonly", width=26)
+            cmb_template.set(next((t for t, n in titles.items() if n == self.template_name), ""))
+            cmb_template.bind("<<ComboboxSelected>>", lambda e: setattr(self, "template_name", titles[cmb_template.get()]))
+            cmb_template.pack(side=LEFT)
+
+        self._form_scrolls = (left_scroll, right_scroll, svc)
+        self._refresh_quick_picks()
 
         # Инициализация
         self._on_customer_type_changed()
         self._update_company_meta()
         self._update_service_prices()
 
-        # Корректное отключение trace/биндов при закрытии окна
-        def _cleanup():
-            try:
-                self.company_query.trace_remove("write", self._company_query_trace)
-            except Exception:
-                pass
-            try:
-                self.search_results.destroy()
-            except Exception:
-                pass
-            win.destroy()
+        # Любое изменение полей планирует запись черновика
+        for var in (self.customer_type, self.company_selected, self.plate_var, self.driver_name, self.defect_choice,
+                    self.defect_custom, self.issued_to, self.mechanic, self.vehicle_type,
+                    *self.services_vars.values(), *self.services_qty.values()):
+            var.trace_add("write", self._schedule_draft)
+        self.plate_list.bind("<<ComboboxSelected>>", self._schedule_draft, add="+")
+        self.trailer_list.bind("<<ComboboxSelected>>", self._schedule_draft, add="+")
+
+        # Закрытие только прячет окно: следующий Ctrl+N покажет его после reset_create_form()
+        win.protocol("WM_DELETE_WINDOW", self._hide_create_form)
+        return win
+
+    # ===== Быстрый выбор =====
+    def _refresh_quick_picks(self):
+        visible = set(ALL_COMPANY_NAMES)
+        items = USAGE.top_plates(QUICK_PICK_COUNT, visible=visible)
+        if items == self._quick_pick_items:
+            return
+        self._quick_pick_items = items
+        for child in self.quick_picks.winfo_children():
+            child.destroy()
+        if not items:
+            tb.Label(self.quick_picks, text="появятся после первых нарядов", bootstyle="secondary").pack(side=LEFT)
+        for i, (company, plate) in enumerate(items, start=1):
+            tb.Button(self.quick_picks, text=f"{i}. {plate} · {company}", bootstyle="info-outline",
+                      command=lambda c=company, p=plate: self._quick_pick(c, p)).pack(side=LEFT, padx=2, pady=2)
+
+    def _quick_pick_index(self, k: int):
+        if k < len(self._quick_pick_items):
+            self._quick_pick(*self._quick_pick_items[k])
+
+    def _quick_pick(self, company: str, plate: str):
+        self.customer_type.set("Компания")
+        self._on_customer_type_changed()
+        if self.company_query.get():
+            self.company_query.set("")
+        if company not in self.cmb_company["values"]:
+            return
+        self.cmb_company.set(company)
+        self._update_company_meta()
+        if plate in self.plate_list["values"]:
+            self.plate_list.set(plate)
+        elif plate in self.trailer_list["values"]:
+            self.trailer_list.set(plate)
+        self._schedule_draft()
+
+    def _record_usage(self, data: dict):
+        if self.customer_type.get() != "Компания" or not data.get("customer_display"):
+            return
+        USAGE.record(data["customer_display"], data.get("plate", ""))
+        self._refresh_quick_picks()
 
-        win.protocol("WM_DELETE_WINDOW", _cleanup)
+    # ===== Повтор наряда =====
+    @staticmethod
+    def _sync_order_index():
+        try:
+            ORDER_INDEX.sync()
+        except Exception:
+            pass  # без индекса не работают только поиск и повтор наряда
+
+    def _repeat_last_order(self):
+        """Заполнить форму по последнему наряду на выбранную (или введённую) машину."""
+        if self.customer_type.get() == "Компания":
+            plate = self.plate_list.get().strip() or self.trailer_list.get().strip()
+        else:
+            plate = self.plate_entry.get().strip()
+        if not plate or plate == "Без прицепа":
+            messagebox.showinfo("Повтор наряда", "Сначала выберите или введите гос. номер.", parent=self._form_parent)
+            return
+        try:
+            order = ORDER_INDEX.last_for_plate(plate)
+        except sqlite3.Error as e:
+            messagebox.showerror("Повтор наряда", f"Индекс нарядов недоступен: {e}", parent=self._form_parent)
+            return
+        if order is None:
+            messagebox.showinfo("Повтор наряда", f"Нарядов на {plate} ещё не было.", parent=self._form_parent)
+            return
+        customer = order.get("customer_display", "")
+        defect = order.get("defect", "")
+        custom = defect not in DEFECTS
+        services = {name: s.get("qty", 0) for name, s in order.get("services", {}).items() if s.get("qty", 0)}
+        # исполнитель и механик — кто работает сейчас, а не в прошлый раз
+        self._apply_draft({
+            "customer_type": "Компания" if customer in COMPANIES else "Частное лицо",
+            "company": customer,
+            "plate_pick": order.get("plate", ""),
+            "plate": order.get("plate", ""),
+            "trailer": order.get("trailer") or "Без прицепа",
+            "driver": order.get("driver_name", ""),
+            "defect": "Другое (ввести вручную)" if custom and defect else (defect or DEFECTS[0]),
+            "defect_custom": defect if custom else "",
+            "issued_to": self.issued_to.get().strip(),
+            "mechanic": self.mechanic.get().strip(),
+            "vehicle_type": order.get("vehicle_type") or "Легковой",
+            "services": services,
+        })
+        self._repeat_lines = {name: s for name, s in order.get("services", {}).items() if "parts" in s or "items" in s}
+        self._schedule_draft()
+        number = f" № {order['number']}" if order.get("number") else ""
+        self._flash_status(f"Повтор наряда{number} от {_order_day(order)}")
+
+    # ===== Черновик =====
+    def _schedule_draft(self, *_):
+        if self._draft_suspended:
+            return
+        self._form_unsaved = True
+        if self._draft_job is not None:
+            return
+        self._draft_job = self.root.after(DRAFT_DELAY_MS, self._save_draft)
+
+    def _save_draft(self):
+        self._draft_job = None
+        snap = self._draft_snapshot()
+        if snap is not None:
+            self._draft_writer.submit(snap)
+            self._draft_written = True
+        elif self._draft_written:
+            self._draft_writer.clear()
+            self._draft_written = False
+
+    def _discard_draft(self):
+        self._form_unsaved = False  # наряд сохранён или от формы отказались
+        if self._draft_job is not None:
+            self.root.after_cancel(self._draft_job)
+            self._draft_job = None
+        self._draft_writer.clear()
+        self._draft_written = False
+
+    def _draft_snapshot(self) -> dict | None:
+        """Компактный снимок формы: только заполненные поля и отмеченные услуги."""
+        if not self._widget_exists(self.plate_list):
+            return None
+        services = {name: int(self.services_qty[name].get() or 0) for name in SERVICES if self.services_vars[name].get()}
+        fields = {
+            "customer_type": self.customer_type.get(),
+            "company": self.company_selected.get() if self.customer_type.get() == "Компания" else "",
+            "plate": self.plate_var.get().strip(),
+            "plate_pick": self.plate_list.get(),
+            "trailer": self.trailer_list.get(),
+            "driver": self.driver_name.get().strip(),
+            "defect": self.defect_choice.get(),
+            "defect_custom": self.defect_custom.get().strip(),
+            "issued_to": self.issued_to.get().strip(),
+            "mechanic": self.mechanic.get().strip(),
+            "vehicle_type": self.vehicle_type.get(),
+        }
+        if not (services or fields["company"] or fields["plate"] or fields["driver"] or fields["defect_custom"]):
+            return None  # пустая форма — черновик не нужен
+        defaults = {"customer_type": "Частное лицо", "defect": DEFECTS[0], "vehicle_type": "Легковой", "trailer": "Без прицепа"}
+        snap = {k: v for k, v in fields.items() if v and v != defaults.get(k)}
+        snap["ts"] = datetime.datetime.now().isoformat(timespec="seconds")
+        if services:
+            snap["services"] = services
+        return snap
+
+    def _apply_draft(self, d: dict):
+        self._draft_suspended = True
+        try:
+            self._reset_form_fields()
+            self.customer_type.set(d.get("customer_type", "Частное лицо"))
+            company = d.get("company", "")
+            if company and company in self.cmb_company["values"]:
+                self.cmb_company.set(company)
+                self._update_company_meta()
+            if d.get("plate_pick") in self.plate_list["values"]:
+                self.plate_list.set(d["plate_pick"])
+            if d.get("trailer") in self.trailer_list["values"]:
+                self.trailer_list.set(d["trailer"])
+            self.plate_var.set(d.get("plate", ""))
+            self.driver_name.set(d.get("driver", ""))
+            if d.get("defect") in DEFECTS:
+                self.defect_choice.set(d["defect"])
+                self._on_defect_changed()
+            self.defect_custom.set(d.get("defect_custom", ""))
+            self.issued_to.set(d.get("issued_to", ""))
+            self.mechanic.set(d.get("mechanic", ""))
+            self.vehicle_type.set(d.get("vehicle_type", "Легковой"))
+            for name, qty in d.get("services", {}).items():
+                if name in self.services_vars:
+                    self.services_vars[name].set(1)
+                    self.services_qty[name].set(qty)
+            self._on_customer_type_changed()
+            self._update_service_prices()
+        finally:
+            self._draft_suspended = False
+
+    def _offer_draft_restore(self):
+        if not self._loader.ready("companies"):
+            # черновик ссылается на компанию и номер — предлагаем, когда справочник уже в форме
+            self.root.after(TableLoader.POLL_MS, self._offer_draft_restore)
+            return
+        d = load_draft()
+        if not d:
+            return
+        who = d.get("company") or d.get("plate") or d.get("driver") or ""
+        when = d.get("ts", "").replace("T", " ")
+        text = f"Найден несохранённый черновик наряда от {when}" + (f" ({who})" if who else "") + ".\nВосстановить?"
+        if messagebox.askyesno("Черновик наряда", text, parent=self.root):
+            self.open_create_form()
+            self._apply_draft(d)
+        else:
+            self._discard_draft()
 
     # Применить текущий справочник к открытой форме
     def _apply_companies_to_form(self, win):
@@ -1210,6 +4416,32 @@ class WorkOrderApp:
                 self.search_results.set_items(values[:50], q.strip().lower())
         self._update_company_meta()
 
+    def _on_company_events(self, events: list[tuple[str, str]]):
+        """Внести в форму только изменившиеся компании, не сбивая выбор оператора."""
+        if not hasattr(self, "cmb_company") or not self._widget_exists(self.cmb_company):
+            return
+        current = self.company_selected.get()
+        if any(kind in ("added", "removed", "pay") for kind, _ in events):
+            # поменялся набор видимых компаний — список Combobox задаётся только целиком
+            q = self.company_query.get()
+            values = filter_companies(q)
+            self.cmb_company["values"] = values
+            shown = values[:50]
+            if self._widget_exists(getattr(self, "search_results", None)) and shown != [n for n, _ in self.search_results.items]:
+                self.search_results.set_items(shown, q.strip().lower())
+            self._refresh_quick_picks()
+            if current not in values:
+                self.cmb_company.set(values[0] if values else "")
+                self._update_company_meta()
+                return
+        if any(name == current and kind in ("plates", "inn") for kind, name in events):
+            plate, trailer = self.plate_list.get(), self.trailer_list.get()
+            self._update_company_meta()
+            if plate in self.plate_list["values"]:
+                self.plate_list.set(plate)
+            if trailer in self.trailer_list["values"]:
+                self.trailer_list.set(trailer)
+
     # ======= Админ‑панель =======
     def open_admin_panel(self):
         # пароль
@@ -1217,6 +4449,8 @@ class WorkOrderApp:
         if pwd != "12345":
             messagebox.showerror("Доступ запрещён", "Неверный пароль.", parent=self.root)
             return
+        # админка правит файл компаний — фоновая загрузка не должна потом затереть правки
+        self._loader.wait("companies")
 
         win = tb.Toplevel(self.root)
         win.title("Админ‑панель")
@@ -1251,11 +4485,7 @@ class WorkOrderApp:
             # добавляем В КОНЕЦ
             df.loc[len(df)] = {COL_NAME: name, COL_INN: inn, COL_PLATES: plates, COL_PAY: "да"}
             write_companies_df(df)
-            reload_companies_globals()
-            # обновим GUI, если окно формы открыто
-            self._apply_companies_to_form(self._create_form_window)
-            # обновим списки во всех вкладках админки
-            _apply_filter1(); _apply_filter2(); _apply_filter3(); _apply_filter4(); _refresh_plates_list(); _sync_pay_toggle()
+            set_company(*company_from_row(df.iloc[-1]))  # формы и вкладки обновятся по событию
             messagebox.showinfo("Готово", "Компания добавлена (в конец) и включена в списки (Оплата=да).", parent=win)
 
         tb.Button(tab_add_company, text="Добавить", bootstyle="success", command=do_add_company).grid(row=3, column=1, sticky="e", pady=8)
@@ -1289,18 +4519,8 @@ class WorkOrderApp:
             name = combo1.get().strip()
             if not name:
                 messagebox.showerror("Ошибка", "Выберите компанию.", parent=win); return
-            df = read_companies_df()
-            mask = df[COL_NAME].str.lower() == name.lower()
-            if not mask.any():
+            if not add_company_plates(name, parse_plates(newplates_var.get())):
                 messagebox.showerror("Ошибка", "Компания не найдена в таблице.", parent=win); return
-            plates_old = parse_plates(df.loc[mask, COL_PLATES].iloc[0])
-            plates_new = parse_plates(newplates_var.get())
-            plates_joined = join_plates(plates_old + plates_new)
-            df.loc[mask, COL_PLATES] = plates_joined
-            write_companies_df(df)
-            reload_companies_globals()
-            self._apply_companies_to_form(self._create_form_window)
-            _apply_filter1(); _refresh_plates_list()
             messagebox.showinfo("Готово", "Номера добавлены.", parent=win)
 
         tb.Button(tab_add_plate, text="Добавить номера", bootstyle="success", command=do_add_plates).grid(row=3, column=1, sticky="e", pady=8)
@@ -1320,13 +4540,8 @@ class WorkOrderApp:
         tb.Checkbutton(tab_pay, text="Оплата включена (да)", variable=pay_var, bootstyle="success-square-toggle").grid(row=2, column=0, sticky=NW, pady=4)
 
         def _sync_pay_toggle(*_):
-            name = combo2.get().strip()
-            if not name:
-                pay_var.set(False); return
-            df_state = read_companies_df()
-            mask = df_state[COL_NAME].str.lower() == name.lower()
-            current = str(df_state.loc[mask, COL_PAY].iloc[0]).strip().lower() if mask.any() else ''
-            pay_var.set(current in ("да","yes","true","1"))
+            # справочник в памяти совпадает с файлом — перечитывать его на каждый выбор не нужно
+            pay_var.set(_visible(COMPANIES.get(combo2.get().strip())))
 
         def _apply_filter2(*_):
             all_names = list(COMPANIES.keys())
@@ -1347,13 +4562,24 @@ class WorkOrderApp:
                 messagebox.showerror("Ошибка", "Компания не найдена.", parent=win); return
             df.loc[mask, COL_PAY] = "да" if pay_var.get() else "нет"
             write_companies_df(df)
-            reload_companies_globals()
-            self._apply_companies_to_form(self._create_form_window)
-            _apply_filter2(); _sync_pay_toggle()
+            set_company(*company_from_row(df.loc[mask].iloc[0]))
             messagebox.showinfo("Готово", "Статус оплаты обновлён.", parent=win)
 
         tb.Button(tab_pay, text="Сохранить", bootstyle="success", command=do_set_pay).grid(row=3, column=1, sticky="e", pady=8)
 
+        def do_pay_from_statement():
+            path = filedialog.askopenfilename(parent=win, title="Банковская выписка",
+                                              filetypes=[("Выписки", "*.xlsx *.csv *.txt"), ("Все файлы", "*.*")])
+            if not path:
+                return
+            try:
+                match = match_statement(read_bank_statement(path))
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Не удалось прочитать выписку: {e}", parent=win); return
+            self._show_statement_match(win, match)
+
+        tb.Button(tab_pay, text="Оплаты из выписки…", bootstyle="info", command=do_pay_from_statement).grid(row=3, column=0, sticky=NW, pady=8)
+
         # ====== вкладка Удалить компанию ======
         tab_del_company = tb.Frame(nb, padding=10)
         nb.add(tab_del_company, text="Удалить компанию")
@@ -1381,11 +4607,11 @@ class WorkOrderApp:
             if not messagebox.askyesno("Подтвердите", f"Удалить компанию «{name}» и все её номера?", parent=win):
                 return
             df = read_companies_df()
-            df = df[~(df[COL_NAME].str.lower() == name.lower())]
-            write_companies_df(df)
-            reload_companies_globals()
-            self._apply_companies_to_form(self._create_form_window)
-            _apply_filter1(); _apply_filter2(); _apply_filter3(); _apply_filter4(); _refresh_plates_list(); _sync_pay_toggle()
+            mask = df[COL_NAME].str.lower() == name.lower()
+            removed = list(df.loc[mask, COL_NAME])
+            write_companies_df(df[~mask])
+            for n in removed:
+                set_company(n, None)
             messagebox.showinfo("Готово", "Компания удалена.", parent=win)
 
         tb.Button(tab_del_company, text="Удалить", bootstyle="danger", command=do_del_company).grid(row=2, column=1, sticky="e", pady=8)
@@ -1409,7 +4635,7 @@ class WorkOrderApp:
             name = combo4.get().strip()
             listbox.delete(0, tk.END)
             if name and name in COMPANIES:
-                for p in COMPANIES[name]["plates"]:
+                for p in COMPANIES[name].plates:
                     listbox.insert(tk.END, p)
 
         def _apply_filter4(*_):
@@ -1431,21 +4657,162 @@ class WorkOrderApp:
             sel = [listbox.get(i) for i in listbox.curselection()]
             if not sel:
                 messagebox.showerror("Ошибка", "Выберите номера для удаления.", parent=win); return
-            df = read_companies_df()
-            mask = df[COL_NAME].str.lower() == name.lower()
-            if not mask.any():
+            if not remove_company_plates(name, sel):
                 messagebox.showerror("Ошибка", "Компания не найдена в таблице.", parent=win); return
-            old = parse_plates(df.loc[mask, COL_PLATES].iloc[0])
-            new = [p for p in old if p not in sel]
-            df.loc[mask, COL_PLATES] = join_plates(new)
-            write_companies_df(df)
-            reload_companies_globals()
-            self._apply_companies_to_form(self._create_form_window)
-            _apply_filter4(); _refresh_plates_list()
             messagebox.showinfo("Готово", "Выбранные номера удалены.", parent=win)
 
         tb.Button(tab_del_plate, text="Удалить отмеченные номера", bootstyle="danger", command=do_del_plates).grid(row=3, column=1, sticky="e", pady=8)
 
+        # правки справочника (свои и из файла) — обновляем только затронутое, сохраняя выбранную компанию
+        def _on_company_events(events):
+            if not self._widget_exists(win):
+                return
+            touched = {name for _, name in events}
+            if any(kind in ("added", "removed") for kind, _ in events):
+                for combo, qv in ((combo1, q1), (combo2, q2), (combo3, q3), (combo4, q4)):
+                    qq = qv.get().strip().lower()
+                    vals = [n for n in COMPANIES if qq in n.lower()]
+                    combo["values"] = vals
+                    if combo.get() not in COMPANIES:
+                        combo.set(vals[0] if vals else "")
+                        touched.add(combo.get())
+            if combo2.get() in touched:
+                _sync_pay_toggle()
+            if combo4.get() in touched:
+                _refresh_plates_list()
+        unsubscribe = subscribe_companies(_on_company_events)
+        win.bind("<Destroy>", lambda e: e.widget is win and unsubscribe(), add="+")
+
+        # ====== вкладка Импорт ======
+        tab_import = tb.Frame(nb, padding=10)
+        nb.add(tab_import, text="Импорт")
+        tab_import.grid_columnconfigure(1, weight=1)
+        tab_import.grid_rowconfigure(2, weight=1)
+
+        import_path = tk.StringVar()
+        import_summary = tk.StringVar(value="Файл CSV или xlsx: колонки Компания, ИНН, Номера (через запятую или по одному в строке).")
+        import_plan = {"plan": None}
+        tb.Label(tab_import, text="Файл:").grid(row=0, column=0, sticky=NW, pady=4)
+        tb.Entry(tab_import, textvariable=import_path, state="readonly").grid(row=0, column=1, sticky="we", pady=4)
+        tb.Label(tab_import, textvariable=import_summary, bootstyle="secondary", wraplength=900, justify=LEFT).grid(row=1, column=0, columnspan=3, sticky=NW, pady=4)
+        import_tree = ttk.Treeview(tab_import, columns=("company", "detail"), height=14)
+        import_tree.heading("#0", text="Действие")
+        import_tree.heading("company", text="Компания")
+        import_tree.heading("detail", text="Подробности")
+        import_tree.column("#0", width=140)
+        import_tree.column("company", width=260)
+        import_tree.grid(row=2, column=0, columnspan=3, sticky="nsew", pady=4)
+
+        def do_pick_import():
+            path = filedialog.askopenfilename(parent=win, title="Файл для импорта",
+                                              filetypes=[("Таблицы", "*.xlsx *.csv *.txt"), ("Все файлы", "*.*")])
+            if not path:
+                return
+            import_path.set(path)
+            try:
+                plan = plan_company_import(read_import_table(path))
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Не удалось прочитать файл: {e}", parent=win); return
+            import_plan["plan"] = plan
+            import_tree.delete(*import_tree.get_children())
+            for k, (action, name, detail) in enumerate(plan.diff()):
+                if k == IMPORT_PREVIEW_ROWS:
+                    import_tree.insert("", tk.END, text="…", values=("", "остальные строки не показаны"))
+                    break
+                import_tree.insert("", tk.END, text=action, values=(name, detail))
+            import_summary.set(plan.summary() + ("" if plan.empty else " Проверьте список и нажмите «Импортировать»."))
+
+        def do_apply_import():
+            plan = import_plan["plan"]
+            if plan is None or plan.empty:
+                messagebox.showinfo("Импорт", "Нечего импортировать — сначала выберите файл.", parent=win); return
+            apply_company_import(plan)  # формы и вкладки обновятся по событиям справочника
+            import_plan["plan"] = None
+            import_tree.delete(*import_tree.get_children())
+            messagebox.showinfo("Готово", "Импорт записан. " + plan.summary(), parent=win)
+
+        tb.Button(tab_import, text="Выбрать файл…", bootstyle="secondary", command=do_pick_import).grid(row=0, column=2, sticky="e", padx=6)
+        tb.Button(tab_import, text="Импортировать", bootstyle="success", command=do_apply_import).grid(row=3, column=2, sticky="e", pady=8)
+
+        # ====== вкладка Диагностика ======
+        tab_diag = tb.Frame(nb, padding=10)
+        nb.add(tab_diag, text="Диагностика")
+        tab_diag.grid_columnconfigure(0, weight=1)
+        tab_diag.grid_rowconfigure(1, weight=2)
+        tab_diag.grid_rowconfigure(3, weight=1)
+
+        metrics_on = tk.BooleanVar(value=METRICS.enabled)
+        def _toggle_metrics():
+            METRICS.enabled = metrics_on.get()
+        tb.Checkbutton(tab_diag, text="Собирать замеры", variable=metrics_on, command=_toggle_metrics, bootstyle="success-square-toggle").grid(row=0, column=0, sticky=NW, pady=4)
+
+        spans_tree = ttk.Treeview(tab_diag, columns=("count", "p50", "p95", "last"), height=10)
+        spans_tree.heading("#0", text="Замер")
+        for col, title in (("count", "Кол-во"), ("p50", "p50, мс"), ("p95", "p95, мс"), ("last", "Последний, мс")):
+            spans_tree.heading(col, text=title)
+            spans_tree.column(col, width=110, anchor="e")
+        spans_tree.grid(row=1, column=0, sticky="nsew", pady=4)
+
+        tb.Label(tab_diag, text="Кэши:").grid(row=2, column=0, sticky=NW, pady=(8, 0))
+        cache_tree = ttk.Treeview(tab_diag, columns=("hits", "misses", "rate"), height=5)
+        cache_tree.heading("#0", text="Кэш")
+        for col, title in (("hits", "Попадания"), ("misses", "Промахи"), ("rate", "Доля попаданий")):
+            cache_tree.heading(col, text=title)
+            cache_tree.column(col, width=120, anchor="e")
+        cache_tree.grid(row=3, column=0, sticky="nsew", pady=4)
+
+        diag_info = tk.StringVar(value=f"Файл метрик: {METRICS.path}")
+        tb.Label(tab_diag, textvariable=diag_info, bootstyle="secondary").grid(row=4, column=0, sticky=NW, pady=4)
+        startup = "  ".join(f"{stage}: {ms:.0f} мс" for stage, ms in STARTUP_TIMINGS.items())
+        tb.Label(tab_diag, text=f"Запуск (от старта процесса): {startup}", bootstyle="secondary").grid(row=5, column=0, sticky=NW)
+
+        def _refresh_diag():
+            if not self._widget_exists(spans_tree):
+                return
+            spans_tree.delete(*spans_tree.get_children())
+            for name, st in sorted(METRICS.summary().items()):
+                spans_tree.insert("", tk.END, text=name, values=(st["count"], f"{st['p50']:.1f}", f"{st['p95']:.1f}", f"{st['last']:.1f}"))
+            cache_tree.delete(*cache_tree.get_children())
+            for name, (hits, misses, rate) in sorted(METRICS.cache_summary().items()):
+                cache_tree.insert("", tk.END, text=name, values=(hits, misses, f"{rate:.0%}"))
+            win.after(2000, _refresh_diag)
+        _refresh_diag()
+
+    def _show_statement_match(self, parent, match: StatementMatch):
+        """Итог сверки выписки: кому включим оплату и какие плательщики не нашлись."""
+        dlg = tb.Toplevel(parent)
+        dlg.title("Оплаты из выписки")
+        dlg.geometry("900x560")
+        dlg.grid_columnconfigure(0, weight=1)
+        dlg.grid_rowconfigure(1, weight=1)
+        summary = tk.StringVar(value=match.summary())
+        tb.Label(dlg, textvariable=summary, wraplength=860, justify=LEFT).grid(row=0, column=0, columnspan=2, sticky=NW, padx=10, pady=8)
+        tree = ttk.Treeview(dlg, columns=("inn", "detail"))
+        tree.heading("#0", text="Компания / плательщик")
+        tree.heading("inn", text="ИНН")
+        tree.heading("detail", text="")
+        tree.column("#0", width=380)
+        tree.column("inn", width=130)
+        tree.grid(row=1, column=0, sticky="nsew", padx=10)
+        vsb = ttk.Scrollbar(dlg, orient="vertical", command=tree.yview)
+        vsb.grid(row=1, column=1, sticky="ns")
+        tree.configure(yscrollcommand=vsb.set)
+        enable = tree.insert("", tk.END, text=f"Включить оплату ({len(match.enable)})", open=True)
+        for name, inn in match.enable.items():
+            tree.insert(enable, tk.END, text=name, values=(inn, ""))
+        missing = tree.insert("", tk.END, text=f"Нет в справочнике ({len(match.unmatched)})", open=True)
+        for inn, (payer, total, n) in sorted(match.unmatched.items(), key=lambda kv: -kv[1][1]):
+            tree.insert(missing, tk.END, text=payer or "—", values=(inn or "—", f"{n} плат. на {total:,.2f} ₽".replace(",", " ")))
+
+        def _apply():
+            apply_statement(match)  # формы и вкладки обновятся по событиям справочника
+            summary.set(f"Оплата включена: {len(match.enable)} компаний. " + match.summary())
+            btn_apply.configure(state=DISABLED)
+
+        btn_apply = tb.Button(dlg, text=f"Включить оплату ({len(match.enable)})", bootstyle="success", command=_apply,
+                              state=(NORMAL if match.enable else DISABLED))
+        btn_apply.grid(row=2, column=0, sticky="e", padx=10, pady=8)
+
     # ======= ЛОГИКА формы =======
     def _widget_exists(self, w) -> bool:
         try:
@@ -1455,17 +4822,21 @@ class WorkOrderApp:
 
     def _update_company_meta(self):
         name = getattr(self, "company_selected", tk.StringVar()).get()
-        meta = COMPANIES.get(name, {"inn": "", "cars": [], "trailers": [], "plates": []})
+        meta = COMPANIES.get(name) or Company(0, name)
         if hasattr(self, "company_inn_var"):
-            self.company_inn_var.set(meta.get("inn", ""))
+            self.company_inn_var.set(meta.inn)
         q = ""
         if hasattr(self, "company_query"):
             q = self.company_query.get().strip().lower()
+        # точное совпадение номера по индексу важнее поиска подстроки
+        ref = PLATE_INDEX.lookup(q) if q else None
+        if ref is not None and ref.company != name:
+            ref = None
         if hasattr(self, "plate_list") and self._widget_exists(self.plate_list):
-            cars = meta.get("cars", [])
+            cars = list(meta.cars)
             self.plate_list["values"] = cars
-            sel_plate = ""
-            for p in cars:
+            sel_plate = ref.plate if ref is not None and ref.role == "car" else ""
+            for p in ([] if sel_plate else cars):
                 if q and q in p.lower():
                     sel_plate = p
                     break
@@ -1476,10 +4847,10 @@ class WorkOrderApp:
             else:
                 self.plate_list.set("")
         if hasattr(self, "trailer_list") and self._widget_exists(self.trailer_list):
-            trailers = ["Без прицепа"] + meta.get("trailers", [])
+            trailers = ["Без прицепа", *meta.trailers]
             self.trailer_list["values"] = trailers
-            sel_trailer = ""
-            for t in trailers:
+            sel_trailer = ref.plate if ref is not None and ref.role == "trailer" else ""
+            for t in ([] if sel_trailer else trailers):
                 if q and q in t.lower():
                     sel_trailer = t
                     break
@@ -1504,13 +4875,19 @@ class WorkOrderApp:
                 if hasattr(self, "trailer_list"):
                     self.trailer_list.configure(state=DISABLED)
 
-    def _update_service_prices(self):
+    def _update_service_prices(self, changed: set | None = None):
+        """Подписи цен у услуг; changed — только эти пары (тип авто, услуга прайса)."""
         vt = getattr(self, "vehicle_type", tk.StringVar(value="Легковой")).get()
         global PRICE_TABLE
+        if not self._loader.ready("price"):
+            return  # подписи цен заполнятся, когда прайс догрузится
+        METRICS.cache("price", bool(PRICE_TABLE.get(vt)))
         if not PRICE_TABLE.get(vt):
             PRICE_TABLE = load_price_table()
         for name, lbl in getattr(self, "service_price_labels", {}).items():
             base_name = SERVICE_PRICE_NAME.get(name, name)
+            if changed is not None and (vt, base_name) not in changed:
+                continue
             price = PRICE_TABLE.get(vt, {}).get(base_name, "-")
             if isinstance(price, tuple):
                 lbl.configure(text=f"{price[0]}/{price[1]}")
@@ -1519,15 +4896,17 @@ class WorkOrderApp:
             else:
                 lbl.configure(text="-")
 
-    def _ask_split_service(self, title: str, labels: list[str], total: int) -> list[int]:
+    def _ask_split_service(self, title: str, labels: list[str], total: int, initial: list[int] | None = None) -> list[int]:
         win = tb.Toplevel(self._form_parent)
         win.title(title)
+        if not (initial and len(initial) == len(labels) and sum(initial) == total):
+            initial = [total] + [0] * (len(labels) - 1)  # разбивка прошлого наряда — только если сошлось количество
         vars = []
         for i, lab in enumerate(labels):
             row = tb.Frame(win, padding=4)
             row.grid(row=i, column=0)
             tb.Label(row, text=lab).pack(side=LEFT, padx=4)
-            val = tk.IntVar(value=(total if i == 0 else 0))
+            val = tk.IntVar(value=initial[i])
             tb.Spinbox(row, from_=0, to=999, textvariable=val, width=6).pack(side=LEFT, padx=4)
             vars.append(val)
         res = []
@@ -1539,66 +4918,50 @@ class WorkOrderApp:
         self._form_parent.wait_window(win)
         return res
 
-    def _ask_consumables(self, kind: str, qty: int):
-        global CONSUMABLES_TABLE, CONSUMABLE_CATEGORIES
-        # перечитываем файл, чтобы гарантировать актуальные данные
-        CONSUMABLES_TABLE, CONSUMABLE_CATEGORIES = load_consumables_table()
-        dlg = ConsumableDialog(self._form_parent, kind, qty)
+    def _ask_consumables(self, wanted: dict[str, int]) -> dict[str, list]:
+        """Одно окно на все выбранные услуги-расходники: {услуга: кол-во} -> {услуга: [(вариант, категория, тип), ...]}."""
+        if not wanted:
+            return {}
+        # таблица расходников актуальна: правки файла подхватывает DataDirWatcher
+        dlg = ConsumableDialog(self._form_parent, wanted,
+                               {name: line["items"] for name, line in self._repeat_lines.items() if "items" in line})
         self._form_parent.wait_window(dlg)
-        return dlg.result or []
+        return dlg.result or {}
 
+    @METRICS.timed("collect_services")
     def _collect_services(self) -> dict[str, dict]:
         vt = self.vehicle_type.get()
         global PRICE_TABLE
+        self._loader.wait("price")
+        self._loader.wait("consumables")
+        METRICS.cache("price", bool(PRICE_TABLE.get(vt)))
         if not PRICE_TABLE.get(vt):
             PRICE_TABLE = load_price_table()
-        selected = {}
+        consumables = self._ask_consumables({
+            name: qty for name in SERVICES
+            if name in CONSUMABLE_SERVICE_MAP and self.services_vars[name].get()
+            and (qty := max(0, int(self.services_qty[name].get()))) > 0
+        })
+        # исходные данные строк (разбивка, расходники) сохраняются в наряде — по ним его можно пересчитать
+        lines = {}
         for name in SERVICES:
             var = self.services_vars[name]
             qty = max(0, int(self.services_qty[name].get()))
             if not (var.get() and qty > 0):
                 continue
-            base_name = SERVICE_PRICE_NAME.get(name, name)
-            if name == "Снятие/установка":
-                outer, inner = self._ask_split_service(name, ["наружное", "внутреннее"], qty)
-                price = PRICE_TABLE.get(vt, {}).get(base_name, (0,0))
-                if isinstance(price, int):
-                    price = (price, price)
-                cost = outer*price[0] + inner*price[1]
-                total_qty = outer + inner
-                if total_qty > 0:
-                    avg = cost // total_qty
-                    selected[name] = {"qty": total_qty, "price": avg, "cost": cost}
-                    self.services_qty[name].set(total_qty)
-                else:
-                    self.services_qty[name].set(0)
-            elif name == "Вентиль легковой":
-                chrome, black = self._ask_split_service(name, ["хром", "черный"], qty)
-                price = PRICE_TABLE.get(vt, {}).get(base_name, (0,0))
-                cost = chrome*price[0] + black*price[1]
-                total_qty = chrome + black
-                if total_qty > 0:
-                    avg = cost // total_qty
-                    selected[name] = {"qty": total_qty, "price": avg, "cost": cost}
-                    self.services_qty[name].set(total_qty)
-                else:
-                    self.services_qty[name].set(0)
+            if name in SPLIT_SERVICES:
+                lines[name] = {"parts": self._ask_split_service(name, SPLIT_SERVICES[name], qty,
+                                                                self._repeat_lines.get(name, {}).get("parts"))}
             elif name in CONSUMABLE_SERVICE_MAP:
-                kind = CONSUMABLE_SERVICE_MAP[name]
-                items = self._ask_consumables(kind, qty)
-                cost = 0
-                for n, c, t in items:
-                    price = CONSUMABLES_TABLE.get(kind, {}).get(n, {}).get((c, t), 0)
-                    cost += price
-                total_qty = len(items)
-                if total_qty > 0:
-                    avg = cost // total_qty
-                    selected[name] = {"qty": total_qty, "price": avg, "cost": cost}
-                    self.services_qty[name].set(total_qty)
+                counts = collections.Counter(consumables.get(name, []))
+                lines[name] = {"items": [[n, c, t, k] for (n, c, t), k in counts.items()]}
             else:
-                price = PRICE_TABLE.get(vt, {}).get(base_name, 0)
-                cost = price * qty
-                selected[name] = {"qty": qty, "price": price, "cost": cost}
+                lines[name] = {"qty": qty}
+        selected = price_services(vt, lines)
+        for name, line in lines.items():
+            total_qty = selected.get(name, {}).get("qty", 0)
+            if "parts" in line or total_qty:
+                self.services_qty[name].set(total_qty)
         return selected
 
     def _validate(self) -> tuple[bool, str]:
@@ -1655,6 +5018,7 @@ class WorkOrderApp:
             "issued_to": self.issued_to.get().strip(),
             "mechanic": self.mechanic.get().strip(),
             "vehicle_type": self.vehicle_type.get(),
+            "template": self.template_name,
             "services": self._collect_services(),
         }
         return data
@@ -1667,7 +5031,9 @@ class WorkOrderApp:
         data = self._gather_data()
         try:
             xlsx_path = fill_excel_only(data)
-            messagebox.showinfo("Готово", f"Excel сформирован:\n\n{xlsx_path}\n\nОткрываю папку с результатами.", parent=self._form_parent)
+            self._discard_draft()
+            self._record_usage(data)
+            messagebox.showinfo("Готово", f"Наряд № {data['number']}. Excel сформирован:\n\n{xlsx_path}\n\nОткрываю папку с результатами.", parent=self._form_parent)
             try:
                 os.startfile(str(OUTPUT_DIR.resolve()))
             except Exception:
@@ -1683,21 +5049,141 @@ class WorkOrderApp:
             messagebox.showerror("Ошибка", msg, parent=self._form_parent)
             return
         data = self._gather_data()
+        reprint = find_reprint(data)
+        if reprint is not None:
+            meta, xlsx_path, pdf_path = reprint
+            if messagebox.askyesno("Такой наряд уже есть", f"Сегодня уже сформирован такой же наряд № {meta.get('number', '')}:\n\n"
+                                   f"{pdf_path}\n\nОткрыть его для повторной печати?\n(«Нет» — создать новый наряд с новым номером.)",
+                                   parent=self._form_parent):
+                self._discard_draft()
+                try:
+                    os.startfile(str(pdf_path))
+                except Exception:
+                    pass
+                return
         try:
             xlsx_path, pdf_path = fill_excel_and_export_pdf(data)
-            messagebox.showinfo("Готово", f"Файлы сохранены:\n\n{xlsx_path}\n{pdf_path}\n\nОткрываю папку с результатами.", parent=self._form_parent)
+            self._discard_draft()
+            self._record_usage(data)
+            messagebox.showinfo("Готово", f"Наряд № {data['number']}. Файлы сохранены:\n\n{xlsx_path}\n{pdf_path}\n\nОткрываю папку с результатами.", parent=self._form_parent)
             try:
                 os.startfile(str(OUTPUT_DIR.resolve()))
             except Exception:
                 pass
         except FileNotFoundError as e:
             messagebox.showerror("Шаблон не найден", str(e), parent=self._form_parent)
+        except PdfQueuedError as e:
+            self._discard_draft()
+            self._record_usage(data)
+            self._poll_outbox(reschedule=False)
+            messagebox.showwarning("PDF в очереди", f"Excel сохранён:\n\n{e.xlsx_path}\n\nPDF не удалось создать сейчас — "
+                                   f"он будет создан автоматически, когда заработает Excel или LibreOffice "
+                                   f"(в очереди: {e.pending}).", parent=self._form_parent)
         except RuntimeError as e:
             messagebox.showerror("Не удалось создать PDF", f"{e}\nПроверьте наличие Microsoft Excel (или LibreOffice).", parent=self._form_parent)
         except Exception as e:
             messagebox.showerror("Ошибка", f"Неожиданная ошибка: {e}", parent=self._form_parent)
 
-def main():
+def _cli_metrics(args):
+    summary = summarize_metrics_file()
+    if not summary:
+        print(f"Нет замеров в {METRICS_FILE}")
+        return
+    width = max(len(k) for k in summary)
+    for name, st in sorted(summary.items()):
+        print(f"{name:<{width}}  n={st['count']:<6} p50={st['p50']:9.1f} мс  p95={st['p95']:9.1f} мс")
+
+
+def _cli_import_bank(args):
+    _set_companies(_load_companies_bundle())
+    match = match_statement(read_bank_statement(args.file))
+    for name, inn in match.enable.items():
+        print(f"оплата: да     {name} (ИНН {inn})")
+    for inn, (payer, total, n) in match.unmatched.items():
+        print(f"не найден      {inn or '—'} {payer}: {n} плат. на {total:,.2f} ₽".replace(",", " "))
+    print(match.summary())
+    if not args.apply:
+        print("Пробный прогон — файл компаний не изменён (запишите с --apply).")
+    elif match.enable:
+        apply_statement(match)
+        print(f"Записано в {COMPANIES_XLSX}")
+
+
+def _cli_import_companies(args):
+    _set_companies(_load_companies_bundle())
+    plan = plan_company_import(read_import_table(args.file))
+    for action, name, detail in plan.diff():
+        print(f"{action:<15} {name}: {detail}")
+    print(plan.summary())
+    if not args.apply:
+        print("Пробный прогон — файл компаний не изменён (запишите с --apply).")
+    elif not plan.empty:
+        apply_company_import(plan)
+        print(f"Записано в {COMPANIES_XLSX}")
+
+
+def _cli_reprice(args):
+    # история пополняется при загрузке справочников: текущие файлы — последняя ревизия
+    for name in ("price", "consumables"):
+        load, apply = TABLE_LOADERS[name]
+        apply(load())
+    paths = args.files or sorted(OUTPUT_DIR.glob("наряд_*.json"))
+    rows = reprice_orders(paths, args.date)
+    for path, old, new in rows:
+        mark = "" if old == new else f"  ({new - old:+d} ₽)"
+        print(f"{path.name:<32} {old:>9} ₽ -> {new:>9} ₽{mark}")
+    changed = sum(1 for _, old, new in rows if old != new)
+    print(f"Нарядов: {len(rows)}, сумма отличается: {changed}; ревизий прайса: {len(PRICE_HISTORY.revisions('price'))}")
+
+
+def _cli_export(args):
+    _set_companies(_load_companies_bundle())
+    n = export_orders(args.out, args.date_from, args.date_to, args.format)
+    print(f"Выгружено строк: {n} -> {args.out}")
+
+
+def _cli_find(args):
+    added, removed = ORDER_INDEX.sync()
+    if added or removed:
+        print(f"Индекс обновлён: +{added}, −{removed}")
+    hits = ORDER_INDEX.search(" ".join(args.query), parse_search_day(args.date_from or ""), parse_search_day(args.date_to or "", end=True))
+    for h in hits:
+        print(f"{h['created']}  {h['number']:<14} {h['customer'][:30]:<30} {h['plate'][:24]:<24} {h['total']:>9} ₽  {h['file']}")
+    print(f"Найдено: {len(hits)}")
+
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description="Наряд-Заказ")
+    sub = ap.add_subparsers(dest="command")
+    sub.add_parser("metrics", help="сводка p50/p95 по файлу метрик").set_defaults(func=_cli_metrics)
+    p_imp = sub.add_parser("import-companies", help="массовый импорт компаний и номеров из CSV/xlsx")
+    p_imp.add_argument("file", help="таблица с колонками Компания, ИНН, Номера (Оплата — по желанию)")
+    p_imp.add_argument("--apply", action="store_true", help="записать изменения (без флага — только показать)")
+    p_imp.set_defaults(func=_cli_import_companies)
+    p_bank = sub.add_parser("import-bank", help="включить «Оплата» по банковской выписке (сверка по ИНН плательщика)")
+    p_bank.add_argument("file", help="выписка: CSV/xlsx или 1C (1CClientBankExchange, .txt)")
+    p_bank.add_argument("--apply", action="store_true", help="записать изменения (без флага — только показать)")
+    p_bank.set_defaults(func=_cli_import_bank)
+    p_rep = sub.add_parser("reprice", help="пересчитать наряды по ценам на дату (по умолчанию — на дату наряда)")
+    p_rep.add_argument("files", nargs="*", type=Path, help="JSON нарядов (по умолчанию — все из папки output)")
+    p_rep.add_argument("--date", help="дата цен, ГГГГ-ММ-ДД")
+    p_rep.set_defaults(func=_cli_reprice)
+    p_exp = sub.add_parser("export", help="выгрузить наряды за период для бухгалтерии (строка на услугу)")
+    p_exp.add_argument("out", type=Path, help="файл: .csv, .jsonl (можно с .gz) или .parquet (нужен pyarrow)")
+    p_exp.add_argument("--from", dest="date_from", help="с даты, ГГГГ-ММ-ДД")
+    p_exp.add_argument("--to", dest="date_to", help="по дату включительно, ГГГГ-ММ-ДД")
+    p_exp.add_argument("--format", choices=EXPORT_FORMATS, help="формат, если не ясен из расширения")
+    p_exp.set_defaults(func=_cli_export)
+    p_find = sub.add_parser("find", help="полнотекстовый поиск по нарядам (заказчик, номер, водитель, неисправность, услуги)")
+    p_find.add_argument("query", nargs="*", help="слова запроса; каждое — как начало слова")
+    p_find.add_argument("--from", dest="date_from", help="с даты: ДД.ММ.ГГГГ, ММ.ГГГГ или ГГГГ")
+    p_find.add_argument("--to", dest="date_to", help="по дату: ДД.ММ.ГГГГ, ММ.ГГГГ или ГГГГ")
+    p_find.set_defaults(func=_cli_find)
+    args = ap.parse_args(argv)
+    if args.command:
+        return args.func(args)
+
     app = tb.Window(themename="flatly")
     WorkOrderApp(app)
     app.mainloop()
@@ -0,0 +1,53 @@
+import main
+
+
+def _files(tmp_path, name, size):
+    xlsx, pdf = tmp_path / f"{name}.xlsx", tmp_path / f"{name}.pdf"
+    xlsx.write_bytes(b"x" * size)
+    pdf.write_bytes(b"p" * size)
+    return {"order.xlsx": xlsx, "order.pdf": pdf}
+
+
+def test_fingerprint_ignores_number_and_time():
+    order = {"customer_display": "ООО Ромашка", "plate": "А123ВС77", "number": "2026-15", "created": "2026-03-05 10:00"}
+    key = main.order_fingerprint(order, "v1")
+    assert main.order_fingerprint({**order, "number": "2026-16", "created": "2026-03-05 17:30"}, "v1") == key
+    assert main.order_fingerprint({**order, "plate": " А123ВС77 "}, "v1") == key
+    assert main.order_fingerprint({**order, "created": "2026-03-06 10:00"}, "v1") != key  # дата печатается на бланке
+    assert main.order_fingerprint(order, "v2") != key
+    assert main.order_fingerprint({**order, "plate": "В456ОР199"}, "v1") != key
+
+
+def test_put_get(tmp_path):
+    cache = main.ArtifactCache(tmp_path / "cache")
+    assert cache.get("ab" * 32) is None
+    cache.put("ab" * 32, _files(tmp_path, "a", 10), {"number": "2026-15"})
+    cached = cache.get("ab" * 32)
+    assert cached["number"] == "2026-15"
+    assert cached["paths"]["order.pdf"].read_bytes() == b"p" * 10
+    cached["paths"]["order.pdf"].unlink()
+    assert cache.get("ab" * 32) is None  # неполная запись — промах
+
+
+def test_lru_eviction(tmp_path):
+    cache = main.ArtifactCache(tmp_path / "cache", max_bytes=300)  # запись — около 140 байт вместе с meta.json
+    for key in ("aa", "bb"):
+        cache.put(key * 32, _files(tmp_path, key, 50), {})
+    assert cache.get("aa" * 32) is not None  # «aa» открывали последним — уходит «bb»
+    cache.put("cc" * 32, _files(tmp_path, "cc", 50), {})
+    assert cache.get("bb" * 32) is None
+    assert cache.get("aa" * 32) is not None
+    assert cache.get("cc" * 32) is not None
+    # новый экземпляр (следующий запуск) восстанавливает размеры с диска
+    fresh = main.ArtifactCache(tmp_path / "cache", max_bytes=150)
+    fresh.put("dd" * 32, _files(tmp_path, "dd", 50), {})
+    assert sum(fresh.get(k * 32) is not None for k in ("aa", "cc", "dd")) == 1
+
+
+def test_restore_missing_originals(tmp_path):
+    cache = main.ArtifactCache(tmp_path / "cache")
+    files = _files(tmp_path, "a", 10)
+    cache.put("ab" * 32, files, {"xlsx": str(files["order.xlsx"]), "pdf": str(files["order.pdf"])})
+    files["order.pdf"].unlink()
+    assert main.ArtifactCache.restore(cache.get("ab" * 32)) == (files["order.xlsx"], files["order.pdf"])
+    assert files["order.pdf"].read_bytes() == b"p" * 10
@@ -0,0 +1,33 @@
+import main
+
+
+PREAMBLE_CSV = """\
+Выписка по счёту;40702810900000012345;;
+Период;01.03.2026;31.03.2026;
+Владелец счёта;ООО Шиномонтаж;ИНН 7701000000;
+Дата;Плательщик;ИНН плательщика;Назначение платежа;Поступление
+05.03.2026;ООО Транслогистика;7702000001;Оплата по счёту 12;15 000,00
+06.03.2026;ИП Петров;770300000002;Оплата по счёту 13;2 500,50
+"""
+
+
+def test_csv_with_preamble(tmp_path):
+    path = tmp_path / "statement.csv"
+    path.write_text(PREAMBLE_CSV, encoding="cp1251")
+    assert main.read_bank_statement(path) == [
+        ("7702000001", "ООО Транслогистика", 15000.0),
+        ("770300000002", "ИП Петров", 2500.5),
+    ]
+
+
+def test_csv_without_preamble(tmp_path):
+    path = tmp_path / "statement.csv"
+    path.write_text("ИНН плательщика,Плательщик,Сумма\n7702000001,ООО Транслогистика,100\n", encoding="utf-8-sig")
+    assert main.read_bank_statement(path) == [("7702000001", "ООО Транслогистика", 100.0)]
+
+
+def test_import_table_csv(tmp_path):
+    path = tmp_path / "import.csv"
+    path.write_text("Компания;ИНН;Номера\nООО Ромашка;7701000001;А123ВС77\n", encoding="utf-8")
+    df = main.read_import_table(path)
+    assert df.iloc[0]["Компания"] == "ООО Ромашка"
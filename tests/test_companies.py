@@ -0,0 +1,91 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def companies(monkeypatch):
+    table = {
+        "ООО Альфа": main.Company(1, "ООО Альфа", "7701000001", "да", ("А111АА77",)),
+        "ООО Бета": main.Company(2, "ООО Бета", "", "нет", ("В222ВВ77",)),
+        "ООО Вега": main.Company(3, "ООО Вега", "", "да", ("Е333ЕЕ77",)),
+    }
+    plates = main.PlateIndex.build(table)
+    visible = [n for n, m in table.items() if m.visible]
+    monkeypatch.setattr(main, "COMPANIES", table)
+    monkeypatch.setattr(main, "ALL_COMPANY_NAMES", visible)
+    monkeypatch.setattr(main, "PLATE_INDEX", plates)
+    monkeypatch.setattr(main, "SEARCH_INDEX", main.CompanySearchIndex(visible, plates))
+    monkeypatch.setattr(main, "COMPANY_LISTENERS", [])
+    return table
+
+
+def _search(query):
+    names = main.SEARCH_INDEX.names
+    return [names[i] for _, _, i in main.SEARCH_INDEX.search(query)]
+
+
+def test_change_without_events_reaches_companies(companies):
+    meta = main.Company(10, "ООО Альфа", "7701000001", "да", ("А111АА77",))
+    main.set_company("ООО Альфа", meta)
+    assert main.COMPANIES["ООО Альфа"] is meta
+
+
+def test_reindexed_company_keeps_file_order(companies):
+    main.set_company("ООО Альфа", main.Company(1, "ООО Альфа", "7701000001", "да", ("А111АА77", "К444КК77")))
+    assert _search("ооо") == ["ООО Альфа", "ООО Вега"]
+    main.set_company("ООО Бета", main.Company(2, "ООО Бета", "", "да", ("В222ВВ77",)))
+    assert main.ALL_COMPANY_NAMES == ["ООО Альфа", "ООО Бета", "ООО Вега"]
+    assert _search("ооо") == ["ООО Альфа", "ООО Бета", "ООО Вега"]
+    main.set_company("ООО Гамма", main.Company(4, "ООО Гамма", "", "да", ()))
+    assert _search("ооо") == ["ООО Альфа", "ООО Бета", "ООО Вега", "ООО Гамма"]
+
+
+def _search_index():
+    table = {
+        "ООО Транслогистика": main.Company(1, "ООО Транслогистика", plates=("А123ВС77", "SCANIA М332КР196")),
+        "Логистик-Сервис": main.Company(2, "Логистик-Сервис", plates=("В456ОР199",)),
+        "ИП Петров": main.Company(3, "ИП Петров", plates=("Прицеп ЕА 1626 66",)),
+        "Транспортная компания «Север»": main.Company(4, "Транспортная компания «Север»"),
+    }
+    return main.CompanySearchIndex(list(table), main.PlateIndex.build(table))
+
+
+def _ranked(index, query):
+    return [(tier, d, index.names[i]) for tier, d, i in index.search(query)]
+
+
+def test_search_tiers():
+    index = _search_index()
+    assert _ranked(index, "транс") == [(0, 0, "Транспортная компания «Север»"), (1, 0, "ООО Транслогистика")]
+    assert _ranked(index, "логистик") == [(0, 0, "Логистик-Сервис"), (1, 0, "ООО Транслогистика")]
+    assert _ranked(index, "петров") == [(1, 0, "ИП Петров")]
+    assert _ranked(index, "") == []
+
+
+def test_search_by_plate_fragment():
+    index = _search_index()
+    assert _ranked(index, "a123") == [(1, 0, "ООО Транслогистика")]
+    assert _ranked(index, "1626") == [(1, 0, "ИП Петров")]
+    assert _ranked(index, "scania") == [(1, 0, "ООО Транслогистика")]
+
+
+def test_search_typos():
+    index = _search_index()
+    assert _ranked(index, "транслогистк") == [(2, 1, "ООО Транслогистика")]
+    assert _ranked(index, "петрв") == [(2, 1, "ИП Петров")]
+    assert _ranked(index, "петорв") == []  # две правки в слове из шести букв — больше, чем допускаем
+    assert _ranked(index, "сивер транспортная") == [(2, 1, "Транспортная компания «Север»")]
+    assert _ranked(index, "пет") == [(1, 0, "ИП Петров")]  # короткое слово — без опечаток
+    assert _ranked(index, "ипп") == []
+
+
+def test_search_skips_removed():
+    index = _search_index()
+    plates = main.PlateIndex.build({"ИП Петров": main.Company(3, "ИП Петров", plates=("К100КК77",))})
+    index.remove("ИП Петров")
+    assert _ranked(index, "петров") == []
+    index.add("ИП Петров", plates)
+    assert _ranked(index, "к100") == [(1, 0, "ИП Петров")]
+    assert _ranked(index, "1626") == []
+    assert index.garbage == 1
@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+
+import main
+
+
+@pytest.fixture
+def companies(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "COMPANIES_XLSX", tmp_path / "companies.xlsx")
+    for name in ("COMPANIES", "ALL_COMPANY_NAMES", "PLATE_INDEX", "SEARCH_INDEX", "PLATES"):
+        monkeypatch.setattr(main, name, getattr(main, name))
+    df = pd.DataFrame([["ООО Ромашка", "7701000001", "В222ВВ77, А111АА77", "да", ""]], columns=main.COMPANY_COLUMNS)
+    main.write_companies_df(df)
+    main._set_companies(main._load_companies_bundle())
+
+
+def _plan(*rows):
+    df = pd.DataFrame([[name, "", plates, ""] for name, plates in rows],
+                      columns=[main.COL_NAME, main.COL_INN, main.COL_PLATES, main.COL_PAY])
+    return main.plan_company_import(df)
+
+
+def test_failed_write_leaves_memory_untouched(companies, monkeypatch):
+    plan = _plan(("ООО Ромашка", "С333СС77"), ("ООО Лютик", "Е444ЕЕ77"))
+    plates, meta = main.PLATES.records, main.COMPANIES["ООО Ромашка"]
+
+    def fail(df):
+        raise PermissionError("companies.xlsx открыт в Excel")
+
+    monkeypatch.setattr(main, "write_companies_df", fail)
+    with pytest.raises(PermissionError):
+        main.apply_company_import(plan)
+    assert main.PLATES.records == plates
+    assert main.COMPANIES["ООО Ромашка"] is meta
+    assert "ООО Лютик" not in main.COMPANIES
+
+
+def test_import_appends_plates_in_order(companies):
+    main.apply_company_import(_plan(("ООО Ромашка", "С333СС77, а111аа77")))
+    assert main.read_companies_df()[main.COL_PLATES].tolist() == ["В222ВВ77, А111АА77, С333СС77"]
+    assert set(main.COMPANIES["ООО Ромашка"].plates) == {"А111АА77", "В222ВВ77", "С333СС77"}
+
+
+def _fail_write(df):
+    raise PermissionError("companies.xlsx открыт в Excel")
+
+
+@pytest.mark.parametrize("change", [
+    lambda: main.add_company_plates("ООО Ромашка", ["С333СС77"]),
+    lambda: main.remove_company_plates("ООО Ромашка", ["А111АА77"]),
+])
+def test_failed_plate_edit_leaves_memory_untouched(companies, monkeypatch, change):
+    plates, meta = main.PLATES.records, main.COMPANIES["ООО Ромашка"]
+    monkeypatch.setattr(main, "write_companies_df", _fail_write)
+    with pytest.raises(PermissionError):
+        change()
+    assert main.PLATES.records == plates
+    assert main.COMPANIES["ООО Ромашка"] is meta
+
+
+def test_plate_edits_keep_excel_changes(companies):
+    df = main.read_companies_df()
+    df[main.COL_PLATES] = ["В222ВВ77, А111АА77, М555ММ77"]  # номер дописали в Excel
+    main.write_companies_df(df)
+    assert main.add_company_plates("ооо ромашка", ["С333СС77"])
+    assert main.remove_company_plates("ООО Ромашка", ["А111АА77"])
+    assert main.read_companies_df()[main.COL_PLATES].tolist() == ["В222ВВ77, М555ММ77, С333СС77"]
+    assert set(main.COMPANIES["ООО Ромашка"].plates) == {"В222ВВ77", "М555ММ77", "С333СС77"}
+    assert not main.add_company_plates("ООО Лютик", ["Е444ЕЕ77"])
@@ -0,0 +1,99 @@
+import concurrent.futures
+import csv
+import gzip
+import io
+import json
+from pathlib import Path
+
+import pytest
+
+import main
+
+
+def _no_pool(*args, **kwargs):
+    raise AssertionError("пул процессов для пары файлов не нужен")
+
+
+def test_few_xlsx_parsed_in_process(tmp_path, monkeypatch):
+    paths = [tmp_path / f"наряд_{i}.xlsx" for i in range(3)]
+    for path in paths:
+        path.write_bytes(b"")  # не xlsx — read_order_xlsx вернёт None
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", _no_pool)
+    assert list(main.load_orders(paths, workers=4)) == [(p, None) for p in paths]
+
+
+def test_many_xlsx_go_to_pool(tmp_path, monkeypatch):
+    paths = [tmp_path / f"наряд_{i}.xlsx" for i in range(5)]
+    for path in paths:
+        path.write_bytes(b"")
+    started = []
+    pool_class = concurrent.futures.ProcessPoolExecutor
+
+    def counting_pool(*args, **kwargs):
+        started.append(kwargs)
+        return pool_class(*args, **kwargs)
+
+    monkeypatch.setattr(main, "EXPORT_POOL_MIN_FILES", 2)
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", counting_pool)
+    assert list(main.load_orders(paths, workers=2)) == [(p, None) for p in paths]
+    assert started == [{"max_workers": 2}]
+
+
+def _orders_folder(tmp_path):
+    folder = tmp_path / "orders"
+    folder.mkdir()
+    orders = [
+        ("1", "2026-02-27 10:00", "ООО Ромашка", {"Мойка": (1, 300), "Шиномонтаж": (4, 250)}),
+        ("2", "2026-03-05 12:00", "ИП Петров", {"Балансировка": (2, 400)}),
+    ]
+    for number, created, customer, services in orders:
+        order = {"number": number, "created": created, "customer_display": customer, "plate": "А123ВС77",
+                 "trailer": "", "vehicle_type": "Легковой",
+                 "services": {name: {"qty": q, "price": p, "cost": q * p} for name, (q, p) in services.items()}}
+        (folder / f"наряд_{number}.xlsx").write_bytes(b"")
+        (folder / f"наряд_{number}.json").write_text(json.dumps(order, ensure_ascii=False), encoding="utf-8")
+    return folder
+
+
+@pytest.fixture
+def companies(monkeypatch):
+    monkeypatch.setattr(main, "COMPANIES", {"ООО Ромашка": main.Company(1, "ООО Ромашка", "7701000001")})
+
+
+def test_export_csv(tmp_path, companies):
+    out = tmp_path / "orders.csv"
+    assert main.export_orders(out, folder=_orders_folder(tmp_path)) == 3
+    rows = list(csv.DictReader(io.StringIO(out.read_text(encoding="utf-8-sig")), delimiter=";"))
+    assert [r["service"] for r in rows] == ["Мойка", "Шиномонтаж", "Балансировка"]
+    assert rows[0]["inn"] == "7701000001" and rows[2]["inn"] == ""
+    assert rows[1]["order_total"] == "1300" and rows[1]["date"] == "2026-02-27"
+    assert rows[2]["file"] == "наряд_2.xlsx"
+    assert list(tmp_path.glob(".*.tmp")) == []
+
+
+def test_export_jsonl_gz_by_period(tmp_path, companies):
+    out = tmp_path / "march.jsonl.gz"
+    assert main.export_orders(out, "2026-03-01", "2026-03-31", folder=_orders_folder(tmp_path)) == 1
+    with gzip.open(out, "rt", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f]
+    assert rows == [{"number": "2", "date": "2026-03-05", "customer": "ИП Петров", "inn": "", "plate": "А123ВС77",
+                     "trailer": "", "vehicle_type": "Легковой", "service": "Балансировка", "qty": 2, "price": 400,
+                     "cost": 800, "order_total": 800, "file": "наряд_2.xlsx"}]
+
+
+def test_export_format(tmp_path):
+    assert main._export_format(Path("a.CSV"), None) == ("csv", False)
+    assert main._export_format(Path("a.jsonl.gz"), None) == ("jsonl", True)
+    assert main._export_format(Path("выгрузка"), None) == ("csv", False)
+    assert main._export_format(Path("a.txt"), "parquet") == ("parquet", False)
+    with pytest.raises(ValueError, match="xml"):
+        main.export_orders(tmp_path / "a.xml", folder=tmp_path)
+
+
+def test_export_parquet(tmp_path, companies):
+    pq = pytest.importorskip("pyarrow.parquet")
+    out = tmp_path / "orders.parquet"
+    assert main.export_orders(out, folder=_orders_folder(tmp_path)) == 3
+    table = pq.read_table(out)
+    assert table.column_names == list(main.EXPORT_COLUMNS)
+    assert table.column("cost").to_pylist() == [300.0, 1000.0, 800.0]
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+import main
+
+
+def _order(number, created, customer, plate, services=("Шиномонтаж",), **extra):
+    return {"number": number, "created": created, "customer_display": customer, "plate": plate, "trailer": "",
+            "services": {name: {"qty": 1, "price": 500, "cost": 500} for name in services}, **extra}
+
+
+def _add(index, folder, name, order):
+    xlsx = folder / f"наряд_{name}.xlsx"
+    xlsx.write_bytes(b"")
+    index.add(xlsx, order)
+    return xlsx
+
+
+def test_sync_skips_orders_removed_by_another_sync(tmp_path, monkeypatch):
+    folder = tmp_path / "orders"
+    folder.mkdir()
+    first, second = main.OrderIndex(tmp_path / "index.sqlite"), main.OrderIndex(tmp_path / "index.sqlite")
+    _add(first, folder, "1", _order("1", "2026-03-05", "ООО Ромашка", "А123ВС77")).unlink()
+    load_orders = main.load_orders
+
+    def racing(paths, workers=None):
+        # второй процесс успевает убрать ту же запись, пока первый читает папку
+        monkeypatch.setattr(main, "load_orders", load_orders)
+        assert second.sync(folder) == (0, 1)
+        return load_orders(paths, workers)
+
+    monkeypatch.setattr(main, "load_orders", racing)
+    try:
+        assert first.sync(folder) == (0, 1)
+        assert first.search("") == []
+    finally:
+        first.close()
+        second.close()
+
+
+@pytest.fixture
+def index(tmp_path):
+    folder = tmp_path / "orders"
+    folder.mkdir()
+    index = main.OrderIndex(tmp_path / "index.sqlite")
+    _add(index, folder, "1", _order("1", "2026-02-27 10:00", "ООО Транслогистика", "А123ВС77", defect="стук в подвеске"))
+    _add(index, folder, "2", _order("2", "2026-03-05 12:00", "ИП Петров", "В456ОР199", ("Балансировка",)))
+    _add(index, folder, "3", _order("3", "2026-03-10 09:00", "ООО Транслогистика", "а 123 вс 77", mechanic="Сидоров"))
+    yield index
+    index.close()
+
+
+def _numbers(hits):
+    return [h["number"] for h in hits]
+
+
+def test_search(index):
+    assert _numbers(index.search("транслог")) == ["3", "1"]  # новые сверху
+    assert _numbers(index.search("a123bc")) == ["3", "1"]     # номер латиницей, без региона
+    assert _numbers(index.search("балансир")) == ["2"]
+    assert _numbers(index.search("стук подвеск")) == ["1"]
+    assert _numbers(index.search("сидоров транслогистика")) == ["3"]
+    assert _numbers(index.search("транслог", "2026-03-01", "2026-03-31")) == ["3"]
+    assert _numbers(index.search("")) == ["3", "2", "1"]
+    assert _numbers(index.search("", limit=1)) == ["3"]
+    assert index.search('"кавычки" OR') == []
+    hit = index.search("балансир")[0]
+    assert hit["customer"] == "ИП Петров" and hit["total"] == 500 and "«" in hit["snippet"]
+
+
+def test_last_for_plate(index):
+    assert index.last_for_plate("A123BC 77")["number"] == "3"
+    assert index.last_for_plate("в456ор199")["customer_display"] == "ИП Петров"
+    assert index.last_for_plate("Е001КХ77") is None
+    assert index.last_for_plate("  ") is None
+    assert index.record("наряд_2.xlsx")["number"] == "2"
+
+
+def test_sync_folder(tmp_path):
+    folder = tmp_path / "orders"
+    folder.mkdir()
+    for number in ("1", "2"):
+        (folder / f"наряд_{number}.xlsx").write_bytes(b"")
+        (folder / f"наряд_{number}.json").write_text(
+            json.dumps(_order(number, f"2026-03-0{number}", "ООО Ромашка", "А123ВС77"), ensure_ascii=False), encoding="utf-8")
+    index = main.OrderIndex(tmp_path / "index.sqlite")
+    try:
+        assert index.sync(folder) == (2, 0)
+        assert index.sync(folder) == (0, 0)
+        (folder / "наряд_1.xlsx").unlink()
+        assert index.sync(folder) == (0, 1)
+        assert _numbers(index.search("ромашка")) == ["2"]
+    finally:
+        index.close()
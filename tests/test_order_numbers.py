@@ -0,0 +1,43 @@
+import multiprocessing
+from pathlib import Path
+
+import pytest
+
+import main
+
+
+def test_allocate_and_release(tmp_path):
+    numbers = main.OrderNumbers(tmp_path / "order_numbers.json")
+    assert numbers.allocate("2026") == 1
+    assert numbers.allocate("2026", count=3) == 2
+    assert numbers.allocate("2027") == 1
+    assert numbers.last("2026") == 4
+    assert not numbers.release("2026", 2, count=2)  # после них выдан номер 4 — вернуть нельзя
+    assert numbers.release("2026", 4)
+    assert numbers.allocate("2026") == 4
+    assert main.OrderNumbers(tmp_path / "order_numbers.json").last("2027") == 1
+
+
+def test_broken_file_is_not_reset(tmp_path):
+    path = tmp_path / "order_numbers.json"
+    path.write_text('{"2026": "сорок"}', encoding="utf-8")
+    with pytest.raises(ValueError):
+        main.OrderNumbers(path).allocate("2026")
+    assert path.read_text(encoding="utf-8") == '{"2026": "сорок"}'
+
+
+def _allocate(args):
+    path, count = args
+    numbers = main.OrderNumbers(Path(path))
+    return [numbers.allocate("2026") for _ in range(count)]
+
+
+def test_parallel_processes_get_unique_numbers(tmp_path):
+    # процессы одновременно берут номера из одного файла: ровно 1..N, у каждого — по возрастанию
+    path, processes, per_process = tmp_path / "order_numbers.json", 4, 100
+    with multiprocessing.Pool(processes) as pool:
+        chunks = pool.map(_allocate, [(str(path), per_process)] * processes)
+    total = processes * per_process
+    assert sorted(n for chunk in chunks for n in chunk) == list(range(1, total + 1))
+    assert all(chunk == sorted(chunk) for chunk in chunks)
+    assert main.OrderNumbers(path).last("2026") == total
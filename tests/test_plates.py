@@ -0,0 +1,101 @@
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("А123ВС77", ("А123ВС77", "А123ВС")),
+    ("a 123 bc 77", ("А123ВС77", "А123ВС")),
+    ("A123BC 77 RUS", ("А123ВС77", "А123ВС")),
+    ("х777хх177", ("Х777ХХ177", "Х777ХХ")),
+    ("Прицеп ЕА 1626 66", ("ЕА162666", "ЕА1626")),
+    ("SCANIA S440 М332КР196", ("М332КР196", "М332КР")),
+    ("Трактор 12-34", ("ТРАКТОР1234", "ТРАКТОР1234")),
+])
+def test_canonical_plate(text, expected):
+    assert main.canonical_plate(text) == expected
+
+
+def _index(**companies):
+    return main.PlateIndex.build({name: main.Company(i, name, plates=plates)
+                                  for i, (name, plates) in enumerate(companies.items(), 1)})
+
+
+def test_lookup_any_spelling():
+    index = _index(Ромашка=("А123ВС77", "Прицеп ЕА 1626 66"), Лютик=("В456ОР199",))
+    assert index.lookup("a123bc77") == main.PlateRef("Ромашка", "car", "А123ВС77")
+    assert index.lookup("ЕА1626 66") == main.PlateRef("Ромашка", "trailer", "Прицеп ЕА 1626 66")
+    assert index.lookup("В456ОР199 RUS").company == "Лютик"
+    assert index.lookup("Е001КХ77") is None
+    assert index.lookup("А12") is None  # кусок номера — не полный номер
+
+
+def test_lookup_without_region():
+    index = _index(Ромашка=("А123ВС77",), Лютик=("К321МН77", "К321МН50"), Вега=("О555ОО77",), Бета=("О555ОО50",))
+    assert index.lookup("А123ВС").company == "Ромашка"
+    assert index.lookup("К321МН").company == "Лютик"  # оба региона у одной компании
+    assert index.lookup("О555ОО") is None             # без региона номер неоднозначен
+
+
+def test_remove_company():
+    index = _index(Ромашка=("А123ВС77",), Лютик=("В456ОР199",))
+    index.remove_company("Ромашка")
+    assert index.lookup("А123ВС77") is None
+    assert index.lookup("А123ВС") is None
+    assert index.lookup("В456ОР199").company == "Лютик"
+    index.add_plates("Лютик", ["А123ВС77"])
+    assert index.lookup("А123ВС77").company == "Лютик"
+    assert "А123ВС77" in index.canon_blob["Лютик"]
+
+
+def _table():
+    return main.PlateTable([
+        (2, "В222ВВ77", "car", "2026-01-02"),
+        (1, "Прицеп ЕА 1626 66", "trailer", "2026-01-01"),
+        (1, "А111АА77", "car", "2026-01-01"),
+        (2, "В222ВВ77", "car", "2026-02-02"),  # повтор — остаётся первая запись
+    ])
+
+
+def test_plate_table_sorted_by_company():
+    table = _table()
+    assert len(table) == 3
+    assert table.spans() == {1: (0, 2), 2: (2, 3)}
+    assert table.cell(1) == "А111АА77, Прицеп ЕА 1626 66"
+    assert table.for_company(2) == [main.PlateRecord(2, "В222ВВ77", "car", "2026-01-02")]
+    assert table.company_plates(*table._range(1)) == (("А111АА77", "Прицеп ЕА 1626 66"), 1)
+    assert table.cell(3) == ""
+
+
+def test_plate_table_add_remove():
+    table = _table()
+    assert table.add(1, " Б100ББ77 ", added="2026-03-01")
+    assert not table.add(1, "Б100ББ77")
+    assert not table.add(1, "  ")
+    assert table.cell(1) == "А111АА77, Б100ББ77, Прицеп ЕА 1626 66"
+    assert table.add(1, "Прицеп АА 0001 77")
+    assert {r.plate: r.kind for r in table.for_company(1)}["Прицеп АА 0001 77"] == "trailer"
+    assert table.remove(1, "А111АА77")
+    assert not table.remove(1, "А111АА77")
+    assert table.spans() == {1: (0, 3), 2: (3, 4)}
+
+
+def test_plate_sheet_round_trip():
+    table = _table()
+    rows = [main.PLATE_SHEET_COLUMNS, *table.rows()]
+    assert rows[1] == (1, "А111АА77", "машина", "2026-01-01")
+    assert main.PlateTable.from_rows(rows).records == table.records
+    # порядок столбцов и мусорные строки листа, поправленного руками
+    shuffled = [["Номер", "ID компании", "Тип", "Добавлен"], ["Х1", "нет", "", ""], ["Б2", 5.0, "Прицеп", "2026-01-05"], ["А1", 5, "", ""]]
+    assert main.PlateTable.from_rows(shuffled).records == [
+        main.PlateRecord(5, "А1", "car", ""), main.PlateRecord(5, "Б2", "trailer", "2026-01-05")]
+
+
+def test_reconcile_keeps_known_records():
+    known = _table()
+    table = main.reconcile_plates([1, 2], ["А111АА77, Прицеп АВ 1234 77", ""], known)
+    today = main.datetime.date.today().isoformat()
+    assert table.records == [
+        main.PlateRecord(1, "А111АА77", "car", "2026-01-01"),
+        main.PlateRecord(1, "Прицеп АВ 1234 77", "trailer", today),
+    ]
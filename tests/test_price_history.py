@@ -0,0 +1,25 @@
+import main
+
+
+def _price(value):
+    return {"Легковой": {"Шиномонтаж R15": value}, "Грузовой": {}}
+
+
+def test_older_price_file_gets_own_date(tmp_path):
+    history = main.PriceHistory(tmp_path / "price_history.json")
+    assert history.record("price", _price(1000), "2026-03-01")
+    assert history.record("price", _price(1200), "2026-05-01")
+    assert history.record("price", _price(1100), "2026-04-01")
+    assert not history.record("price", _price(1100), "2026-04-01")
+    assert history.revisions("price") == ["2026-03-01", "2026-04-01", "2026-05-01"]
+    assert [history.as_of("price", day)["Легковой"]["Шиномонтаж R15"]
+            for day in ("2026-03-15", "2026-04-15", "2026-06-01")] == [1000, 1100, 1200]
+
+
+def test_history_shared_between_instances(tmp_path):
+    path = tmp_path / "price_history.json"
+    first, second = main.PriceHistory(path), main.PriceHistory(path)
+    first.as_of("price", "2026-01-01")
+    second.record("price", _price(1000), "2026-03-01")
+    first.record("price", _price(1200), "2026-05-01")
+    assert main.PriceHistory(path).revisions("price") == ["2026-03-01", "2026-05-01"]
@@ -0,0 +1,57 @@
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+import main
+
+TEMPLATE = Path(main.__file__).parent / "templates" / "order_template.xlsx"
+
+
+def test_layout_coordinates():
+    layout = main.TemplateLayout({"cells": {"customer": "I5"},
+                                  "services": {"rows": {"Мойка": 20}, "qty": "BF", "price": "BR", "cost": "CD"}})
+    assert layout.cells == {"customer": (5, 9)}
+    assert layout.services == [("Мойка", ((20, 58), (20, 70), (20, 82)))]
+    assert layout.a5 and not layout.landscape
+    default = main.TemplateLayout(main.DEFAULT_LAYOUT)
+    assert default.services[0] == (main.SERVICES[0], ((13, 58), (13, 70), (13, 82)))
+    with pytest.raises(ValueError, match="неизвестные поля: phone"):
+        main.TemplateLayout({"cells": {"phone": "A1"}})
+
+
+@pytest.fixture
+def registry(tmp_path):
+    shutil.copy(TEMPLATE, tmp_path / "order.xlsx")
+    return main.TemplateRegistry(tmp_path)
+
+
+def test_registry_caches_until_changed(registry, tmp_path):
+    assert registry.names() == ["order"]
+    first = registry.get("order")
+    assert registry.get("order") is first
+    layout = {**main.DEFAULT_LAYOUT, "title": "Наряд (копия)"}
+    (tmp_path / f"order{main.TEMPLATE_LAYOUT_SUFFIX}").write_text(json.dumps(layout, ensure_ascii=False), encoding="utf-8")
+    second = registry.get("order")
+    assert second is not first
+    assert second.version != first.version
+    assert registry.title("order") == "Наряд (копия)"
+    with pytest.raises(FileNotFoundError):
+        registry.get("нет_такого")
+
+
+def test_restore_returns_template_values(registry):
+    tpl = registry.get("order")
+    row, col = tpl.layout.cells["customer"]
+    before = tpl.sheet.cell(row, col).value
+    tpl.sheet.cell(row, col).value = "ООО Ромашка"
+    tpl.restore()
+    assert tpl.sheet.cell(row, col).value == before
+
+
+def test_broken_layout(registry, tmp_path):
+    (tmp_path / f"order{main.TEMPLATE_LAYOUT_SUFFIX}").write_text("{", encoding="utf-8")
+    with pytest.raises(ValueError, match="order"):
+        registry.get("order")
+    assert registry.title("order") == "order"